@@ -1,8 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, status, Request, FastAPI
 from fastapi.security import OAuth2PasswordBearer
 from models import TokenData, User
 import os
@@ -11,15 +10,12 @@ import os
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+CONNECT_STATE_EXPIRE_MINUTES = 10
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Signed OAuth state naming the user a Shopify store is being connected for
+CONNECT_STATE_PURPOSE = "shopify_connect"
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -31,7 +27,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+def create_connect_state(user_id: str) -> str:
+    """Sign the OAuth state for a user connecting a store"""
+    return create_access_token(
+        {"sub": user_id, "purpose": CONNECT_STATE_PURPOSE},
+        timedelta(minutes=CONNECT_STATE_EXPIRE_MINUTES)
+    )
+
+def verify_connect_state(state: str) -> Optional[str]:
+    """Get the user id an OAuth state was signed for, or None if it is not valid"""
+    try:
+        payload = jwt.decode(state, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("purpose") != CONNECT_STATE_PURPOSE:
+        return None
+    return payload.get("sub")
+
+async def authenticate_token(app: FastAPI, token: str) -> User:
+    """Get the user an access token belongs to, raising 401 if it is not valid"""
+    # Tokens verified recently skip both the signature check and the user lookup
+    principal_cache = app.principal_cache
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -40,20 +60,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # Connect states are signed with the same key but are not access tokens
+        if email is None or payload.get("purpose"):
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
     
-    from database import Database
-    db = Database(None, None)  # This will be properly initialized in the router
-    user = await db.get_user_by_email(token_data.email)
+    user = await app.db.get_user_by_email(token_data.email)
     if user is None:
         raise credentials_exception
-    return User(**user)
+    user["_id"] = str(user["_id"])
+    user = User(**user)
+    principal_cache.put(token, user, payload["exp"])
+    return user
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> User:
+    return await authenticate_token(request.app, token)
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user
+
+async def get_current_store_id(current_user: User = Depends(get_current_active_user)) -> str:
+    if not current_user.store_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No store connected")
+    return current_user.store_id 
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""Count MongoDB commands per Database method and per API request.
+
+Needs a running MongoDB; everything is written to a scratch database that is dropped afterwards:
+
+    MONGODB_URL=mongodb://localhost:27017 python -m benchmarks.bench_db_round_trips
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from fastapi import FastAPI
+from typing import Any, Awaitable, Callable, Dict, List
+from datetime import datetime
+from database import Database, ORDER_DIAL_PROJECTION, ID_PROJECTION
+from principal_cache import PrincipalCache
+from auth import create_access_token
+from models import Order, Store, User
+from routers import orders, voice
+import asyncio
+import httpx
+import os
+
+BENCH_DB = "bench_round_trips"
+EMAIL = "bench@example.com"
+
+class CommandCounter(monitoring.CommandListener):
+    """Count commands sent to the server, ignoring driver housekeeping"""
+
+    IGNORED = {"hello", "isMaster", "ismaster", "ping", "endSessions", "killCursors"}
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in self.IGNORED:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+class FakeDialer:
+    """Answers dial requests without calling Twilio"""
+
+    async def dial(self, to: str, order_number: str, store_id: str, claim: Any = None) -> Dict[str, Any]:
+        return {"status": "initiated", "call_sid": "CA-bench", "timestamp": datetime.utcnow()}
+
+async def measure(counter: CommandCounter, label: str, work: Callable[[], Awaitable[Any]]) -> int:
+    before = counter.count
+    result = await work()
+    used = counter.count - before
+    outcome = f"HTTP {result.status_code}" if isinstance(result, httpx.Response) else ""
+    print(f"{label:<52} {used:3d}  {outcome}")
+    return used
+
+def sample_order(store_id: str, number: int) -> Dict[str, Any]:
+    return Order(
+        shopifyOrderId=f"bench-{number}",
+        storeId=store_id,
+        orderNumber=str(number),
+        customerName="Bench Customer",
+        customerPhone="+923001234567",
+        amount=1500.0
+    ).dict(exclude={"id"})
+
+async def main():
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(
+        os.getenv("MONGODB_URL", "mongodb://localhost:27017"),
+        event_listeners=[counter]
+    )
+    await client.drop_database(BENCH_DB)
+    db = Database(client, BENCH_DB)
+    await db.create_indexes()
+
+    try:
+        store = await db.create_store(Store(shopifyDomain="bench.myshopify.com", accessToken="x", webhookSecret="x").dict(exclude={"id"}))
+        store_id = str(store["_id"])
+        user = await db.create_user(User(email=EMAIL, hashed_password="x", store_id=store_id).dict(exclude={"id"}))
+        for number in range(1000, 1050):
+            await db.create_order(sample_order(store_id, number))
+
+        print("Database methods")
+        order_id = str((await db.get_order_by_number(store_id, "1000", ID_PROJECTION))["_id"])
+        await measure(counter, "create_order", lambda: db.create_order(sample_order(store_id, 2000)))
+        await measure(counter, "get_order", lambda: db.get_order(order_id, store_id))
+        await measure(counter, "get_order (dial projection)", lambda: db.get_order(order_id, store_id, ORDER_DIAL_PROJECTION))
+        await measure(counter, "get_orders", lambda: db.get_orders(store_id, 0, 20))
+        await measure(counter, "get_orders_page", lambda: db.get_orders_page(store_id, 20))
+        await measure(counter, "update_order", lambda: db.update_order(order_id, {"status": "called"}, store_id))
+        await measure(
+            counter,
+            "update_order (expected state, not matched)",
+            lambda: db.update_order(order_id, {"status": "called"}, store_id, expected={"status": "pending"})
+        )
+        await measure(counter, "update_order_by_number", lambda: db.update_order_by_number(store_id, "1001", {"status": "called"}))
+        await measure(counter, "create_store", lambda: db.create_store({"shopifyDomain": "other.myshopify.com"}))
+        await measure(counter, "update_store", lambda: db.update_store(store_id, {"voiceSettings": {}}))
+        await measure(counter, "create_user", lambda: db.create_user({"email": "other@example.com"}))
+        await measure(counter, "update_user", lambda: db.update_user(str(user["_id"]), {"is_active": True}))
+
+        app = FastAPI()
+        app.include_router(orders.router, prefix="/api/orders")
+        app.include_router(voice.router, prefix="/api/voice")
+        app.db = db
+        app.principal_cache = PrincipalCache()
+        app.dialer = FakeDialer()
+
+        token = create_access_token({"sub": EMAIL})
+        headers = {"Authorization": f"Bearer {token}"}
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as http:
+            # The first authenticated request fills the principal cache
+            await http.get("/api/orders/")
+
+            print("\nAPI requests")
+            requests: List[Any] = [
+                ("GET /api/orders", lambda: http.get("/api/orders/", params={"limit": 20})),
+                ("GET /api/orders/page", lambda: http.get("/api/orders/page", params={"limit": 20})),
+                ("GET /api/orders/{id}", lambda: http.get(f"/api/orders/{order_id}")),
+                ("PUT /api/orders/{id}/status", lambda: http.put(f"/api/orders/{order_id}/status", params={"status": "pending"})),
+                ("POST /api/orders/{id}/call", lambda: http.post(f"/api/orders/{order_id}/call")),
+                ("POST /api/orders/{id}/call (already calling)", lambda: http.post(f"/api/orders/{order_id}/call")),
+                ("POST /api/voice/.../handle-input (digit 1)", lambda: http.post(
+                    f"/api/voice/{store_id}/handle-input/1002", data={"Digits": "1"}
+                )),
+                ("POST /api/voice/.../handle-input (digit 9)", lambda: http.post(
+                    f"/api/voice/{store_id}/handle-input/1002", data={"Digits": "9"}
+                )),
+                ("GET /api/voice/settings", lambda: http.get("/api/voice/settings")),
+                ("PUT /api/voice/settings", lambda: http.put("/api/voice/settings", json={"language": "ur"})),
+            ]
+            for label, send in requests:
+                await measure(counter, label, send)
+    finally:
+        await client.drop_database(BENCH_DB)
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+"""End-to-end latency of the webhook -> DB -> dial and IVR callback flows, fully offline.
+
+The app runs in process with its real startup. Shopify and Twilio are local HTTP stand-ins,
+and MongoDB is either an in-memory stand-in (needs mongomock-motor) or a scratch database
+that is dropped afterwards. Results are printed as JSON for comparing commits:
+
+    python -m benchmarks.bench_e2e [--orders 200] [--concurrency 20] [--fetch-ratio 0.1]
+    MONGODB_URL=mongodb://localhost:27017 python -m benchmarks.bench_e2e --mongo url --output before.json
+"""
+import os
+
+# Modules read their configuration at import, so the benchmark's defaults go in first
+BENCH_ENV = {
+    "MONGODB_DB": "bench_e2e",
+    "BASE_URL": "https://bench.example.com",
+    "TWILIO_ACCOUNT_SID": "ACbench",
+    "TWILIO_AUTH_TOKEN": "bench-twilio-token",
+    "TWILIO_PHONE_NUMBER": "+15005550006",
+    "SHOPIFY_API_SECRET": "bench-shopify-secret",
+    "TWILIO_CPS": "1000",
+    "DIALER_MAX_IN_FLIGHT": "50",
+    "INGEST_POLL_INTERVAL": "0.05",
+    "ORDER_EVENTS_RETRY_DELAY": "3600"
+}
+for name, value in BENCH_ENV.items():
+    os.environ.setdefault(name, value)
+
+from twilio.request_validator import RequestValidator
+from typing import Any, Awaitable, Callable, Dict, List
+from models import Store
+from benchmarks.fake_services import FakeShopify, FakeTwilio, InMemoryOpCounter, LocalServer, shopify_order
+from benchmarks.bench_db_round_trips import CommandCounter
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import httpx
+import json
+import subprocess
+import sys
+import time
+
+SHOP_DOMAIN = "bench-store.myshopify.com"
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(samples: List[float], elapsed: float, ops: int, requests: int) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds, throughput and MongoDB operations per request"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+        "throughput_per_s": round(len(samples) / elapsed, 1) if elapsed else None,
+        "mongo_ops_per_request": round(ops / requests, 2) if requests else None
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def webhook_headers(body: bytes, number: int) -> Dict[str, str]:
+    digest = hmac.new(os.environ["SHOPIFY_API_SECRET"].encode("utf-8"), body, hashlib.sha256).digest()
+    return {
+        "Content-Type": "application/json",
+        "X-Shopify-Hmac-Sha256": base64.b64encode(digest).decode("utf-8"),
+        "X-Shopify-Topic": "orders/create",
+        "X-Shopify-Shop-Domain": SHOP_DOMAIN,
+        "X-Shopify-Webhook-Id": f"bench-{number}"
+    }
+
+async def bounded(concurrency: int, count: int, flow: Callable[[int], Awaitable[None]]) -> float:
+    """Run flow(0..count-1) with at most `concurrency` in flight and return the wall time"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            await flow(index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(count)))
+    return time.perf_counter() - started
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    import main
+
+    if args.mongo == "memory":
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("The in-memory MongoDB stand-in needs mongomock-motor: pip install mongomock-motor")
+        counter: Any = InMemoryOpCounter()
+        counter.install()
+        main.AsyncIOMotorClient = lambda url: mongomock_motor.AsyncMongoMockClient()
+    else:
+        counter = CommandCounter()
+        scratch = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+        await scratch.drop_database(os.environ["MONGODB_DB"])
+        scratch.close()
+        main.AsyncIOMotorClient = lambda url: AsyncIOMotorClient(url, event_listeners=[counter])
+
+    twilio = FakeTwilio(args.twilio_latency)
+    shopify = FakeShopify(args.shopify_latency)
+    twilio_server, shopify_server = LocalServer(twilio.app), LocalServer(shopify.app)
+    await twilio_server.start()
+    await shopify_server.start()
+
+    app = main.app
+    await main.startup_db_client()
+    try:
+        if args.mongo == "memory":
+            # The stand-in has no change streams; nothing in these flows subscribes anyway
+            await app.order_events.stop()
+
+        # Point the real clients at the stand-ins
+        app.voice_service.client.api.base_url = twilio_server.url
+        pool_get = app.shopify_clients.get
+
+        async def local_shopify_client(shop_url: str, access_token: str):
+            client = await pool_get(shop_url, access_token)
+            client.http.base_url = f"{shopify_server.url}/admin/api/{client.api_version}"
+            return client
+
+        app.shopify_clients.get = local_shopify_client
+        await app.db.create_store(Store(shopifyDomain=SHOP_DOMAIN, accessToken="bench", webhookSecret="bench").dict(exclude={"id"}))
+        store_id = str((await app.db.get_store_by_domain(SHOP_DOMAIN))["_id"])
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="https://bench.example.com") as client:
+            numbers = [args.first_order + index for index in range(args.orders)]
+            # Every n-th payload lacks the customer, so the processor fetches the order from Shopify
+            fetch_every = round(1 / args.fetch_ratio) if args.fetch_ratio else 0
+
+            ack, to_dial = [], []
+            ops_before = counter.count
+
+            async def webhook_flow(index: int):
+                number = numbers[index]
+                payload = shopify_order(number)
+                if fetch_every and index % fetch_every == 0:
+                    payload = {"id": payload["id"], "order_number": number}
+                body = json.dumps(payload).encode("utf-8")
+                dialed = twilio.dialed(str(number))
+                started = time.perf_counter()
+                response = await client.post("/api/shopify/webhook", content=body, headers=webhook_headers(body, number))
+                ack.append(time.perf_counter() - started)
+                response.raise_for_status()
+                call = await asyncio.wait_for(dialed, args.timeout)
+                to_dial.append(call["dialed_at"] - started)
+
+            webhook_elapsed = await bounded(args.concurrency, args.orders, webhook_flow)
+            # Dial results are recorded after the dialer answers; count them with the webhooks
+            await app.webhook_processor.stop()
+            webhook_ops = counter.count - ops_before
+
+            validator = RequestValidator(os.environ["TWILIO_AUTH_TOKEN"])
+            base_url = os.environ["BASE_URL"]
+            ivr: Dict[str, List[float]] = {"status": [], "welcome": [], "input": []}
+            flows: List[float] = []
+            ops_before = counter.count
+
+            async def timed(kind: str, path: str, data: Dict[str, str], signed: bool = False):
+                headers = {}
+                if signed:
+                    headers["X-Twilio-Signature"] = validator.compute_signature(base_url + path, data)
+                started = time.perf_counter()
+                response = await client.post(path, data=data, headers=headers)
+                ivr[kind].append(time.perf_counter() - started)
+                response.raise_for_status()
+
+            async def ivr_flow(index: int):
+                call = twilio.calls[index]
+                number = call["order_number"]
+                status_path = f"/api/voice/{store_id}/status/{call['order_number']}"
+                started = time.perf_counter()
+                for sequence, call_status in enumerate(("initiated", "ringing", "in-progress")):
+                    await timed("status", status_path, {"CallSid": call["sid"], "CallStatus": call_status, "SequenceNumber": str(sequence)}, True)
+                await timed("welcome", f"/api/voice/{store_id}/welcome/{number}", {"CallSid": call["sid"]})
+                await timed("input", f"/api/voice/{store_id}/handle-input/{number}", {"CallSid": call["sid"], "Digits": "1"}, True)
+                await timed("status", status_path, {"CallSid": call["sid"], "CallStatus": "completed", "SequenceNumber": "3", "CallDuration": "21"}, True)
+                flows.append(time.perf_counter() - started)
+
+            ivr_elapsed = await bounded(args.concurrency, len(twilio.calls), ivr_flow)
+            ivr_ops = counter.count - ops_before
+            ivr_requests = sum(len(samples) for samples in ivr.values())
+    finally:
+        if args.mongo == "url":
+            await app.mongodb_client.drop_database(os.environ["MONGODB_DB"])
+        await main.shutdown_db_client()
+        await twilio_server.stop()
+        await shopify_server.stop()
+
+    return {
+        "revision": git_revision(),
+        "config": {
+            "mongo": args.mongo,
+            "orders": args.orders,
+            "concurrency": args.concurrency,
+            "fetch_ratio": args.fetch_ratio,
+            "twilio_latency_s": args.twilio_latency,
+            "shopify_latency_s": args.shopify_latency,
+            "twilio_cps": float(os.environ["TWILIO_CPS"])
+        },
+        "webhook": {
+            "ack": summarize(ack, webhook_elapsed, webhook_ops, len(ack)),
+            "webhook_to_dial": summarize(to_dial, webhook_elapsed, webhook_ops, len(to_dial)),
+            "shopify_fetches": shopify.requests
+        },
+        "ivr": {
+            **{kind: summarize(samples, ivr_elapsed, ivr_ops, ivr_requests) for kind, samples in ivr.items()},
+            "flow": summarize(flows, ivr_elapsed, ivr_ops, len(flows))
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end latency benchmark")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mongo", choices=("memory", "url"), default="memory", help="in-memory stand-in or MONGODB_URL")
+    parser.add_argument("--fetch-ratio", type=float, default=0.1, help="share of webhooks that need a Shopify fetch")
+    parser.add_argument("--twilio-latency", type=float, default=0.0, help="seconds the fake Twilio takes per call")
+    parser.add_argument("--shopify-latency", type=float, default=0.0, help="seconds the fake Shopify takes per request")
+    parser.add_argument("--first-order", type=int, default=1001)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each dial")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measure IVR endpoint latency while a burst of logins runs, with bcrypt inline vs in the process pool.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_login_ivr [--logins 50] [--ivr-requests 200]
+"""
+from fastapi import FastAPI
+from typing import Any, Dict, List, Optional, Tuple
+from password_hasher import PasswordHasher, pwd_context
+from routers import auth, voice
+import argparse
+import asyncio
+import httpx
+import time
+
+EMAIL = "bench@example.com"
+PASSWORD = "correct horse battery staple"
+STORE_ID = "65a1f0c2e4b0a1b2c3d4e5f6"
+
+class InMemoryUsers:
+    """Just enough of Database for the login and IVR routes"""
+
+    def __init__(self, hashed_password: str):
+        self.user = {"_id": "65a1f0c2e4b0a1b2c3d4e5f7", "email": EMAIL, "hashed_password": hashed_password}
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return dict(self.user) if email == EMAIL else None
+
+    async def update_user(self, user_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        self.user.update(update_data)
+        return dict(self.user)
+
+class InlineHasher:
+    """The old behaviour: bcrypt on the event loop"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return pwd_context.verify_and_update(password, hashed_password)
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run(label: str, hasher: Any, hashed_password: str, logins: int, ivr_requests: int):
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/api/auth")
+    app.include_router(voice.router, prefix="/api/voice")
+    app.db = InMemoryUsers(hashed_password)
+    app.password_hasher = hasher
+    await hasher.start()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login() -> int:
+            response = await client.post("/api/auth/token", data={"username": EMAIL, "password": PASSWORD})
+            return response.status_code
+
+        async def ivr() -> List[float]:
+            latencies = []
+            for _ in range(ivr_requests):
+                started = time.perf_counter()
+                response = await client.post(f"/api/voice/{STORE_ID}/welcome/1042")
+                latencies.append((time.perf_counter() - started) * 1000)
+                assert response.status_code == 200
+                await asyncio.sleep(0.005)
+            return latencies
+
+        started = time.perf_counter()
+        results = await asyncio.gather(ivr(), *[login() for _ in range(logins)])
+        elapsed = time.perf_counter() - started
+
+    await hasher.stop()
+    latencies, statuses = results[0], results[1:]
+    print(
+        f"{label:<8} ivr p50 {percentile(latencies, 50):8.1f} ms  p99 {percentile(latencies, 99):8.1f} ms  "
+        f"max {max(latencies):8.1f} ms  logins ok {statuses.count(200)}/{logins}  wall {elapsed:.1f} s"
+    )
+
+async def main(logins: int, ivr_requests: int):
+    hashed_password = pwd_context.hash(PASSWORD)
+    await run("inline", InlineHasher(), hashed_password, logins, ivr_requests)
+    await run("pool", PasswordHasher(queue_timeout=60), hashed_password, logins, ivr_requests)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--ivr-requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.ivr_requests))
@@ -0,0 +1,79 @@
+"""Compare order list serialization: response_model validation + json vs shaped documents + orjson.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_order_serialization
+"""
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+from models import Order
+from serialization import DocumentResponse, order_serializer
+import asyncio
+import json
+import time
+
+STORE_ID = "65a1f0c2e4b0a1b2c3d4e5f6"
+ITERATIONS = 2000
+
+def sample_orders(count: int) -> List[Dict[str, Any]]:
+    """Orders as find() returns them with ORDER_LIST_PROJECTION"""
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "shopifyOrderId": str(5000000000 + number),
+            "storeId": STORE_ID,
+            "orderNumber": str(1000 + number),
+            "customerName": "Ayesha Khan",
+            "customerPhone": "+923001234567",
+            "amount": 2499.0,
+            "status": "pending",
+            "callStatus": "completed",
+            "createdAt": now - timedelta(minutes=number),
+            "lastCallAt": now,
+            "lastCallStatus": "completed",
+            "lastCallDuration": 42,
+            "lastCallEventAt": now,
+            "callAttempts": 2,
+            "retryAttempt": 1
+        }
+        for number in range(count)
+    ]
+
+async def validated(field, orders: List[Dict[str, Any]]) -> bytes:
+    """What FastAPI does for a response_model; _id must already be a string to pass validation"""
+    content = await serialize_response(field=field, response_content=[{**order, "_id": str(order["_id"])} for order in orders])
+    return JSONResponse(content).body
+
+def shaped(orders: List[Dict[str, Any]]) -> bytes:
+    return DocumentResponse(order_serializer.shape_many(orders)).body
+
+async def bench(label: str, fn, rows: int) -> float:
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await fn()
+    per_request = (time.perf_counter() - started) / ITERATIONS * 1e6
+    print(f"{label:<34} {per_request:9.1f} us/response ({rows} rows)")
+    return per_request
+
+async def main():
+    field = create_response_field(name="Response_get_orders", type_=List[Order])
+    for rows in (10, 100):
+        orders = sample_orders(rows)
+
+        # Both paths must produce the same JSON
+        assert json.loads(await validated(field, orders)) == json.loads(shaped(orders))
+
+        async def run_shaped():
+            shaped(orders)
+
+        before = await bench("response_model + json", lambda: validated(field, orders), rows)
+        after = await bench("shaped documents + orjson", run_shaped, rows)
+        print(f"{'':<34} {before / after:9.1f}x faster")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+"""Compare per-request TwiML render time: VoiceResponse builders vs precompiled templates.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_twiml
+"""
+from twiml_templates import TwimlTemplates, build_welcome, build_input_response
+import timeit
+
+ORDER_NUMBER = "1042"
+STORE_ID = "65a1f0c2e4b0a1b2c3d4e5f6"
+ITERATIONS = 20000
+
+def bench(label: str, fn) -> float:
+    seconds = min(timeit.repeat(fn, number=ITERATIONS, repeat=5))
+    per_request = seconds / ITERATIONS * 1e6
+    print(f"{label:<28} {per_request:8.2f} us/request")
+    return per_request
+
+def main():
+    templates = TwimlTemplates()
+
+    # Both paths must produce the same document
+    assert templates.render_welcome(ORDER_NUMBER, STORE_ID) == build_welcome(ORDER_NUMBER, STORE_ID).encode("utf-8")
+    for digit in ("1", "0", "2", "9"):
+        assert templates.render_input(ORDER_NUMBER, STORE_ID, digit) == \
+            build_input_response(ORDER_NUMBER, STORE_ID, digit).encode("utf-8")
+
+    before = bench("welcome (VoiceResponse)", lambda: build_welcome(ORDER_NUMBER, STORE_ID).encode("utf-8"))
+    after = bench("welcome (template)", lambda: templates.render_welcome(ORDER_NUMBER, STORE_ID))
+    print(f"{'':<28} {before / after:8.1f}x faster")
+
+    for digit in ("1", "0", "2", "9"):
+        before = bench(f"input {digit} (VoiceResponse)", lambda: build_input_response(ORDER_NUMBER, STORE_ID, digit).encode("utf-8"))
+        after = bench(f"input {digit} (template)", lambda: templates.render_input(ORDER_NUMBER, STORE_ID, digit))
+        print(f"{'':<28} {before / after:8.1f}x faster")
+
+if __name__ == "__main__":
+    main()
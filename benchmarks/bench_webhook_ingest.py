@@ -0,0 +1,78 @@
+"""Compare webhook body handling: buffered read + per-request HMAC key + json vs one streaming pass + orjson.
+
+The body arrives in 64 KB chunks, the size uvicorn reads from the socket. In the app the parse happens
+in the ingest worker rather than the request, but it is counted here either way. Run from the repository root:
+
+    python -m benchmarks.bench_webhook_ingest
+"""
+import os
+
+os.environ.setdefault("SHOPIFY_API_SECRET", "bench-shopify-secret")
+
+from typing import Any, AsyncIterator, Dict
+from benchmarks.fake_services import shopify_order
+from shopify_service import ShopifyService
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import orjson
+import time
+
+CHUNK_SIZE = 65536
+SIZES_KB = (5, 50, 500)
+
+def order_payload(size_kb: int) -> bytes:
+    """An orders/create body padded with line items to roughly size_kb"""
+    order: Dict[str, Any] = shopify_order(1001)
+    item = {"id": 0, "title": "Lawn suit", "variant_title": "Medium / Blue", "sku": "LS-M-BLU", "quantity": 1,
+            "price": "2499.00", "vendor": "Urdu Threads", "properties": [{"name": "Stitching", "value": "Unstitched"}]}
+    order["line_items"] = []
+    while len(json.dumps(order)) < size_kb * 1024:
+        order["line_items"].append({**item, "id": len(order["line_items"])})
+    return json.dumps(order).encode("utf-8")
+
+async def stream(body: bytes) -> AsyncIterator[bytes]:
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+async def buffered(body: bytes, header: str) -> Any:
+    """The handler before: request.body(), a fresh HMAC key and json.loads"""
+    data = b"".join([chunk async for chunk in stream(body)])
+    calculated = base64.b64encode(
+        hmac.new(os.getenv("SHOPIFY_API_SECRET").encode("utf-8"), data, hashlib.sha256).digest()
+    ).decode("utf-8")
+    assert hmac.compare_digest(calculated, header)
+    return json.loads(data)
+
+async def single_pass(body: bytes, header: str) -> Any:
+    data, digest = await ShopifyService.read_webhook(stream(body))
+    assert ShopifyService.verify_webhook_digest(digest, header)
+    return orjson.loads(data)
+
+async def bench(label: str, fn, body: bytes, header: str, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn(body, header)
+    per_request = (time.perf_counter() - started) / iterations * 1e6
+    print(f"{label:<38} {per_request:10.1f} us/webhook ({len(body) // 1024} KB)")
+    return per_request
+
+async def main():
+    for size_kb in SIZES_KB:
+        body = order_payload(size_kb)
+        header = base64.b64encode(
+            hmac.new(os.environ["SHOPIFY_API_SECRET"].encode("utf-8"), body, hashlib.sha256).digest()
+        ).decode("utf-8")
+
+        # Both paths must accept the signature and produce the same order
+        assert await buffered(body, header) == await single_pass(body, header)
+
+        iterations = max(20, 20000 // size_kb)
+        before = await bench("buffered + json", buffered, body, header, iterations)
+        after = await bench("single pass + orjson", single_pass, body, header, iterations)
+        print(f"{'':<38} {before / after:10.1f}x faster")
+
+if __name__ == "__main__":
+    asyncio.run(main())
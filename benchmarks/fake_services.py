@@ -0,0 +1,132 @@
+"""Local stand-ins for Shopify, Twilio and MongoDB used by the offline benchmarks."""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+import asyncio
+import socket
+import time
+import uuid
+import uvicorn
+
+# Collection methods counted as one MongoDB operation on the in-memory stand-in
+COUNTED_METHODS = (
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_delete", "bulk_write",
+    "aggregate", "count_documents", "estimated_document_count", "distinct"
+)
+
+def shopify_order(number: int) -> Dict[str, Any]:
+    """A Shopify orders/create payload with everything the webhook processor needs"""
+    return {
+        "id": 5000000000 + number,
+        "order_number": number,
+        "name": f"#{number}",
+        "total_price": "2499.00",
+        "phone": "+923001234567",
+        "customer": {"first_name": "Ayesha", "last_name": "Khan", "phone": "+923001234567"},
+        "billing_address": {"name": "Ayesha Khan", "phone": "+923001234567", "city": "Lahore"},
+        "line_items": [{"title": "Lawn suit", "quantity": 1, "price": "2499.00"}]
+    }
+
+class LocalServer:
+    """Serves an ASGI app over real HTTP on an ephemeral localhost port, inside the running loop"""
+
+    def __init__(self, app: FastAPI):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.socket.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off", access_log=False))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self.server.serve(sockets=[self.socket]))
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        self.server.should_exit = True
+        if self._task:
+            await self._task
+
+class FakeTwilio:
+    """Accepts Calls.json like the Twilio REST API and records every dial"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self.app = FastAPI()
+        self.app.add_api_route(
+            "/2010-04-01/Accounts/{account_sid}/Calls.json", self.create_call, methods=["POST"], status_code=201
+        )
+
+    def dialed(self, order_number: str) -> "asyncio.Future[Dict[str, Any]]":
+        """Resolves with the call once the app dials this order"""
+        if order_number not in self._waiters:
+            self._waiters[order_number] = asyncio.get_running_loop().create_future()
+        return self._waiters[order_number]
+
+    async def create_call(self, account_sid: str, request: Request) -> Dict[str, Any]:
+        form = await request.form()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        call = {
+            "sid": f"CA{uuid.uuid4().hex}",
+            "account_sid": account_sid,
+            "to": form.get("To"),
+            "from": form.get("From"),
+            "status": "queued",
+            # The welcome URL ends with the order number
+            "order_number": urlparse(form.get("Url", "")).path.rsplit("/", 1)[-1],
+            "status_callback": form.get("StatusCallback"),
+            "dialed_at": time.perf_counter()
+        }
+        self.calls.append(call)
+        waiter = self.dialed(call["order_number"])
+        if not waiter.done():
+            waiter.set_result(call)
+        return {key: call[key] for key in ("sid", "account_sid", "to", "from", "status")}
+
+class FakeShopify:
+    """Serves order lookups from the Admin REST API with Shopify's rate limit header"""
+
+    def __init__(self, latency: float = 0.0, bucket_size: int = 40):
+        self.latency = latency
+        self.bucket_size = bucket_size
+        self.requests = 0
+        self.app = FastAPI()
+        self.app.add_api_route("/admin/api/{version}/orders/{order_id}.json", self.get_order, methods=["GET"])
+
+    async def get_order(self, version: str, order_id: int) -> JSONResponse:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return JSONResponse(
+            {"order": shopify_order(order_id - 5000000000)},
+            headers={"X-Shopify-Shop-Api-Call-Limit": f"1/{self.bucket_size}"}
+        )
+
+class InMemoryOpCounter:
+    """Counts collection calls on the mongomock stand-in; nested calls inside mongomock count once"""
+
+    def __init__(self):
+        self.count = 0
+        self._depth = 0
+
+    def install(self):
+        from mongomock.collection import Collection
+        for name in COUNTED_METHODS:
+            setattr(Collection, name, self._counted(getattr(Collection, name)))
+
+    def _counted(self, method):
+        def wrapper(*args, **kwargs):
+            if self._depth == 0:
+                self.count += 1
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return wrapper
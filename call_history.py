@@ -0,0 +1,152 @@
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from typing import Dict, Any, Optional, List, Tuple
+from database import Database, ID_PROJECTION, ORDER_STATS_PROJECTION
+from order_stats import OrderStats
+from metrics import metrics
+import base64
+import json
+import os
+
+# Call events per bucket document; a full bucket is never rewritten
+CALL_HISTORY_BUCKET_SIZE = int(os.getenv("CALL_HISTORY_BUCKET_SIZE", "50"))
+
+# Buckets sort newest first by seq; migrated buckets have none and come after, newest _id first
+BUCKET_SORT = [("seq", DESCENDING), ("_id", DESCENDING)]
+
+def encode_history_cursor(bucket: Dict[str, Any], index: int) -> str:
+    """Encode a position inside a bucket as an opaque cursor"""
+    position = {"b": str(bucket["_id"]), "s": bucket.get("seq"), "i": index}
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_history_cursor(cursor: str) -> Tuple[ObjectId, Optional[int], int]:
+    """Decode a cursor produced by encode_history_cursor"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        seq = position.get("s")
+        return ObjectId(position["b"]), None if seq is None else int(seq), int(position["i"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+class CallHistoryStore:
+    """Call events kept in per-order bucket documents, with a summary on the order"""
+
+    def __init__(self, database: Database, stats: Optional[OrderStats], bucket_size: int = CALL_HISTORY_BUCKET_SIZE):
+        self.db = database
+        self.stats = stats
+        self.buckets = database.db.call_events
+        self.bucket_size = bucket_size
+
+    async def create_indexes(self):
+        # Appends look for the open bucket; reads walk an order's buckets newest first
+        await self.buckets.create_index([("orderId", ASCENDING), ("seq", DESCENDING), ("_id", DESCENDING)])
+        # One bucket per sequence number, so racing appends cannot open two buckets
+        await self.buckets.create_index(
+            [("orderId", ASCENDING), ("seq", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"seq": {"$exists": True}}
+        )
+
+    async def append(self, order_id: str, store_id: str, event: Dict[str, Any]) -> None:
+        """Add an event to the order's open bucket, starting a new one when it is full"""
+        while True:
+            # At most one bucket per order is open, so this matches the newest one or none
+            result = await self.buckets.update_one(
+                {"orderId": order_id, "count": {"$lt": self.bucket_size}},
+                {
+                    "$push": {"events": event},
+                    "$inc": {"count": 1},
+                    "$min": {"firstAt": event["timestamp"]},
+                    "$max": {"lastAt": event["timestamp"]}
+                }
+            )
+            if result.matched_count:
+                return
+
+            last = await self.buckets.find_one({"orderId": order_id, "seq": {"$exists": True}}, {"seq": 1}, sort=[("seq", DESCENDING)])
+            try:
+                await self.buckets.insert_one({
+                    "orderId": order_id,
+                    "storeId": store_id,
+                    "seq": last["seq"] + 1 if last else 0,
+                    "events": [event],
+                    "count": 1,
+                    "firstAt": event["timestamp"],
+                    "lastAt": event["timestamp"]
+                })
+                return
+            except DuplicateKeyError:
+                # Another callback opened this bucket first; append to it instead
+                metrics.incr("call_history.bucket_races")
+
+    async def record_event(
+        self,
+        store_id: str,
+        order_number: str,
+        call_sid: str,
+        summary: Dict[str, Any],
+        event: Dict[str, Any],
+        sequence: Optional[int] = None,
+        new_attempt: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Apply a Twilio call status callback to the order summary and store the event"""
+        query: Dict[str, Any] = {"storeId": store_id, "orderNumber": order_number}
+        if new_attempt:
+            # The first callback of a new call may beat the dial result that records its CallSid
+            query["$or"] = [{"call_sid": call_sid}, {"callStatus": "calling"}]
+        else:
+            # Callbacks of an earlier call must not overwrite the summary of the current one
+            query["call_sid"] = call_sid
+        fields = {"call_sid": call_sid, "lastCallStatus": event["status"], "lastCallEventAt": event["timestamp"], **summary}
+        if sequence is not None:
+            # Twilio may deliver callbacks out of order; never go back to an earlier one for the same call
+            query["$nor"] = [{"call_sid": call_sid, "callSequence": {"$gte": sequence}}]
+            fields["callSequence"] = sequence
+        update: Dict[str, Any] = {"$set": fields}
+        if new_attempt:
+            update["$inc"] = {"callAttempts": 1}
+
+        # The previous state lets the rollup move the order between callStatus counters
+        order = await self.db.orders.find_one_and_update(
+            query, update, projection={"retryAttempt": 1, **ORDER_STATS_PROJECTION}, return_document=ReturnDocument.BEFORE
+        )
+        if order is not None and self.stats:
+            await self.stats.record_change(order, fields)
+        if order is None:
+            # A late or stale callback still belongs in the history
+            order = await self.db.get_order_by_number(store_id, order_number, ID_PROJECTION)
+            if order is None:
+                return None
+            metrics.incr("voice.stale_status_callbacks")
+
+        await self.append(str(order["_id"]), store_id, event)
+        return order
+
+    async def get_page(
+        self,
+        order_id: str,
+        limit: int = 20,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get an order's call events newest first, with a cursor for the next page"""
+        query: Dict[str, Any] = {"orderId": order_id}
+        bucket_id, end = None, None
+        if cursor:
+            bucket_id, seq, end = decode_history_cursor(cursor)
+            if seq is None:
+                query.update({"seq": None, "_id": {"$lte": bucket_id}})
+            else:
+                query["$or"] = [{"seq": {"$lte": seq}}, {"seq": None}]
+
+        events: List[Dict[str, Any]] = []
+        buckets = self.buckets.find(query, {"events": 1, "seq": 1}).sort(BUCKET_SORT)
+        async for bucket in buckets:
+            # Events are appended in order, so an index from the start stays valid as the bucket grows
+            stop = end if bucket["_id"] == bucket_id else len(bucket["events"])
+            for index in range(stop - 1, -1, -1):
+                if len(events) == limit:
+                    await buckets.close()
+                    return events, encode_history_cursor(bucket, index + 1)
+                events.append(bucket["events"][index])
+        return events, None
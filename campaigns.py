@@ -0,0 +1,347 @@
+from pymongo import ASCENDING, UpdateOne, ReturnDocument
+from bson import ObjectId
+from typing import Dict, Any, Optional, List, Set
+from datetime import datetime, timedelta
+from database import Database, new_dial_owner, dial_claim_fields, dial_claimable, DIAL_CLAIM_LEASE, DIAL_CLAIM_FIELDS
+from dialer import Dialer, TokenBucket, record_call_result
+from order_stats import OrderStats
+from retry_scheduler import RetryScheduler
+from models import Campaign, CampaignCreate, CampaignState
+from metrics import metrics
+import asyncio
+import socket
+import uuid
+import time
+import os
+
+# Campaign runner configuration
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "50"))
+CAMPAIGN_POLL_INTERVAL = float(os.getenv("CAMPAIGN_POLL_INTERVAL", "5"))  # seconds
+CAMPAIGN_RUNNER_LEASE = int(os.getenv("CAMPAIGN_RUNNER_LEASE", "60"))  # seconds
+
+# An expired lease that any runner can take over
+LEASE_EXPIRED = datetime(1970, 1, 1)
+
+class CampaignManager:
+    """Run bulk calling campaigns over orders selected by a filter"""
+
+    def __init__(
+        self,
+        db: Database,
+        dialer: Dialer,
+        order_stats: OrderStats,
+        retry_scheduler: RetryScheduler,
+        batch_size: int = CAMPAIGN_BATCH_SIZE,
+        poll_interval: float = CAMPAIGN_POLL_INTERVAL,
+        runner_lease: int = CAMPAIGN_RUNNER_LEASE
+    ):
+        self.db = db
+        self.dialer = dialer
+        self.order_stats = order_stats
+        self.retry_scheduler = retry_scheduler
+        self.campaigns = db.db.campaigns
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.runner_lease = runner_lease
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._runners: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def create_indexes(self):
+        await self.campaigns.create_index([("state", ASCENDING), ("leaseUntil", ASCENDING)])
+        await self.campaigns.create_index([("storeId", ASCENDING), ("createdAt", -1)])
+        await self.db.orders.create_index("campaignId", sparse=True)
+        await self.db.orders.create_index("campaignClaim", sparse=True)
+
+    @staticmethod
+    def build_filter(request: CampaignCreate) -> Dict[str, Any]:
+        """Translate a campaign request into an orders query"""
+        query: Dict[str, Any] = {}
+        if request.status:
+            query["status"] = request.status.value
+        if request.callStatus:
+            query["callStatus"] = request.callStatus.value
+        if request.storeId:
+            query["storeId"] = request.storeId
+        if request.createdFrom or request.createdTo:
+            query["createdAt"] = {}
+            if request.createdFrom:
+                query["createdAt"]["$gte"] = request.createdFrom
+            if request.createdTo:
+                query["createdAt"]["$lt"] = request.createdTo
+        return query
+
+    async def create(self, request: CampaignCreate) -> Dict[str, Any]:
+        """Create a campaign; a runner picks it up immediately"""
+        campaign = Campaign(
+            storeId=request.storeId,
+            filter=self.build_filter(request),
+            targetCps=request.targetCps
+        )
+        doc = campaign.dict(exclude={"id"})
+        doc["leaseUntil"] = LEASE_EXPIRED
+        result = await self.campaigns.insert_one(doc)
+        doc["_id"] = result.inserted_id
+        await self._acquire_runners()
+        return doc
+
+    async def get(self, campaign_id: str, store_id: str) -> Optional[Dict[str, Any]]:
+        """Get a campaign and its progress"""
+        return await self.campaigns.find_one({"_id": ObjectId(campaign_id), "storeId": store_id})
+
+    async def get_campaigns(self, store_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get the store's most recent campaigns"""
+        cursor = self.campaigns.find({"storeId": store_id}).sort("createdAt", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def set_state(
+        self,
+        campaign_id: str,
+        state: CampaignState,
+        from_states: List[CampaignState],
+        store_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Move a campaign to a new state if it is currently in one of `from_states`"""
+        query: Dict[str, Any] = {"_id": ObjectId(campaign_id), "state": {"$in": [s.value for s in from_states]}}
+        if store_id:
+            query["storeId"] = store_id
+        return await self.campaigns.find_one_and_update(
+            query,
+            {"$set": {"state": state.value, "updatedAt": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def pause(self, campaign_id: str, store_id: str) -> Optional[Dict[str, Any]]:
+        return await self.set_state(campaign_id, CampaignState.PAUSED, [CampaignState.RUNNING], store_id)
+
+    async def resume(self, campaign_id: str, store_id: str) -> Optional[Dict[str, Any]]:
+        return await self.set_state(campaign_id, CampaignState.RUNNING, [CampaignState.PAUSED], store_id)
+
+    async def cancel(self, campaign_id: str, store_id: str) -> Optional[Dict[str, Any]]:
+        return await self.set_state(
+            campaign_id,
+            CampaignState.CANCELLED,
+            [CampaignState.RUNNING, CampaignState.PAUSED],
+            store_id
+        )
+
+    async def record_outcome(self, campaign_id: str, digit: str) -> None:
+        """Count an IVR answer from a campaign call"""
+        inc = {"counts.answered": 1}
+        if digit == "1":
+            inc["counts.confirmed"] = 1
+        elif digit == "0":
+            inc["counts.cancelled"] = 1
+        await self.campaigns.update_one({"_id": ObjectId(campaign_id)}, {"$inc": inc})
+
+    async def claim_batch(self, campaign: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Claim the next batch of matching orders for a campaign, or get None once none are left"""
+        campaign_id = str(campaign["_id"])
+        query = {**campaign["filter"], "campaignId": {"$ne": campaign_id}}
+        claimable = dial_claimable(datetime.utcnow())
+        cursor = self.db.orders.find(
+            {"$and": [query, claimable]},
+            {"storeId": 1, "createdAt": 1, "callStatus": 1, "campaignId": 1}
+        ).sort("createdAt", ASCENDING).limit(self.batch_size)
+        candidates = {order["_id"]: order async for order in cursor}
+        if not candidates:
+            return None
+
+        # Each claim re-checks the filter, the lease and the callStatus it was read with, so concurrent
+        # campaigns and calls cannot take the same order and the rollup moves the right count
+        token = uuid.uuid4().hex
+        await self.db.orders.bulk_write([
+            UpdateOne(
+                {"_id": order_id, "$and": [query, claimable, {"callStatus": order.get("callStatus")}]},
+                {"$set": {"campaignId": campaign_id, "campaignClaim": token, **dial_claim_fields(new_dial_owner())}}
+            )
+            for order_id, order in candidates.items()
+        ], ordered=False)
+        claimed = await self.db.orders.find(
+            {"campaignClaim": token},
+            {"customerPhone": 1, "orderNumber": 1, "storeId": 1, "retryAttempt": 1, "campaignClaim": 1, "dialOwner": 1}
+        ).to_list(length=self.batch_size)
+        if claimed:
+            # Each order keeps what it was claimed from, so an undialed claim can be released as it was
+            for order in claimed:
+                order["before"] = candidates[order["_id"]]
+            await self.order_stats.record_changes(
+                [order["before"] for order in claimed], {"callStatus": "calling"}
+            )
+            await self.campaigns.update_one(
+                {"_id": campaign["_id"]},
+                {"$inc": {"counts.queued": len(claimed)}}
+            )
+        return claimed
+
+    async def release_batch(self, campaign: Dict[str, Any], orders: List[Dict[str, Any]]) -> int:
+        """Give back claimed orders that were never dialed, as they were before the claim"""
+        released: Dict[str, List[Dict[str, Any]]] = {}
+        for order in orders:
+            before = order["before"]
+            update: Dict[str, Any] = {
+                "$set": {"callStatus": before.get("callStatus")},
+                "$unset": {name: "" for name in ("campaignClaim", *DIAL_CLAIM_FIELDS)}
+            }
+            if before.get("campaignId"):
+                update["$set"]["campaignId"] = before["campaignId"]
+            else:
+                update["$unset"]["campaignId"] = ""
+            # A claim already taken over after its lease ran out belongs to someone else
+            result = await self.db.orders.update_one({"_id": order["_id"], "dialOwner": order["dialOwner"]}, update)
+            if result.matched_count:
+                released.setdefault(before.get("callStatus"), []).append({**before, "callStatus": "calling"})
+
+        count = sum(len(befores) for befores in released.values())
+        for call_status, befores in released.items():
+            await self.order_stats.record_changes(befores, {"callStatus": call_status})
+        if count:
+            await self.campaigns.update_one({"_id": campaign["_id"]}, {"$inc": {"counts.queued": -count}})
+            metrics.incr("campaigns.released", count)
+        return count
+
+    async def _is_running(self, campaign_id: str) -> bool:
+        campaign = await self.campaigns.find_one({"_id": ObjectId(campaign_id)}, {"state": 1})
+        return bool(campaign) and campaign["state"] == CampaignState.RUNNING.value
+
+    def start(self):
+        """Start acquiring runnable campaigns"""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop acquiring campaigns and wait for local runners"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+        await asyncio.gather(*self._runners.values(), return_exceptions=True)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self._acquire_runners()
+            except Exception as e:
+                print(f"Error acquiring campaigns: {str(e)}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire_runners(self):
+        # Take over running campaigns whose runner lease expired
+        while not self._stopping.is_set():
+            now = datetime.utcnow()
+            campaign = await self.campaigns.find_one_and_update(
+                {"state": CampaignState.RUNNING.value, "leaseUntil": {"$lt": now}},
+                {"$set": {
+                    "runnerId": self.runner_id,
+                    "leaseUntil": now + timedelta(seconds=self.runner_lease)
+                }},
+                return_document=ReturnDocument.AFTER
+            )
+            if not campaign:
+                return
+            campaign_id = str(campaign["_id"])
+            if campaign_id not in self._runners or self._runners[campaign_id].done():
+                self._runners[campaign_id] = asyncio.create_task(self._run_campaign(campaign_id))
+
+    async def _renew(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        return await self.campaigns.find_one_and_update(
+            {"_id": ObjectId(campaign_id), "runnerId": self.runner_id},
+            {"$set": {"leaseUntil": datetime.utcnow() + timedelta(seconds=self.runner_lease)}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_claims(self, token: str) -> None:
+        # Orders of a slow batch wait longer than a dial claim lasts before they are dialed
+        await self.db.orders.update_many(
+            {"campaignClaim": token},
+            {"$set": {"dialLeaseUntil": datetime.utcnow() + timedelta(seconds=DIAL_CLAIM_LEASE)}}
+        )
+
+    async def _run_campaign(self, campaign_id: str):
+        pending: Set[asyncio.Task] = set()
+        bucket: Optional[TokenBucket] = None
+        campaign: Optional[Dict[str, Any]] = None
+        # Claimed orders of the current batch not yet handed to the dialer
+        undialed: List[Dict[str, Any]] = []
+        try:
+            while not self._stopping.is_set():
+                campaign = await self._renew(campaign_id)
+                if not campaign or campaign["state"] in (CampaignState.CANCELLED.value, CampaignState.COMPLETED.value):
+                    return
+                if campaign["state"] == CampaignState.PAUSED.value:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if bucket is None or bucket.rate != campaign["targetCps"]:
+                    bucket = TokenBucket(campaign["targetCps"])
+
+                batch = await self.claim_batch(campaign)
+                if batch is None:
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    await self.set_state(campaign_id, CampaignState.COMPLETED, [CampaignState.RUNNING])
+                    return
+                if not batch:
+                    # Concurrent claimers took every candidate; the next query finds what is left
+                    continue
+
+                renewed_at = checked_at = time.monotonic()
+                undialed = list(batch)
+                while undialed:
+                    order = undialed[0]
+                    # Slow campaigns can take longer than the lease to dispatch a batch
+                    if time.monotonic() - renewed_at > self.runner_lease / 2:
+                        await self._renew(campaign_id)
+                        await self._renew_claims(order["campaignClaim"])
+                        renewed_at = time.monotonic()
+                    # Pause and cancel take effect within a second, not at the end of the batch
+                    if time.monotonic() - checked_at >= 1:
+                        if self._stopping.is_set() or not await self._is_running(campaign_id):
+                            break
+                        checked_at = time.monotonic()
+                    await bucket.acquire()
+                    future = await self.dialer.submit(
+                        order["customerPhone"], order["orderNumber"], order["storeId"], (str(order["_id"]), order["dialOwner"])
+                    )
+                    undialed.pop(0)
+                    task = asyncio.create_task(self._record_call(campaign["_id"], order, future))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                if undialed:
+                    await self.release_batch(campaign, undialed)
+                    undialed = []
+        except Exception as e:
+            print(f"Error running campaign {campaign_id}: {str(e)}")
+        finally:
+            if undialed:
+                try:
+                    await self.release_batch(campaign, undialed)
+                except Exception as e:
+                    # Their dial claims run out and the retry sweep picks them up
+                    print(f"Error releasing orders of campaign {campaign_id}: {str(e)}")
+            await asyncio.gather(*pending, return_exceptions=True)
+            # Let another runner take over right away if the campaign is still running
+            await self.campaigns.update_one(
+                {"_id": ObjectId(campaign_id), "runnerId": self.runner_id},
+                {"$set": {"leaseUntil": LEASE_EXPIRED}}
+            )
+
+    async def _record_call(self, campaign_oid: ObjectId, order: Dict[str, Any], future: asyncio.Future):
+        try:
+            call = await future
+        except Exception as e:
+            call = {"error": str(e), "status": "failed", "timestamp": datetime.utcnow()}
+        # A call skipped because its claim expired was never dialed
+        failed = call["status"] in ("failed", "skipped")
+        await record_call_result(
+            self.db, self.order_stats, str(order["_id"]), call,
+            unset=("campaignClaim", *DIAL_CLAIM_FIELDS), owner=order["dialOwner"]
+        )
+        if call["status"] == "failed":
+            await self.retry_scheduler.schedule_next(order)
+        await self.campaigns.update_one(
+            {"_id": campaign_oid},
+            {"$inc": {"counts.failed" if failed else "counts.dialed": 1}}
+        )
+        metrics.incr("campaigns.failed" if failed else "campaigns.dialed")
@@ -1,7 +1,61 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from fastapi import Request
 from bson import ObjectId
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+from datetime import datetime, timedelta
+from serialization import order_serializer
+import base64
+import json
+import socket
+import uuid
+import os
+
+# Filtered counts stop here so the estimate stays cheap on large collections
+ORDER_COUNT_LIMIT = 10000
+
+# Per-call-site projections; order responses read only the fields of the Order model
+ORDER_LIST_PROJECTION = order_serializer.projection
+ORDER_STATS_PROJECTION = {"storeId": 1, "createdAt": 1, "status": 1, "callStatus": 1}
+ORDER_DIAL_PROJECTION = {"customerPhone": 1, "orderNumber": 1, "retryAttempt": 1, **ORDER_STATS_PROJECTION}
+ID_PROJECTION = {"_id": 1}
+
+# An order being dialed is "calling" with a claim owner and lease; a lease that runs out means the
+# owner died before recording the dial, and the claim can be taken over
+DIAL_CLAIM_LEASE = int(os.getenv("DIAL_CLAIM_LEASE", "300"))  # seconds; the dialer renews it while a dial is queued
+DIAL_CLAIM_FIELDS = ("dialOwner", "dialLeaseUntil")
+
+def new_dial_owner() -> str:
+    """A unique claim owner that names the worker holding it"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+def dial_claim_fields(owner: str, lease: int = DIAL_CLAIM_LEASE) -> Dict[str, Any]:
+    """Order fields that claim it for one dial"""
+    return {"callStatus": "calling", "dialOwner": owner, "dialLeaseUntil": datetime.utcnow() + timedelta(seconds=lease)}
+
+def dial_owner_filter(order_id: str, owner: Optional[str] = None) -> Dict[str, Any]:
+    """Match an order, and only while `owner` still holds its dial claim when given"""
+    query: Dict[str, Any] = {"_id": ObjectId(order_id)}
+    if owner:
+        query["dialOwner"] = owner
+    return query
+
+def dial_claimable(now: datetime) -> Dict[str, Any]:
+    """Orders nobody is calling, or whose dial claim outlived its lease"""
+    return {"$or": [{"callStatus": {"$ne": "calling"}}, {"dialLeaseUntil": {"$lt": now}}]}
+
+def encode_cursor(order: Dict[str, Any]) -> str:
+    """Encode an order's (createdAt, _id) position as an opaque cursor"""
+    position = {"t": order["createdAt"].isoformat(), "i": str(order["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(position["t"]), ObjectId(position["i"])
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 class Database:
     def __init__(self, client: AsyncIOMotorClient, db_name: str):
@@ -12,12 +66,18 @@ class Database:
         self.users = self.db.users
 
     async def create_indexes(self):
-        # Create indexes for orders collection
+        # Create indexes for orders collection, one per dashboard query shape
         await self.orders.create_index("shopifyOrderId", unique=True)
-        await self.orders.create_index("orderNumber")
-        await self.orders.create_index("status")
-        await self.orders.create_index("callStatus")
-        await self.orders.create_index("createdAt")
+        await self.orders.create_index([("storeId", 1), ("createdAt", -1), ("_id", -1)])
+        await self.orders.create_index([("storeId", 1), ("status", 1), ("createdAt", -1), ("_id", -1)])
+        await self.orders.create_index([("storeId", 1), ("callStatus", 1), ("createdAt", -1), ("_id", -1)])
+        await self.orders.create_index(
+            [("storeId", 1), ("orderNumber", 1)],
+            unique=True,
+            partialFilterExpression={"storeId": {"$type": "string"}}
+        )
+        # Only orders with a dial or call in flight carry a lease
+        await self.orders.create_index("dialLeaseUntil", sparse=True)
 
         # Create indexes for stores collection
         await self.stores.create_index("shopifyDomain", unique=True)
@@ -27,67 +87,239 @@ class Database:
         await self.users.create_index("email", unique=True)
         await self.users.create_index("store_id")
 
-    async def get_order(self, order_id: str) -> Optional[Dict[str, Any]]:
-        return await self.orders.find_one({"_id": ObjectId(order_id)})
+    @staticmethod
+    def order_filter(
+        store_id: str,
+        status: Optional[str] = None,
+        call_status: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Build the store-scoped orders filter shared by list, page and count queries"""
+        query: Dict[str, Any] = {"storeId": store_id}
+        if status:
+            query["status"] = status
+        if call_status:
+            query["callStatus"] = call_status
+        return query
+
+    @staticmethod
+    def order_id_filter(order_id: str, store_id: Optional[str] = None) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"_id": ObjectId(order_id)}
+        if store_id:
+            query["storeId"] = store_id
+        return query
+
+    async def get_order(
+        self,
+        order_id: str,
+        store_id: Optional[str] = None,
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        return await self.orders.find_one(self.order_id_filter(order_id, store_id), projection)
+
+    async def get_order_by_number(
+        self,
+        store_id: str,
+        order_number: str,
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        return await self.orders.find_one({"storeId": store_id, "orderNumber": order_number}, projection)
 
     async def get_orders(
         self,
+        store_id: str,
         skip: int = 0,
         limit: int = 10,
         status: Optional[str] = None,
         call_status: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        query = {}
-        if status:
-            query["status"] = status
-        if call_status:
-            query["callStatus"] = call_status
-
-        cursor = self.orders.find(query).skip(skip).limit(limit).sort("createdAt", -1)
+        query = self.order_filter(store_id, status, call_status)
+        cursor = self.orders.find(query, ORDER_LIST_PROJECTION).skip(skip).limit(limit).sort([("createdAt", -1), ("_id", -1)])
         return await cursor.to_list(length=limit)
 
+    async def get_orders_page(
+        self,
+        store_id: str,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        call_status: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = self.order_filter(store_id, status, call_status)
+        if cursor:
+            created_at, order_id = decode_cursor(cursor)
+            # The $lte bound keeps the index scan tight; $or breaks createdAt ties on _id
+            query["createdAt"] = {"$lte": created_at}
+            query["$or"] = [
+                {"createdAt": {"$lt": created_at}},
+                {"_id": {"$lt": order_id}}
+            ]
+
+        # Fetch one extra document to know whether another page exists
+        docs = await self.orders.find(query, ORDER_LIST_PROJECTION).sort(
+            [("createdAt", -1), ("_id", -1)]
+        ).limit(limit + 1).to_list(length=limit + 1)
+        next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+        return docs[:limit], next_cursor
+
+    async def estimate_order_count(
+        self,
+        store_id: str,
+        status: Optional[str] = None,
+        call_status: Optional[str] = None
+    ) -> int:
+        query = self.order_filter(store_id, status, call_status)
+        return await self.orders.count_documents(query, limit=ORDER_COUNT_LIMIT)
+
     async def create_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
-        result = await self.orders.insert_one(order_data)
-        return await self.get_order(str(result.inserted_id))
+        # insert_one sets _id on the document, so there is nothing to read back
+        await self.orders.insert_one(order_data)
+        return order_data
+
+    async def _update_one_order(
+        self,
+        query: Dict[str, Any],
+        update_data: Dict[str, Any],
+        expected: Optional[Dict[str, Any]],
+        projection: Optional[Dict[str, int]],
+        return_previous: bool
+    ) -> Optional[Dict[str, Any]]:
+        if expected:
+            query.update(expected)
+        return await self.orders.find_one_and_update(
+            query,
+            {"$set": update_data},
+            projection=projection,
+            return_document=ReturnDocument.BEFORE if return_previous else ReturnDocument.AFTER
+        )
+
+    async def update_order(
+        self,
+        order_id: str,
+        update_data: Dict[str, Any],
+        store_id: Optional[str] = None,
+        expected: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, int]] = None,
+        return_previous: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Update an order and get it back, or None if it is missing or not in the expected state"""
+        return await self._update_one_order(
+            self.order_id_filter(order_id, store_id), update_data, expected, projection, return_previous
+        )
 
-    async def update_order(self, order_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        await self.orders.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": update_data}
+    async def update_order_by_number(
+        self,
+        store_id: str,
+        order_number: str,
+        update_data: Dict[str, Any],
+        expected: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, int]] = None,
+        return_previous: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Update an order found by its store-scoped number and get it back"""
+        return await self._update_one_order(
+            {"storeId": store_id, "orderNumber": order_number}, update_data, expected, projection, return_previous
+        )
+
+    async def claim_order_for_dial(
+        self,
+        order_id: str,
+        owner: str,
+        store_id: Optional[str] = None,
+        expected: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Atomically claim an order for one dial and get it as it was, or None if it is missing, being called or not as expected"""
+        conditions = [self.order_id_filter(order_id, store_id), dial_claimable(datetime.utcnow())]
+        if expected:
+            conditions.append(expected)
+        return await self.orders.find_one_and_update(
+            {"$and": conditions},
+            {"$set": dial_claim_fields(owner)},
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def renew_dial_claim(self, order_id: str, owner: str) -> bool:
+        """Extend a dial claim's lease, or return False if `owner` no longer holds it"""
+        result = await self.orders.update_one(
+            dial_owner_filter(order_id, owner),
+            {"$set": {"dialLeaseUntil": datetime.utcnow() + timedelta(seconds=DIAL_CLAIM_LEASE)}}
+        )
+        return result.matched_count == 1
+
+    async def renew_dial_claims(self, claims: List[Tuple[str, str]]) -> None:
+        """Extend the leases of many (order id, owner) claims in one update"""
+        # Owners are unique per claim, so an order whose owner is in the set is still held by one of them
+        await self.orders.update_many(
+            {
+                "_id": {"$in": [ObjectId(order_id) for order_id, _ in claims]},
+                "dialOwner": {"$in": [owner for _, owner in claims]}
+            },
+            {"$set": {"dialLeaseUntil": datetime.utcnow() + timedelta(seconds=DIAL_CLAIM_LEASE)}}
         )
-        return await self.get_order(order_id)
 
-    async def get_store(self, store_id: str) -> Optional[Dict[str, Any]]:
-        return await self.stores.find_one({"_id": ObjectId(store_id)})
+    async def get_store(self, store_id: str, projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        return await self.stores.find_one({"_id": ObjectId(store_id)}, projection)
 
     async def get_store_by_domain(self, domain: str) -> Optional[Dict[str, Any]]:
         return await self.stores.find_one({"shopifyDomain": domain})
 
     async def create_store(self, store_data: Dict[str, Any]) -> Dict[str, Any]:
-        result = await self.stores.insert_one(store_data)
-        return await self.get_store(str(result.inserted_id))
+        await self.stores.insert_one(store_data)
+        return store_data
+
+    async def connect_store(self, domain: str, credentials: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """Save a shop's credentials, creating its store with `defaults` on first install"""
+        return await self.stores.find_one_and_update(
+            {"shopifyDomain": domain},
+            {"$set": {**credentials, "updatedAt": datetime.utcnow()}, "$setOnInsert": defaults},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
 
-    async def update_store(self, store_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def update_store(
+        self,
+        store_id: str,
+        update_data: Dict[str, Any],
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
         update_data["updatedAt"] = datetime.utcnow()
-        await self.stores.update_one(
+        return await self.stores.find_one_and_update(
             {"_id": ObjectId(store_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=projection,
+            return_document=ReturnDocument.AFTER
         )
-        return await self.get_store(store_id)
 
-    async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
-        return await self.users.find_one({"_id": ObjectId(user_id)})
+    async def delete_store(self, store_id: str) -> bool:
+        result = await self.stores.delete_one({"_id": ObjectId(store_id)})
+        return result.deleted_count == 1
+
+    async def get_user(self, user_id: str, projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        if not ObjectId.is_valid(user_id):
+            return None
+        return await self.users.find_one({"_id": ObjectId(user_id)}, projection)
 
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         return await self.users.find_one({"email": email})
 
     async def create_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
-        result = await self.users.insert_one(user_data)
-        return await self.get_user(str(result.inserted_id))
+        await self.users.insert_one(user_data)
+        return user_data
 
-    async def update_user(self, user_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        await self.users.update_one(
+    async def update_user(
+        self,
+        user_id: str,
+        update_data: Dict[str, Any],
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        return await self.users.find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection=projection,
+            return_document=ReturnDocument.AFTER
         )
-        return await self.get_user(user_id) 
\ No newline at end of file
+
+def get_database(request: Request) -> Database:
+    """Get the app-scoped database created at startup"""
+    return request.app.db
\ No newline at end of file
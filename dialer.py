@@ -0,0 +1,243 @@
+from twilio.base.exceptions import TwilioRestException
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+from datetime import datetime, timedelta
+from database import Database, dial_owner_filter, DIAL_CLAIM_LEASE, ORDER_STATS_PROJECTION
+from voice_service import VoiceService, TWILIO_CPS, CALL_TIME_LIMIT
+from order_stats import OrderStats
+from metrics import metrics
+import asyncio
+import random
+import os
+import time
+
+# Dialer configuration
+DIALER_MAX_IN_FLIGHT = int(os.getenv("DIALER_MAX_IN_FLIGHT", "10"))
+DIALER_QUEUE_SIZE = int(os.getenv("DIALER_QUEUE_SIZE", "1000"))
+DIALER_MAX_RETRIES = int(os.getenv("DIALER_MAX_RETRIES", "3"))
+DIALER_RETRY_BASE_DELAY = float(os.getenv("DIALER_RETRY_BASE_DELAY", "1"))  # seconds
+
+# A placed call keeps the order "calling" until its final status callback; past this lease the callback
+# was lost, and the order is failed and retried. It must outlast queueing, ringing and CALL_TIME_LIMIT
+DIAL_CALL_LEASE = int(os.getenv("DIAL_CALL_LEASE", str(CALL_TIME_LIMIT + 300)))  # seconds
+
+# An order's (id, dial claim owner), checked before the order is dialed
+DialClaim = Tuple[str, str]
+
+def call_result_fields(call: Dict[str, Any]) -> Dict[str, Any]:
+    """Get the order fields to record after a dial attempt"""
+    # Progress of a placed call arrives through Twilio status callbacks; only a failed dial is final here
+    fields = {"call_sid": call.get("call_sid"), "lastCallAt": call["timestamp"]}
+    if call["status"] == "failed":
+        fields["callStatus"] = "failed"
+    else:
+        fields["dialLeaseUntil"] = call["timestamp"] + timedelta(seconds=DIAL_CALL_LEASE)
+    return fields
+
+async def record_call_result(
+    db: Database,
+    stats: OrderStats,
+    order_id: str,
+    call: Dict[str, Any],
+    extra: Optional[Dict[str, Any]] = None,
+    unset: Iterable[str] = (),
+    owner: Optional[str] = None
+) -> None:
+    """Store the outcome of a dial on the order; only a failed dial changes the counted callStatus"""
+    # With an owner nothing is written once the claim was lost to another worker
+    fields = {**call_result_fields(call), **(extra or {})}
+    update: Dict[str, Any] = {"$set": fields}
+    # A placed call keeps its lease; only the claim's owner is released
+    unset = [name for name in unset if name not in fields]
+    if unset:
+        update["$unset"] = {name: "" for name in unset}
+    if "callStatus" not in fields:
+        await db.orders.update_one(dial_owner_filter(order_id, owner), update)
+        return
+
+    # The rollup needs the status being replaced
+    before = await db.orders.find_one_and_update(
+        dial_owner_filter(order_id, owner),
+        update,
+        projection=ORDER_STATS_PROJECTION,
+        return_document=ReturnDocument.BEFORE
+    )
+    await stats.record_change(before, fields)
+
+class TokenBucket:
+    """Async token bucket that admits at most `rate` acquisitions per second"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Dialer:
+    """Rate-limited async outbound dialer with bounded in-flight Twilio requests"""
+
+    def __init__(
+        self,
+        voice_service: VoiceService,
+        db: Optional[Database] = None,
+        cps: float = TWILIO_CPS,
+        max_in_flight: int = DIALER_MAX_IN_FLIGHT,
+        queue_size: int = DIALER_QUEUE_SIZE,
+        max_retries: int = DIALER_MAX_RETRIES
+    ):
+        self.voice_service = voice_service
+        self.db = db
+        self.bucket = TokenBucket(cps)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.queue: "asyncio.Queue[Tuple[str, str, str, Optional[DialClaim], asyncio.Future]]" = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = 0
+        # Claims of orders waiting to be dialed; a long queue outlasts the claim lease
+        self._waiting: Dict[str, DialClaim] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="dialer")
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        """Start the dialer workers"""
+        for _ in range(self.max_in_flight):
+            self._workers.append(asyncio.create_task(self._run()))
+        if self.db:
+            self._workers.append(asyncio.create_task(self._renew_waiting()))
+
+    async def stop(self):
+        """Stop the workers and fail calls that were never dialed"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Dialer stopped"))
+        self._executor.shutdown(wait=False)
+
+    async def submit(
+        self,
+        to_number: str,
+        order_number: str,
+        store_id: str,
+        claim: Optional[DialClaim] = None
+    ) -> asyncio.Future:
+        """Queue a call, waiting while the queue is full, and return a future for its result"""
+        # A claimed order's lease is kept alive while it waits, and the call is skipped if the claim is lost
+        future = asyncio.get_running_loop().create_future()
+        if claim:
+            self._waiting[claim[1]] = claim
+        try:
+            await self.queue.put((to_number, order_number, store_id, claim, future))
+        except BaseException:
+            if claim:
+                self._waiting.pop(claim[1], None)
+            raise
+        metrics.incr("dialer.queued")
+        return future
+
+    async def dial(
+        self,
+        to_number: str,
+        order_number: str,
+        store_id: str,
+        claim: Optional[DialClaim] = None
+    ) -> Dict[str, Any]:
+        """Queue a call and wait for Twilio's response"""
+        return await (await self.submit(to_number, order_number, store_id, claim))
+
+    async def _renew_waiting(self):
+        while True:
+            await asyncio.sleep(DIAL_CLAIM_LEASE / 3)
+            if not self._waiting:
+                continue
+            try:
+                await self.db.renew_dial_claims(list(self._waiting.values()))
+            except Exception as e:
+                print(f"Error renewing dial claims: {str(e)}")
+
+    async def _run(self):
+        while True:
+            to_number, order_number, store_id, claim, future = await self.queue.get()
+            try:
+                result = await self._dial_with_retries(to_number, order_number, store_id, claim)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_exception(RuntimeError("Dialer stopped"))
+                raise
+            finally:
+                if claim:
+                    self._waiting.pop(claim[1], None)
+                self.queue.task_done()
+
+    async def _dial_with_retries(
+        self,
+        to_number: str,
+        order_number: str,
+        store_id: str,
+        claim: Optional[DialClaim] = None
+    ) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            # Renewing right before dialing fails if the lease ran out and another worker took the order over
+            if claim and self.db:
+                try:
+                    held = await self.db.renew_dial_claim(*claim)
+                except Exception as e:
+                    metrics.incr("dialer.failed")
+                    return {"error": str(e), "status": "failed", "timestamp": datetime.utcnow()}
+                if not held:
+                    metrics.incr("dialer.claims_lost")
+                    return {"error": "Dial claim lost", "status": "skipped", "timestamp": datetime.utcnow()}
+            self.in_flight += 1
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, self.voice_service.create_call, to_number, order_number, store_id
+                )
+                metrics.incr("dialer.dialed")
+                return result
+            except TwilioRestException as e:
+                retryable = e.status == 429 or e.status >= 500
+                if not retryable or attempt >= self.max_retries:
+                    metrics.incr("dialer.failed")
+                    return {"error": str(e), "status": "failed", "timestamp": datetime.utcnow()}
+            except Exception as e:
+                metrics.incr("dialer.failed")
+                return {"error": str(e), "status": "failed", "timestamp": datetime.utcnow()}
+            finally:
+                self.in_flight -= 1
+
+            # Jittered exponential backoff before retrying a 429/5xx
+            metrics.incr("dialer.retried")
+            delay = DIALER_RETRY_BASE_DELAY * (2 ** attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get dialer queue depth and in-flight calls"""
+        return {
+            "queued": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "cps": self.bucket.rate,
+            "claims_lost": metrics.get("dialer.claims_lost")
+        }
@@ -0,0 +1,133 @@
+"""Explain every hot query shape and fail if any of them scans a whole collection.
+
+Usage:
+
+    python index_audit.py [--create-indexes]
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from bson import ObjectId
+from typing import Dict, Any, List, Tuple
+from datetime import datetime
+from dotenv import load_dotenv
+from database import Database, dial_claimable
+from campaigns import CampaignManager
+from models import CampaignCreate
+import asyncio
+import sys
+import os
+
+# Placeholder values; the planner only cares about the shape of the query
+SAMPLE_STORE_ID = "000000000000000000000000"
+SAMPLE_ORDER_ID = ObjectId("000000000000000000000000")
+NEWEST_FIRST = [("createdAt", DESCENDING), ("_id", DESCENDING)]
+
+def find_shapes() -> List[Tuple[str, str, Dict[str, Any], List[Tuple[str, int]]]]:
+    """List (name, collection, filter, sort) for every indexed find query"""
+    now = datetime.utcnow()
+    page_filter = Database.order_filter(SAMPLE_STORE_ID, "pending")
+    page_filter["createdAt"] = {"$lte": now}
+    page_filter["$or"] = [{"createdAt": {"$lt": now}}, {"_id": {"$lt": SAMPLE_ORDER_ID}}]
+    # The campaign claim exactly as CampaignManager.claim_batch builds it
+    campaign_filter = CampaignManager.build_filter(CampaignCreate(status="pending", callStatus="not_called", storeId=SAMPLE_STORE_ID))
+    campaign_filter["campaignId"] = {"$ne": SAMPLE_STORE_ID}
+    writeback_due = {"state": "pending", "nextAttemptAt": {"$lte": now}}
+    return [
+        ("orders by store", "orders", Database.order_filter(SAMPLE_STORE_ID), NEWEST_FIRST),
+        ("orders by store+status", "orders", Database.order_filter(SAMPLE_STORE_ID, "pending"), NEWEST_FIRST),
+        ("orders by store+callStatus", "orders", Database.order_filter(SAMPLE_STORE_ID, None, "failed"), NEWEST_FIRST),
+        ("orders page after cursor", "orders", page_filter, NEWEST_FIRST),
+        ("order by store+orderNumber", "orders", {"storeId": SAMPLE_STORE_ID, "orderNumber": "1001"}, []),
+        ("campaign claim", "orders", {"$and": [campaign_filter, dial_claimable(now)]}, [("createdAt", ASCENDING)]),
+        ("campaign claimed batch", "orders", {"campaignClaim": "token"}, []),
+        ("expired dial claims", "orders", {"dialLeaseUntil": {"$lt": now}, "callStatus": "calling"}, []),
+        ("stale dial claims", "orders", {"dialLeaseUntil": {"$lt": now}, "callStatus": {"$ne": "calling"}}, []),
+        ("campaign runner lease", "campaigns", {"state": "running", "leaseUntil": {"$lt": now}}, []),
+        ("campaigns by store", "campaigns", {"storeId": SAMPLE_STORE_ID}, [("createdAt", DESCENDING)]),
+        ("open call history bucket", "call_events", {"orderId": SAMPLE_STORE_ID, "count": {"$lt": 50}}, []),
+        ("call history page", "call_events", {"orderId": SAMPLE_STORE_ID}, [("seq", DESCENDING), ("_id", DESCENDING)]),
+        ("last call history bucket", "call_events", {"orderId": SAMPLE_STORE_ID, "seq": {"$exists": True}}, [("seq", DESCENDING)]),
+        ("due call retries", "call_retries", {"nextAttemptAt": {"$lte": now}}, [("nextAttemptAt", ASCENDING)]),
+        ("ingest claim", "webhook_ingest", {"visibleAt": {"$lte": now}}, [("visibleAt", ASCENDING)]),
+        ("dead letters by shop", "webhook_dead_letters", {"shopDomain": "sample.myshopify.com"}, [("failedAt", DESCENDING)]),
+        (
+            "writeback due store",
+            "shopify_writebacks",
+            {**writeback_due, "storeId": {"$nin": [SAMPLE_STORE_ID]}},
+            [("nextAttemptAt", ASCENDING)]
+        ),
+        ("writeback claim", "shopify_writebacks", {**writeback_due, "storeId": SAMPLE_STORE_ID}, [("nextAttemptAt", ASCENDING)]),
+        ("writeback outcomes", "shopify_writebacks", {"storeId": SAMPLE_STORE_ID, "state": "failed"}, [("updatedAt", DESCENDING)]),
+        ("backfill lease", "shopify_backfills", {"state": "running", "leaseUntil": {"$lt": now}}, []),
+        ("daily order rollups", "order_daily_stats", {"storeId": SAMPLE_STORE_ID, "day": {"$gte": now, "$lt": now}}, [("day", ASCENDING)])
+    ]
+
+def count_shapes() -> List[Tuple[str, str, Dict[str, Any]]]:
+    """List (name, collection, filter) for every indexed count query"""
+    return [
+        ("order count by store+status", "orders", Database.order_filter(SAMPLE_STORE_ID, "pending")),
+        ("order count by store+callStatus", "orders", Database.order_filter(SAMPLE_STORE_ID, None, "failed"))
+    ]
+
+def plan_stages(plan: Any) -> List[str]:
+    """Collect every stage name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+async def audit(db: Database) -> bool:
+    """Explain every query shape and report whether all of them use an index"""
+    ok = True
+    results = []
+    for name, collection, query, sort in find_shapes():
+        cursor = db.db[collection].find(query).limit(100)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        results.append((name, plan_stages(explain["queryPlanner"]["winningPlan"])))
+
+    for name, collection, query in count_shapes():
+        explain = await db.db.command(
+            {"explain": {"count": collection, "query": query}, "verbosity": "queryPlanner"}
+        )
+        results.append((name, plan_stages(explain["queryPlanner"]["winningPlan"])))
+
+    for name, stages in results:
+        scanned = "COLLSCAN" in stages
+        ok = ok and not scanned
+        print(f"{'FAIL' if scanned else 'ok  '} {name:<36} {' <- '.join(stages)}")
+    return ok
+
+async def main(create_indexes: bool) -> int:
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    db = Database(client, os.getenv("MONGODB_DB", "shopify_voice"))
+    try:
+        if create_indexes:
+            from ingest_queue import IngestQueue
+            from retry_scheduler import RetryScheduler
+            from call_history import CallHistoryStore
+            from order_stats import OrderStats
+            from shopify_writeback import ShopifyWriteback
+            from shopify_backfill import BackfillManager
+            await db.create_indexes()
+            await IngestQueue(db).create_indexes()
+            await RetryScheduler(db, None, None).create_indexes()
+            await CallHistoryStore(db, None).create_indexes()
+            await CampaignManager(db, None, None, None).create_indexes()
+            await OrderStats(db).create_indexes()
+            await ShopifyWriteback(db, None).create_indexes()
+            await BackfillManager(db, None, None).create_indexes()
+        return 0 if await audit(db) else 1
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main("--create-indexes" in sys.argv[1:])))
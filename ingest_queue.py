@@ -0,0 +1,194 @@
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from bson import ObjectId
+from typing import Optional, Dict, Any, Callable, Awaitable, List
+from datetime import datetime, timedelta
+from database import Database
+from metrics import metrics
+import asyncio
+import os
+import socket
+
+# Ingest queue configuration
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_VISIBILITY_TIMEOUT = int(os.getenv("INGEST_VISIBILITY_TIMEOUT", "60"))  # seconds
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "0.5"))  # seconds
+
+class IngestQueue:
+    """Durable MongoDB-backed queue for raw Shopify webhook deliveries"""
+
+    def __init__(
+        self,
+        database: Database,
+        visibility_timeout: int = INGEST_VISIBILITY_TIMEOUT,
+        max_attempts: int = INGEST_MAX_ATTEMPTS
+    ):
+        self.jobs = database.db.webhook_ingest
+        self.dead_letters = database.db.webhook_dead_letters
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+    async def create_indexes(self):
+        # Claims always look for the earliest visible job
+        await self.jobs.create_index([("visibleAt", ASCENDING)])
+        await self.jobs.create_index([("receivedAt", ASCENDING)])
+        await self.dead_letters.create_index("failedAt")
+        await self.dead_letters.create_index([("shopDomain", ASCENDING), ("failedAt", DESCENDING)])
+
+    async def enqueue(
+        self,
+        topic: str,
+        shop_domain: str,
+        payload: bytes,
+        headers: Optional[Dict[str, str]] = None
+    ) -> str:
+        """Persist a raw webhook delivery and return its job id"""
+        now = datetime.utcnow()
+        result = await self.jobs.insert_one({
+            "topic": topic,
+            "shopDomain": shop_domain,
+            "payload": payload,
+            "headers": headers or {},
+            "receivedAt": now,
+            "visibleAt": now,
+            "attempts": 0,
+            "claimedBy": None,
+            "lastError": None
+        })
+        metrics.incr("ingest.enqueued")
+        return str(result.inserted_id)
+
+    async def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically claim the next visible job and hide it for the visibility timeout"""
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {"visibleAt": {"$lte": now}},
+            {
+                "$set": {
+                    "visibleAt": now + timedelta(seconds=self.visibility_timeout),
+                    "claimedBy": worker_id,
+                    "claimedAt": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("visibleAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def ack(self, job: Dict[str, Any], worker_id: str) -> bool:
+        """Remove a job that was processed successfully"""
+        result = await self.jobs.delete_one({"_id": job["_id"], "claimedBy": worker_id})
+        metrics.incr("ingest.acked")
+        return result.deleted_count == 1
+
+    async def fail(self, job: Dict[str, Any], worker_id: str, error: str) -> None:
+        """Release a failed job for a later retry or move it to the dead-letter collection"""
+        if job["attempts"] >= self.max_attempts:
+            dead = dict(job)
+            dead["lastError"] = error
+            dead["failedAt"] = datetime.utcnow()
+            await self.dead_letters.insert_one(dead)
+            await self.jobs.delete_one({"_id": job["_id"], "claimedBy": worker_id})
+            metrics.incr("ingest.dead_lettered")
+            return
+
+        # Exponential backoff before the job becomes visible again
+        delay = min(2 ** job["attempts"], self.visibility_timeout)
+        await self.jobs.update_one(
+            {"_id": job["_id"], "claimedBy": worker_id},
+            {"$set": {
+                "visibleAt": datetime.utcnow() + timedelta(seconds=delay),
+                "claimedBy": None,
+                "lastError": error
+            }}
+        )
+        metrics.incr("ingest.retried")
+
+    async def list_dead_letters(self, shop_domain: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Get a shop's dead-lettered jobs, most recently failed first, without their payloads"""
+        return await self.dead_letters.find(
+            {"shopDomain": shop_domain},
+            {"topic": 1, "attempts": 1, "lastError": 1, "receivedAt": 1, "failedAt": 1}
+        ).sort("failedAt", DESCENDING).limit(limit).to_list(length=limit)
+
+    async def requeue_dead_letter(self, job_id: str, shop_domain: str) -> bool:
+        """Move one of a shop's dead-lettered jobs back onto the queue"""
+        if not ObjectId.is_valid(job_id):
+            return False
+        job = await self.dead_letters.find_one_and_delete({"_id": ObjectId(job_id), "shopDomain": shop_domain})
+        if not job:
+            return False
+        job.pop("failedAt", None)
+        job.update({"attempts": 0, "claimedBy": None, "visibleAt": datetime.utcnow()})
+        await self.jobs.insert_one(job)
+        metrics.incr("ingest.requeued")
+        return True
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get queue depth and age for worker scaling"""
+        now = datetime.utcnow()
+        depth = await self.jobs.count_documents({})
+        ready = await self.jobs.count_documents({"visibleAt": {"$lte": now}})
+        oldest = await self.jobs.find_one({}, {"receivedAt": 1}, sort=[("receivedAt", ASCENDING)])
+        dead = await self.dead_letters.estimated_document_count()
+        return {
+            "depth": depth,
+            "ready": ready,
+            "in_flight": depth - ready,
+            "oldest_age_seconds": (now - oldest["receivedAt"]).total_seconds() if oldest else 0,
+            "dead_letters": dead
+        }
+
+class IngestWorkerPool:
+    """Pool of async workers draining the ingest queue with claim/ack semantics"""
+
+    def __init__(
+        self,
+        queue: IngestQueue,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        concurrency: int = INGEST_WORKERS,
+        poll_interval: float = INGEST_POLL_INTERVAL
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        """Start the worker tasks"""
+        self._stopping.clear()
+        for i in range(self.concurrency):
+            worker_id = f"{self.worker_prefix}:{i}"
+            self._tasks.append(asyncio.create_task(self._run(worker_id)))
+
+    async def stop(self):
+        """Stop the worker tasks after their current job"""
+        self._stopping.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                print(f"Error claiming ingest job: {str(e)}")
+                job = None
+
+            if not job:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.handler(job)
+            except Exception as e:
+                print(f"Error processing ingest job {job['_id']}: {str(e)}")
+                await self.queue.fail(job, worker_id, str(e))
+            else:
+                await self.queue.ack(job, worker_id)
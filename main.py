@@ -31,20 +31,122 @@ async def startup_db_client():
     app.mongodb = app.mongodb_client[os.getenv("MONGODB_DB", "shopify_voice")]
     # Create indexes
     from database import Database
-    db = Database(app.mongodb_client, os.getenv("MONGODB_DB", "shopify_voice"))
-    await db.create_indexes()
+    app.db = Database(app.mongodb_client, os.getenv("MONGODB_DB", "shopify_voice"))
+    await app.db.create_indexes()
+
+    from metrics import metrics
+    from principal_cache import PrincipalCache
+    from password_hasher import PasswordHasher
+    from voice_service import VoiceService
+    from dialer import Dialer
+    from order_stats import OrderStats
+    from call_history import CallHistoryStore
+    from retry_scheduler import RetryScheduler
+    from campaigns import CampaignManager
+    from shopify_client import ShopifyClientPool
+    from shopify_governor import ShopifyGovernor, SHOPIFY_GOVERNOR_SHARED
+    from shopify_writeback import ShopifyWriteback
+    from ingest_queue import IngestQueue, IngestWorkerPool
+    from webhook_dedup import WebhookDeduplicator
+    from webhook_processor import WebhookProcessor
+    from shopify_backfill import BackfillManager
+    from order_events import OrderEventHub
+
+    # Verified JWT principals, shared by every request in this process
+    app.principal_cache = PrincipalCache()
+    metrics.register_gauge("principal_cache", app.principal_cache.stats)
+
+    # Start bcrypt worker processes
+    app.password_hasher = PasswordHasher()
+    await app.password_hasher.start()
+    metrics.register_gauge("password_hasher", app.password_hasher.stats)
+
+    # Start the rate-limited outbound dialer
+    app.voice_service = VoiceService()
+    app.dialer = Dialer(app.voice_service, app.db)
+    app.dialer.start()
+    metrics.register_gauge("dialer", app.dialer.stats)
+
+    # Daily order rollups, moved on every status and callStatus transition
+    app.order_stats = OrderStats(app.db)
+    await app.order_stats.create_indexes()
+
+    # Bucketed call events, written by Twilio status callbacks
+    app.call_history = CallHistoryStore(app.db, app.order_stats)
+    await app.call_history.create_indexes()
+
+    # Start the call retry scheduler
+    app.retry_scheduler = RetryScheduler(app.db, app.dialer, app.order_stats)
+    await app.retry_scheduler.create_indexes()
+    app.retry_scheduler.start()
+    metrics.register_gauge("retries", app.retry_scheduler.stats)
+
+    # Start the bulk calling campaign runner
+    app.campaigns = CampaignManager(app.db, app.dialer, app.order_stats, app.retry_scheduler)
+    await app.campaigns.create_indexes()
+    app.campaigns.start()
+
+    # Pooled per-shop Shopify clients sharing one rate-limit governor
+    app.shopify_governor = ShopifyGovernor(app.db if SHOPIFY_GOVERNOR_SHARED else None)
+    await app.shopify_governor.create_indexes()
+    metrics.register_gauge("shopify_governor", app.shopify_governor.stats)
+    app.shopify_clients = ShopifyClientPool(app.shopify_governor)
+    metrics.register_gauge("shopify_clients", app.shopify_clients.stats)
+
+    # Start importing existing orders for newly connected stores
+    app.backfills = BackfillManager(app.db, app.shopify_clients, app.order_stats)
+    await app.backfills.create_indexes()
+    app.backfills.start()
+    metrics.register_gauge("backfills", app.backfills.stats)
+
+    # Start pushing confirmed and cancelled outcomes back to Shopify
+    app.shopify_writeback = ShopifyWriteback(app.db, app.shopify_clients)
+    await app.shopify_writeback.create_indexes()
+    app.shopify_writeback.start()
+    metrics.register_gauge("shopify_writeback", app.shopify_writeback.stats)
+
+    # Start webhook ingest workers
+    app.webhook_dedup = WebhookDeduplicator(app.db)
+    await app.webhook_dedup.create_indexes()
+    metrics.register_gauge("webhook_dedup", app.webhook_dedup.stats)
+    app.ingest_queue = IngestQueue(app.db)
+    await app.ingest_queue.create_indexes()
+    metrics.register_gauge("ingest", app.ingest_queue.stats)
+    app.webhook_processor = WebhookProcessor(
+        app.db, app.dialer, app.shopify_clients, app.retry_scheduler, app.order_stats
+    )
+    app.ingest_workers = IngestWorkerPool(app.ingest_queue, app.webhook_processor.process)
+    app.ingest_workers.start()
+
+    # Push order changes to dashboard subscribers
+    app.order_events = OrderEventHub(app.db)
+    app.order_events.start()
+    metrics.register_gauge("order_events", app.order_events.stats)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await app.order_events.stop()
+    await app.ingest_workers.stop()
+    await app.retry_scheduler.stop()
+    await app.campaigns.stop()
+    await app.dialer.stop()
+    await app.webhook_processor.stop()
+    await app.backfills.stop()
+    await app.shopify_writeback.stop()
+    await app.shopify_clients.close()
+    await app.password_hasher.stop()
     app.mongodb_client.close()
 
 # Import and include routers
-from routers import orders, shopify, voice, auth
+from routers import orders, shopify, voice, auth, metrics, campaigns, events
 
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(orders.router, prefix="/api/orders", tags=["Orders"])
 app.include_router(shopify.router, prefix="/api/shopify", tags=["Shopify"])
 app.include_router(voice.router, prefix="/api/voice", tags=["Voice"])
+app.include_router(campaigns.router, prefix="/api/campaigns", tags=["Campaigns"])
+app.include_router(events.router, prefix="/api/events", tags=["Events"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["Metrics"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,36 @@
+from typing import Any, Awaitable, Callable, Dict
+from collections import defaultdict
+
+class Metrics:
+    """In-process counters and gauges exposed through /api/metrics"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, Callable[[], Awaitable[Any]]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """Increment a counter"""
+        self.counters[name] += value
+
+    def get(self, name: str) -> int:
+        """Get the current value of a counter"""
+        return self.counters.get(name, 0)
+
+    def register_gauge(self, name: str, fn: Callable[[], Awaitable[Any]]) -> None:
+        """Register an async callable that is evaluated on every snapshot"""
+        self.gauges[name] = fn
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Collect all counters and evaluate all gauges"""
+        gauges = {}
+        for name, fn in self.gauges.items():
+            try:
+                gauges[name] = await fn()
+            except Exception as e:
+                gauges[name] = {"error": str(e)}
+        return {
+            "counters": dict(self.counters),
+            "gauges": gauges
+        }
+
+metrics = Metrics()
@@ -0,0 +1,76 @@
+"""Move embedded order callHistory arrays into call_events buckets.
+
+Safe to re-run: an order's migrated buckets are replaced until its array is removed.
+
+Usage:
+
+    python migrate_call_history.py
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from typing import Dict, Any, List
+from dotenv import load_dotenv
+from database import Database
+from call_history import CallHistoryStore
+import asyncio
+import sys
+import os
+
+def bucket_id(first_event: Dict[str, Any]) -> ObjectId:
+    """An ObjectId that sorts by the bucket's first event rather than by migration time"""
+    return ObjectId(ObjectId.from_datetime(first_event["timestamp"]).binary[:4] + ObjectId().binary[4:])
+
+def buckets_for(order: Dict[str, Any], bucket_size: int) -> List[Dict[str, Any]]:
+    """Split an order's embedded history into bucket documents"""
+    events = order["callHistory"]
+    buckets = []
+    for start in range(0, len(events), bucket_size):
+        chunk = events[start:start + bucket_size]
+        buckets.append({
+            "_id": bucket_id(chunk[0]),
+            "orderId": str(order["_id"]),
+            "storeId": order.get("storeId"),
+            "events": chunk,
+            # Migrated buckets are closed so new events always start a fresh one
+            "count": bucket_size,
+            "firstAt": chunk[0]["timestamp"],
+            "lastAt": chunk[-1]["timestamp"],
+            "migrated": True
+        })
+    return buckets
+
+async def migrate(db: Database, history: CallHistoryStore) -> int:
+    """Migrate every order that still embeds its call history"""
+    migrated = 0
+    cursor = db.orders.find({"callHistory": {"$exists": True}}, {"callHistory": 1, "storeId": 1})
+    async for order in cursor:
+        events = order.get("callHistory") or []
+        await history.buckets.delete_many({"orderId": str(order["_id"]), "migrated": True})
+        if events:
+            await history.buckets.insert_many(buckets_for(order, history.bucket_size))
+
+        summary: Dict[str, Any] = {}
+        if events:
+            summary["lastCallStatus"] = events[-1]["status"]
+            summary["lastCallEventAt"] = events[-1]["timestamp"]
+        update: Dict[str, Any] = {"$unset": {"callHistory": ""}}
+        if summary:
+            update["$set"] = summary
+        await db.orders.update_one({"_id": order["_id"]}, update)
+        migrated += 1
+    return migrated
+
+async def main() -> int:
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    db = Database(client, os.getenv("MONGODB_DB", "shopify_voice"))
+    try:
+        history = CallHistoryStore(db, None)
+        await history.create_indexes()
+        print(f"Migrated call history for {await migrate(db, history)} orders")
+        return 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,92 @@
+"""Scope orders saved before store scoping to the store they belong to.
+
+Orders created by older versions have no storeId, so the store-scoped order queries no longer
+return them. With one connected store they all belong to it; with several, name the store.
+Safe to re-run: only orders without a storeId are touched.
+
+Usage:
+
+    python migrate_order_stores.py [--store STORE_ID]
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from typing import Dict, Any, Optional, Tuple
+from dotenv import load_dotenv
+from database import Database
+from call_history import CallHistoryStore
+from order_stats import OrderStats
+import argparse
+import asyncio
+import sys
+import os
+
+MIGRATE_BATCH_SIZE = 500
+
+# Orders written before store scoping
+UNSCOPED = {"storeId": None}
+
+async def resolve_store(db: Database, store_id: Optional[str]) -> Optional[str]:
+    """The store to assign, or None if it cannot be told which one"""
+    if store_id:
+        return store_id if ObjectId.is_valid(store_id) and await db.get_store(store_id, {"_id": 1}) else None
+    stores = await db.stores.find({}, {"_id": 1}).limit(2).to_list(length=2)
+    return str(stores[0]["_id"]) if len(stores) == 1 else None
+
+async def migrate(db: Database, history: CallHistoryStore, store_id: str) -> Tuple[int, int]:
+    """Assign every unscoped order and its call events to the store; get (scoped, duplicate) counts"""
+    scoped, duplicates = 0, 0
+    last_id: Optional[ObjectId] = None
+    while True:
+        query: Dict[str, Any] = dict(UNSCOPED)
+        if last_id:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.orders.find(query, {"_id": 1}).sort("_id", ASCENDING).limit(MIGRATE_BATCH_SIZE).to_list(
+            length=MIGRATE_BATCH_SIZE
+        )
+        if not batch:
+            return scoped, duplicates
+        last_id = batch[-1]["_id"]
+
+        # An order number the store already has stays unscoped and is reported instead of failing the batch
+        requests = [UpdateOne({"_id": order["_id"], **UNSCOPED}, {"$set": {"storeId": store_id}}) for order in batch]
+        try:
+            result = await db.orders.bulk_write(requests, ordered=False)
+            scoped += result.modified_count
+        except BulkWriteError as e:
+            scoped += e.details["nModified"]
+            duplicates += len(e.details["writeErrors"])
+            for error in e.details["writeErrors"]:
+                print(f"Order {batch[error['index']]['_id']} duplicates an order number of the store: {error['errmsg']}")
+
+        await history.buckets.update_many(
+            {"orderId": {"$in": [str(order["_id"]) for order in batch]}, **UNSCOPED},
+            {"$set": {"storeId": store_id}}
+        )
+
+async def main(store_id: Optional[str]) -> int:
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    db = Database(client, os.getenv("MONGODB_DB", "shopify_voice"))
+    try:
+        target = await resolve_store(db, store_id)
+        if not target:
+            print(f"Store {store_id} not found" if store_id else "Name the store the orders belong to with --store STORE_ID")
+            return 1
+        await db.create_indexes()
+        scoped, duplicates = await migrate(db, CallHistoryStore(db, None), target)
+        print(f"Scoped {scoped} orders to store {target}; {duplicates} duplicate order numbers left unscoped")
+
+        # Unscoped orders were never counted in the store's rollups
+        stats = OrderStats(db)
+        await stats.create_indexes()
+        await stats.rebuild([target])
+        return 1 if duplicates else 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--store", dest="store_id", help="the store the unscoped orders belong to")
+    sys.exit(asyncio.run(main(parser.parse_args().store_id)))
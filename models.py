@@ -1,7 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Dict
 from datetime import datetime
 from enum import Enum
+from voice_service import TWILIO_CPS
 
 class OrderStatus(str, Enum):
     PENDING = "pending"
@@ -19,12 +20,14 @@ class CallStatus(str, Enum):
 class CallHistory(BaseModel):
     timestamp: datetime
     status: str
+    callSid: Optional[str] = None
     duration: Optional[int] = None
     response: Optional[str] = None
 
 class Order(BaseModel):
     id: Optional[str] = Field(None, alias="_id")
     shopifyOrderId: str
+    storeId: Optional[str] = None
     orderNumber: str
     customerName: str
     customerPhone: str
@@ -33,13 +36,100 @@ class Order(BaseModel):
     callStatus: CallStatus = CallStatus.NOT_CALLED
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     lastCallAt: Optional[datetime] = None
-    callHistory: List[CallHistory] = []
+    lastCallStatus: Optional[str] = None
+    lastCallDuration: Optional[int] = None
+    lastCallEventAt: Optional[datetime] = None
+    callAttempts: int = 0
+    retryAttempt: int = 0
+
+class CallHistoryPage(BaseModel):
+    items: List[CallHistory]
+    next_cursor: Optional[str] = None
+
+class CampaignState(str, Enum):
+    RUNNING = "running"
+    PAUSED = "paused"
+    CANCELLED = "cancelled"
+    COMPLETED = "completed"
+
+class CampaignCreate(BaseModel):
+    status: Optional[OrderStatus] = OrderStatus.PENDING
+    callStatus: Optional[CallStatus] = CallStatus.NOT_CALLED
+    createdFrom: Optional[datetime] = None
+    createdTo: Optional[datetime] = None
+    storeId: Optional[str] = None
+    # The dialer never goes above the account's limit, so a campaign cannot ask for more
+    targetCps: float = Field(1.0, gt=0, le=TWILIO_CPS)
+
+class Campaign(BaseModel):
+    id: Optional[str] = Field(None, alias="_id")
+    storeId: str
+    filter: dict
+    targetCps: float
+    state: CampaignState = CampaignState.RUNNING
+    counts: dict = {
+        "queued": 0,
+        "dialed": 0,
+        "failed": 0,
+        "answered": 0,
+        "confirmed": 0,
+        "cancelled": 0
+    }
+    createdAt: datetime = Field(default_factory=datetime.utcnow)
+    updatedAt: datetime = Field(default_factory=datetime.utcnow)
+
+class OrderPage(BaseModel):
+    items: List[Order]
+    next_cursor: Optional[str] = None
+    estimated_total: Optional[int] = None
+
+class OrderDayStats(BaseModel):
+    day: datetime
+    orders: int = 0
+    status: Dict[str, int] = {}
+    callStatus: Dict[str, int] = {}
+
+class OrderStatsTotals(BaseModel):
+    orders: int = 0
+    status: Dict[str, int] = {}
+    callStatus: Dict[str, int] = {}
+
+class OrderStatsSummary(BaseModel):
+    days: List[OrderDayStats]
+    totals: OrderStatsTotals
+    confirmationRate: float
+    cancellationRate: float
+    answerRate: float
+    callSuccessRate: float
+
+class BackfillProgress(BaseModel):
+    storeId: str
+    state: str
+    pages: int = 0
+    fetched: int = 0
+    imported: int = 0
+    skipped: int = 0
+    error: Optional[str] = None
+    startedAt: datetime
+    updatedAt: datetime
+    completedAt: Optional[datetime] = None
+
+class WritebackState(BaseModel):
+    orderId: str
+    shopifyOrderId: str
+    outcome: str
+    state: str
+    attempts: int = 0
+    lastError: Optional[str] = None
+    updatedAt: datetime
+    syncedAt: Optional[datetime] = None
 
 class Store(BaseModel):
     id: Optional[str] = Field(None, alias="_id")
     shopifyDomain: str
     accessToken: str
     webhookSecret: str
+    webhookId: Optional[str] = None
     voiceSettings: dict = {
         "language": "ur",
         "voiceId": "default",
@@ -57,6 +147,14 @@ class User(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class UserCreate(BaseModel):
+    email: str
+    password: str
+
+class UserUpdate(BaseModel):
+    email: Optional[str] = None
+    password: Optional[str] = None
+
 class Token(BaseModel):
     access_token: str
     token_type: str
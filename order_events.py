@@ -0,0 +1,198 @@
+from pymongo.errors import OperationFailure
+from collections import deque
+from typing import Dict, Any, Optional, Set, Deque, Tuple
+from datetime import datetime
+from database import Database
+from metrics import metrics
+import asyncio
+import json
+import os
+
+# Order event hub configuration
+ORDER_EVENTS_QUEUE_SIZE = int(os.getenv("ORDER_EVENTS_QUEUE_SIZE", "100"))
+ORDER_EVENTS_REPLAY_SIZE = int(os.getenv("ORDER_EVENTS_REPLAY_SIZE", "1000"))
+ORDER_EVENTS_RETRY_DELAY = float(os.getenv("ORDER_EVENTS_RETRY_DELAY", "5"))  # seconds
+
+# Order fields pushed to subscribers
+EVENT_FIELDS = ("storeId", "orderNumber", "customerName", "amount", "status", "callStatus", "call_sid", "lastCallAt")
+
+# Resume tokens the server no longer has history for
+HISTORY_LOST_CODES = {136, 280, 286}
+
+# Sent in place of events a subscriber can no longer receive; control messages have no token
+RESYNC_MESSAGE = (None, json.dumps({"type": "resync"}))
+DROPPED_MESSAGE = json.dumps({"type": "dropped"})
+
+class OrderEvent:
+    """A change to one order, serialized once for every subscriber"""
+
+    __slots__ = ("token", "store_id", "status", "call_status", "data")
+
+    def __init__(self, token: str, order: Dict[str, Any], operation: str):
+        self.token = token
+        self.store_id = order.get("storeId")
+        self.status = order.get("status")
+        self.call_status = order.get("callStatus")
+        payload = {field: order.get(field) for field in EVENT_FIELDS}
+        payload["id"] = str(order["_id"])
+        if isinstance(payload["lastCallAt"], datetime):
+            payload["lastCallAt"] = payload["lastCallAt"].isoformat()
+        self.data = json.dumps({"type": "order", "operation": operation, "token": token, "order": payload})
+
+class Subscription:
+    """One connected client with its own bounded send queue"""
+
+    def __init__(self, store_id: str, statuses: Optional[Set[str]], call_statuses: Optional[Set[str]], queue_size: int):
+        self.store_id = store_id
+        self.statuses = statuses
+        self.call_statuses = call_statuses
+        # (resume token, JSON) pairs; None tells the client it was dropped
+        self.queue: "asyncio.Queue[Optional[Tuple[Optional[str], str]]]" = asyncio.Queue(maxsize=queue_size)
+
+    def wants(self, event: OrderEvent) -> bool:
+        if self.statuses and event.status not in self.statuses:
+            return False
+        if self.call_statuses and event.call_status not in self.call_statuses:
+            return False
+        return True
+
+class OrderEventHub:
+    """Fans one orders change stream per process out to WebSocket and SSE subscribers"""
+
+    def __init__(
+        self,
+        database: Database,
+        queue_size: int = ORDER_EVENTS_QUEUE_SIZE,
+        replay_size: int = ORDER_EVENTS_REPLAY_SIZE,
+        retry_delay: float = ORDER_EVENTS_RETRY_DELAY
+    ):
+        self.db = database
+        self.queue_size = queue_size
+        self.retry_delay = retry_delay
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        # Recent events, so clients reconnecting with a token miss nothing
+        self._recent: Deque[OrderEvent] = deque(maxlen=replay_size)
+        self._resume_after: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(
+        self,
+        store_id: str,
+        statuses: Optional[Set[str]] = None,
+        call_statuses: Optional[Set[str]] = None,
+        resume_token: Optional[str] = None
+    ) -> Subscription:
+        """Register a client, replaying what it missed since resume_token"""
+        subscription = Subscription(store_id, statuses, call_statuses, self.queue_size)
+        if resume_token:
+            self._replay(subscription, resume_token)
+        self._subscribers.setdefault(store_id, set()).add(subscription)
+        metrics.incr("order_events.subscribed")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a client"""
+        subscribers = self._subscribers.get(subscription.store_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.store_id]
+
+    def _replay(self, subscription: Subscription, resume_token: str) -> None:
+        tokens = [event.token for event in self._recent]
+        if resume_token not in tokens:
+            # Too old or from another process; the client must refetch
+            subscription.queue.put_nowait(RESYNC_MESSAGE)
+            return
+        missed = [
+            event for event in list(self._recent)[tokens.index(resume_token) + 1:]
+            if event.store_id == subscription.store_id and subscription.wants(event)
+        ]
+        if len(missed) > self.queue_size:
+            subscription.queue.put_nowait(RESYNC_MESSAGE)
+            return
+        for event in missed:
+            subscription.queue.put_nowait((event.token, event.data))
+
+    def publish(self, event: OrderEvent) -> None:
+        """Send an event to every matching subscriber, dropping any that fell behind"""
+        self._recent.append(event)
+        metrics.incr("order_events.published")
+        for subscription in list(self._subscribers.get(event.store_id, ())):
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.queue.put_nowait((event.token, event.data))
+            except asyncio.QueueFull:
+                self._drop(subscription)
+
+    def _drop(self, subscription: Subscription) -> None:
+        self.unsubscribe(subscription)
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+        metrics.incr("order_events.dropped")
+
+    def _broadcast_resync(self) -> None:
+        self._recent.clear()
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                try:
+                    subscription.queue.put_nowait(RESYNC_MESSAGE)
+                except asyncio.QueueFull:
+                    self._drop(subscription)
+
+    def start(self):
+        """Start watching the orders collection"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop watching and disconnect every subscriber"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                self._drop(subscription)
+
+    async def _run(self):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {
+                "operationType": 1,
+                "fullDocument._id": 1,
+                **{f"fullDocument.{field}": 1 for field in EVENT_FIELDS}
+            }}
+        ]
+        while True:
+            try:
+                async with self.db.orders.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=self._resume_after
+                ) as stream:
+                    async for change in stream:
+                        self._resume_after = change["_id"]
+                        order = change.get("fullDocument")
+                        if order:
+                            self.publish(OrderEvent(change["_id"]["_data"], order, change["operationType"]))
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                print(f"Error watching orders: {str(e)}")
+                if e.code in HISTORY_LOST_CODES:
+                    # Events were missed while disconnected; every client must refetch
+                    self._resume_after = None
+                    self._broadcast_resync()
+            except Exception as e:
+                print(f"Error watching orders: {str(e)}")
+            await asyncio.sleep(self.retry_delay)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get subscriber counts and delivery counters"""
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "stores": len(self._subscribers),
+            "published": metrics.get("order_events.published"),
+            "dropped": metrics.get("order_events.dropped")
+        }
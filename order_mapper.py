@@ -0,0 +1,75 @@
+from typing import Dict, Any, Optional, List
+
+# Fields that must be present before an order can be saved and called
+REQUIRED_ORDER_FIELDS = [
+    "shopifyOrderId",
+    "orderNumber",
+    "customerName",
+    "customerPhone",
+    "amount"
+]
+
+def _address_name(address: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not address:
+        return None
+    name = address.get("name") or " ".join(
+        part for part in (address.get("first_name"), address.get("last_name")) if part
+    )
+    return name or None
+
+def extract_phone(data: Dict[str, Any]) -> Optional[str]:
+    """Get the customer phone from the order, billing, shipping or customer record"""
+    customer = data.get("customer") or {}
+    candidates = [
+        data.get("phone"),
+        (data.get("billing_address") or {}).get("phone"),
+        (data.get("shipping_address") or {}).get("phone"),
+        customer.get("phone"),
+        (customer.get("default_address") or {}).get("phone")
+    ]
+    for phone in candidates:
+        if phone:
+            return phone
+    return None
+
+def extract_customer_name(data: Dict[str, Any]) -> Optional[str]:
+    """Get the customer name from the customer, billing or shipping record"""
+    customer = data.get("customer") or {}
+    name = " ".join(
+        part for part in (customer.get("first_name"), customer.get("last_name")) if part
+    )
+    return (
+        name
+        or _address_name(data.get("billing_address"))
+        or _address_name(data.get("shipping_address"))
+    )
+
+def order_fields_from_payload(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a Shopify order payload to Order fields, omitting any that are missing"""
+    fields: Dict[str, Any] = {}
+
+    if data.get("id") is not None:
+        fields["shopifyOrderId"] = str(data["id"])
+
+    # Prefer the numeric order number; it is safe to use in IVR callback URLs
+    if data.get("order_number") is not None:
+        fields["orderNumber"] = str(data["order_number"])
+    elif data.get("name"):
+        fields["orderNumber"] = str(data["name"]).lstrip("#")
+
+    name = extract_customer_name(data)
+    if name:
+        fields["customerName"] = name
+
+    phone = extract_phone(data)
+    if phone:
+        fields["customerPhone"] = phone
+
+    if data.get("total_price") is not None:
+        fields["amount"] = float(data["total_price"])
+
+    return fields
+
+def missing_order_fields(fields: Dict[str, Any]) -> List[str]:
+    """List required Order fields that are not present"""
+    return [field for field in REQUIRED_ORDER_FIELDS if field not in fields]
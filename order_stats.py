@@ -0,0 +1,160 @@
+from pymongo import ASCENDING, UpdateOne, ReplaceOne
+from typing import Dict, Any, Optional, List, Iterable, Tuple
+from datetime import datetime
+from database import Database
+from metrics import metrics
+import os
+
+# Stores rolled up per aggregation when rebuilding
+ORDER_STATS_REBUILD_BATCH = int(os.getenv("ORDER_STATS_REBUILD_BATCH", "50"))
+
+# Counted order fields; each daily document has one sub-document of counts per field
+COUNTED_FIELDS = ("status", "callStatus")
+
+def order_day(created_at: datetime) -> datetime:
+    """Get the UTC day an order is counted under"""
+    return datetime(created_at.year, created_at.month, created_at.day)
+
+def stats_id(store_id: str, day: datetime) -> str:
+    return f"{store_id}:{day:%Y-%m-%d}"
+
+def counter(field: str, value: Any) -> str:
+    """Name the counter for a field value; enum members count under their value"""
+    return f"{field}.{getattr(value, 'value', value)}"
+
+class OrderStats:
+    """Per-store daily order counters by status and callStatus, kept current with $inc"""
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.daily = database.db.order_daily_stats
+
+    async def create_indexes(self):
+        await self.daily.create_index([("storeId", ASCENDING), ("day", ASCENDING)])
+
+    @staticmethod
+    def _changes(before: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, int]:
+        inc: Dict[str, int] = {}
+        for field in COUNTED_FIELDS:
+            if field in changes and changes[field] != before.get(field):
+                if before.get(field):
+                    inc[counter(field, before[field])] = -1
+                inc[counter(field, changes[field])] = 1
+        return inc
+
+    async def _apply(self, increments: Dict[Tuple[str, datetime], Dict[str, int]]) -> None:
+        requests = [
+            UpdateOne(
+                {"_id": stats_id(store_id, day)},
+                {"$inc": inc, "$setOnInsert": {"storeId": store_id, "day": day}},
+                upsert=True
+            )
+            for (store_id, day), inc in increments.items() if inc
+        ]
+        if requests:
+            await self.daily.bulk_write(requests, ordered=False)
+            metrics.incr("order_stats.increments", len(requests))
+
+    async def record_created(self, order: Dict[str, Any]) -> None:
+        """Count a new order"""
+        await self.record_created_many([order])
+
+    async def record_created_many(self, orders: Iterable[Dict[str, Any]]) -> None:
+        """Count new orders, one bulk write per batch"""
+        increments: Dict[Tuple[str, datetime], Dict[str, int]] = {}
+        for order in orders:
+            merged = increments.setdefault((order["storeId"], order_day(order["createdAt"])), {})
+            names = ["orders"] + [counter(field, order[field]) for field in COUNTED_FIELDS if order.get(field)]
+            for name in names:
+                merged[name] = merged.get(name, 0) + 1
+        await self._apply(increments)
+
+    async def record_change(self, before: Optional[Dict[str, Any]], changes: Dict[str, Any]) -> None:
+        """Move an order's counts from its previous state to the changed one"""
+        if before:
+            await self.record_changes([before], changes)
+
+    async def record_changes(self, befores: Iterable[Dict[str, Any]], changes: Dict[str, Any]) -> None:
+        """Apply the same change to many orders, one bulk write per batch"""
+        increments: Dict[Tuple[str, datetime], Dict[str, int]] = {}
+        for before in befores:
+            if not before.get("storeId") or not before.get("createdAt"):
+                continue
+            key = (before["storeId"], order_day(before["createdAt"]))
+            merged = increments.setdefault(key, {})
+            for name, value in self._changes(before, changes).items():
+                merged[name] = merged.get(name, 0) + value
+        await self._apply(increments)
+
+    async def get_stats(self, store_id: str, start: datetime, end: datetime) -> Dict[str, Any]:
+        """Get daily counts and totals for orders created in [start, end)"""
+        days = await self.daily.find(
+            {"storeId": store_id, "day": {"$gte": order_day(start), "$lt": end}},
+            {"_id": 0, "storeId": 0}
+        ).sort("day", ASCENDING).to_list(length=None)
+
+        totals: Dict[str, Any] = {"orders": 0, "status": {}, "callStatus": {}}
+        for day in days:
+            totals["orders"] += day.get("orders", 0)
+            for field in COUNTED_FIELDS:
+                for value, count in (day.get(field) or {}).items():
+                    totals[field][value] = totals[field].get(value, 0) + count
+
+        status = totals["status"]
+        call_status = totals["callStatus"]
+        answered = status.get("confirmed", 0) + status.get("cancelled", 0) + status.get("support", 0)
+        dialed = call_status.get("completed", 0) + call_status.get("failed", 0)
+        return {
+            "days": days,
+            "totals": totals,
+            "confirmationRate": status.get("confirmed", 0) / totals["orders"] if totals["orders"] else 0.0,
+            "cancellationRate": status.get("cancelled", 0) / totals["orders"] if totals["orders"] else 0.0,
+            "answerRate": answered / totals["orders"] if totals["orders"] else 0.0,
+            "callSuccessRate": call_status.get("completed", 0) / dialed if dialed else 0.0
+        }
+
+    async def rebuild(self, store_ids: Optional[List[str]] = None, batch_size: int = ORDER_STATS_REBUILD_BATCH) -> int:
+        """Recompute the counters from the orders collection, a batch of stores at a time"""
+        if store_ids is None:
+            store_ids = [store_id for store_id in await self.db.orders.distinct("storeId") if store_id]
+
+        rebuilt = 0
+        for start in range(0, len(store_ids), batch_size):
+            batch = store_ids[start:start + batch_size]
+            pipeline = [
+                {"$match": {"storeId": {"$in": batch}}},
+                {"$group": {
+                    "_id": {
+                        "storeId": "$storeId",
+                        "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$createdAt"}},
+                        "status": "$status",
+                        "callStatus": "$callStatus"
+                    },
+                    "count": {"$sum": 1}
+                }}
+            ]
+            docs: Dict[str, Dict[str, Any]] = {}
+            async for group in self.db.orders.aggregate(pipeline, allowDiskUse=True):
+                key = group["_id"]
+                day = datetime.strptime(key["day"], "%Y-%m-%d")
+                doc = docs.setdefault(stats_id(key["storeId"], day), {
+                    "storeId": key["storeId"],
+                    "day": day,
+                    "orders": 0,
+                    "status": {},
+                    "callStatus": {}
+                })
+                doc["orders"] += group["count"]
+                for field in COUNTED_FIELDS:
+                    if key.get(field):
+                        doc[field][key[field]] = doc[field].get(key[field], 0) + group["count"]
+
+            # Days without orders any more disappear; the rest are replaced wholesale
+            await self.daily.delete_many({"storeId": {"$in": batch}, "_id": {"$nin": list(docs)}})
+            if docs:
+                await self.daily.bulk_write(
+                    [ReplaceOne({"_id": doc_id}, doc, upsert=True) for doc_id, doc in docs.items()],
+                    ordered=False
+                )
+            rebuilt += len(docs)
+        return rebuilt
@@ -0,0 +1,114 @@
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+from typing import Dict, Any, Optional, Tuple
+from metrics import metrics
+import multiprocessing
+import asyncio
+import os
+
+# Password hashing configuration; hashes with any other cost are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "100"))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5"))  # seconds
+
+# Pinning min and max rounds makes verify_and_update flag hashes with a different cost
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+class PasswordHasherBusy(Exception):
+    """Raised when password work cannot start within the queue timeout"""
+
+def _warm_up() -> None:
+    pass
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool so logins never block the event loop"""
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+        queue_timeout: float = PASSWORD_HASH_QUEUE_TIMEOUT
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        """Start the worker processes"""
+        # Spawned workers don't inherit the Mongo client or dialer threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _warm_up) for _ in range(self.workers)
+        ])
+
+    async def stop(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        # Shed load instead of letting a login storm queue without bound
+        if self.waiting >= self.max_pending:
+            metrics.incr("auth.password_hash_rejected")
+            raise PasswordHasherBusy("Too many pending password checks")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("auth.password_hash_rejected")
+            raise PasswordHasherBusy("Timed out waiting for a password worker")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured cost"""
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Check a password and get a replacement hash if its cost is out of date"""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed_password)
+        if new_hash:
+            metrics.incr("auth.password_rehashed")
+        return valid, new_hash
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get worker utilisation"""
+        return {
+            "workers": self.workers,
+            "rounds": BCRYPT_ROUNDS,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": metrics.get("auth.password_hash_rejected"),
+            "rehashed": metrics.get("auth.password_rehashed")
+        }
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+from models import User
+from metrics import metrics
+import os
+import time
+
+# Principal cache configuration; entries never outlive the token's exp
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))  # seconds
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+class PrincipalCache:
+    """LRU of verified users keyed by access token"""
+
+    def __init__(self, ttl: int = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()
+        self._tokens_by_subject: Dict[str, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[User]:
+        """Get the user for a token that was verified recently"""
+        entry = self._entries.get(token)
+        if entry is None:
+            metrics.incr("auth.principal_cache_misses")
+            return None
+
+        user, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            metrics.incr("auth.principal_cache_misses")
+            return None
+
+        self._entries.move_to_end(token)
+        metrics.incr("auth.principal_cache_hits")
+        return user
+
+    def put(self, token: str, user: User, token_exp: float) -> None:
+        """Cache a verified user until the TTL or the token's exp, whichever is first"""
+        expires_at = min(time.time() + self.ttl, token_exp)
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (user, expires_at)
+        self._tokens_by_subject.setdefault(user.email, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_subject(self, email: str) -> None:
+        """Drop every cached token for a user"""
+        for token in list(self._tokens_by_subject.get(email, ())):
+            self._remove(token)
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_subject.get(entry[0].email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_subject[entry[0].email]
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get cache size and hit rate"""
+        hits = metrics.get("auth.principal_cache_hits")
+        misses = metrics.get("auth.principal_cache_misses")
+        return {
+            "size": len(self._entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
@@ -0,0 +1,35 @@
+"""Recompute the order_daily_stats rollups from the orders collection.
+
+Run after importing orders outside the API or if the counters are suspected to drift.
+Transitions applied while a store's batch is being rebuilt may be lost; run it off-peak.
+
+Usage:
+
+    python rebuild_order_stats.py [--store STORE_ID ...]
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from typing import List, Optional
+from dotenv import load_dotenv
+from database import Database
+from order_stats import OrderStats
+import argparse
+import asyncio
+import sys
+import os
+
+async def main(store_ids: Optional[List[str]]) -> int:
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    db = Database(client, os.getenv("MONGODB_DB", "shopify_voice"))
+    try:
+        stats = OrderStats(db)
+        await stats.create_indexes()
+        print(f"Rebuilt {await stats.rebuild(store_ids)} daily order rollups")
+        return 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--store", action="append", dest="store_ids", help="only rebuild this store")
+    sys.exit(asyncio.run(main(parser.parse_args().store_ids)))
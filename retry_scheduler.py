@@ -0,0 +1,213 @@
+from pymongo import ASCENDING, ReturnDocument
+from typing import Dict, Any, Optional, List
+from datetime import datetime, timedelta
+from database import Database, new_dial_owner, ORDER_DIAL_PROJECTION, ORDER_STATS_PROJECTION, DIAL_CLAIM_FIELDS
+from dialer import Dialer, record_call_result
+from order_stats import OrderStats
+from metrics import metrics
+import asyncio
+import uuid
+import os
+
+# Retry scheduler configuration
+RETRY_BATCH_SIZE = int(os.getenv("RETRY_BATCH_SIZE", "100"))
+RETRY_POLL_INTERVAL = float(os.getenv("RETRY_POLL_INTERVAL", "5"))  # seconds
+RETRY_CLAIM_LEASE = int(os.getenv("RETRY_CLAIM_LEASE", "120"))  # seconds
+
+class RetryScheduler:
+    """Persistent call retry scheduler driven by Store.voiceSettings"""
+
+    def __init__(
+        self,
+        db: Database,
+        dialer: Dialer,
+        order_stats: OrderStats,
+        batch_size: int = RETRY_BATCH_SIZE,
+        poll_interval: float = RETRY_POLL_INTERVAL,
+        claim_lease: int = RETRY_CLAIM_LEASE
+    ):
+        self.db = db
+        self.dialer = dialer
+        self.order_stats = order_stats
+        self.jobs = db.db.call_retries
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_lease = claim_lease
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def create_indexes(self):
+        # Due jobs are found through nextAttemptAt; an order has at most one pending retry
+        await self.jobs.create_index([("nextAttemptAt", ASCENDING)])
+        await self.jobs.create_index("orderId", unique=True)
+        await self.jobs.create_index("claimToken", sparse=True)
+
+    async def schedule(self, order_id: str, store: Dict[str, Any], attempt: int) -> bool:
+        """Schedule retry number `attempt` for an order, unless the store's limit is reached"""
+        settings = store.get("voiceSettings") or {}
+        max_attempts = int(settings.get("retryAttempts", 3))
+        if attempt > max_attempts:
+            metrics.incr("retries.exhausted")
+            return False
+
+        # Back off from the store's base delay on every further attempt
+        delay = int(settings.get("retryDelay", 300)) * float(settings.get("retryBackoff", 2)) ** (attempt - 1)
+        await self.jobs.update_one(
+            {"orderId": order_id},
+            {"$set": {
+                "orderId": order_id,
+                "storeId": str(store["_id"]),
+                "attempt": attempt,
+                "maxAttempts": max_attempts,
+                "nextAttemptAt": datetime.utcnow() + timedelta(seconds=delay),
+                "claimToken": None
+            }},
+            upsert=True
+        )
+        metrics.incr("retries.scheduled")
+        return True
+
+    async def schedule_next(self, order: Dict[str, Any]) -> bool:
+        """Schedule an order's next retry after a failed or unanswered call"""
+        store = await self.db.get_store(order["storeId"], {"voiceSettings": 1})
+        if not store:
+            return False
+        return await self.schedule(str(order["_id"]), store, order.get("retryAttempt", 0) + 1)
+
+    async def cancel(self, order_id: str) -> None:
+        """Drop any pending retry for an order"""
+        await self.jobs.delete_one({"orderId": order_id})
+
+    async def claim_due(self) -> List[Dict[str, Any]]:
+        """Atomically claim a batch of due jobs for this worker"""
+        now = datetime.utcnow()
+        cursor = self.jobs.find(
+            {"nextAttemptAt": {"$lte": now}},
+            {"_id": 1}
+        ).sort("nextAttemptAt", ASCENDING).limit(self.batch_size)
+        ids = [job["_id"] async for job in cursor]
+        if not ids:
+            return []
+
+        # Re-check due-ness in the update so concurrent workers never claim the same job;
+        # pushing nextAttemptAt forward doubles as the lease for crashed workers
+        token = uuid.uuid4().hex
+        await self.jobs.update_many(
+            {"_id": {"$in": ids}, "nextAttemptAt": {"$lte": now}},
+            {"$set": {
+                "claimToken": token,
+                "nextAttemptAt": now + timedelta(seconds=self.claim_lease)
+            }}
+        )
+        return await self.jobs.find({"claimToken": token}).to_list(length=self.batch_size)
+
+    async def reclaim_expired_dials(self) -> int:
+        """Count dials whose claim, and placed calls whose final callback, outlived the lease as failed and retry them"""
+        now = datetime.utcnow()
+        # A status callback can finish the call before its owner died; only the stale claim goes
+        await self.db.orders.update_many(
+            {"dialLeaseUntil": {"$lt": now}, "callStatus": {"$ne": "calling"}},
+            {"$unset": {name: "" for name in (*DIAL_CLAIM_FIELDS, "campaignClaim")}}
+        )
+        expired = await self.db.orders.find(
+            {"dialLeaseUntil": {"$lt": now}, "callStatus": "calling"},
+            {"storeId": 1, "dialOwner": 1, "retryAttempt": 1}
+        ).limit(self.batch_size).to_list(length=self.batch_size)
+        reclaimed = 0
+        for order in expired:
+            # Only one worker takes over each dead claim; a live owner renewing its lease keeps it.
+            # A placed call has no owner left, and a new dial of the order replaces its lease
+            previous = await self.db.orders.find_one_and_update(
+                {
+                    "_id": order["_id"],
+                    "dialOwner": order.get("dialOwner"),
+                    "dialLeaseUntil": {"$lt": now},
+                    "callStatus": "calling"
+                },
+                {
+                    "$set": {"callStatus": "failed"},
+                    "$unset": {name: "" for name in (*DIAL_CLAIM_FIELDS, "campaignClaim")}
+                },
+                projection=ORDER_STATS_PROJECTION,
+                return_document=ReturnDocument.BEFORE
+            )
+            if not previous:
+                continue
+            reclaimed += 1
+            metrics.incr("retries.reclaimed_dials" if order.get("dialOwner") else "retries.expired_calls")
+            await self.order_stats.record_change(previous, {"callStatus": "failed"})
+            await self.schedule_next(order)
+        return reclaimed
+
+    async def run_once(self) -> int:
+        """Claim and dial one batch of due retries"""
+        await self.reclaim_expired_dials()
+        jobs = await self.claim_due()
+        results = await asyncio.gather(*(self._fire(job) for job in jobs), return_exceptions=True)
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                # The claim lease expires and the job is picked up again
+                print(f"Error retrying call for order {job['orderId']}: {str(result)}")
+        return len(jobs)
+
+    async def _fire(self, job: Dict[str, Any]) -> None:
+        owner = new_dial_owner()
+        order = await self.db.claim_order_for_dial(
+            job["orderId"], owner, expected={"status": "pending"}, projection=ORDER_DIAL_PROJECTION
+        )
+        if not order:
+            # Customer already answered, the order is gone, or another call is in progress
+            await self.jobs.delete_one({"_id": job["_id"], "claimToken": job["claimToken"]})
+            return
+        await self.order_stats.record_change(order, {"callStatus": "calling"})
+
+        metrics.incr("retries.fired")
+        call = await self.dialer.dial(
+            order["customerPhone"], order["orderNumber"], order["storeId"], (job["orderId"], owner)
+        )
+        await record_call_result(
+            self.db, self.order_stats, job["orderId"], call, {"retryAttempt": job["attempt"]},
+            unset=DIAL_CLAIM_FIELDS, owner=owner
+        )
+        await self.jobs.delete_one({"_id": job["_id"], "claimToken": job["claimToken"]})
+
+        if call["status"] == "failed":
+            store = await self.db.get_store(job["storeId"])
+            if store:
+                await self.schedule(job["orderId"], store, job["attempt"] + 1)
+
+    def start(self):
+        """Start polling for due retries"""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop polling after the current batch"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                print(f"Error running call retries: {str(e)}")
+                claimed = 0
+
+            # Keep draining while full batches are due
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get pending and due retry counts"""
+        return {
+            "pending": await self.jobs.estimated_document_count(),
+            "reclaimed_dials": metrics.get("retries.reclaimed_dials"),
+            "expired_calls": metrics.get("retries.expired_calls"),
+            "due": await self.jobs.count_documents({"nextAttemptAt": {"$lte": datetime.utcnow()}})
+        }
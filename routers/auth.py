@@ -1,12 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from typing import Any
-from models import User, Token
-from database import Database
+from typing import Any, Awaitable, TypeVar
+from models import User, UserCreate, UserUpdate, Token
+from database import Database, get_database, ID_PROJECTION
+from password_hasher import PasswordHasherBusy
 from auth import (
-    verify_password,
-    get_password_hash,
     create_access_token,
     get_current_active_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
@@ -14,8 +13,24 @@ from auth import (
 
 router = APIRouter()
 
+T = TypeVar("T")
+
+async def _password_work(work: Awaitable[T]) -> T:
+    try:
+        return await work
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in attempts, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+
 @router.post("/register", response_model=User)
-async def register(user_data: User, db: Database = Depends()) -> Any:
+async def register(
+    user_data: UserCreate,
+    request: Request,
+    db: Database = Depends(get_database)
+) -> Any:
     """Register a new user"""
     # Check if user already exists
     if await db.get_user_by_email(user_data.email):
@@ -26,23 +41,38 @@ async def register(user_data: User, db: Database = Depends()) -> Any:
     
     # Create new user
     user_dict = user_data.dict()
-    user_dict["hashed_password"] = get_password_hash(user_dict.pop("password"))
-    user = await db.create_user(user_dict)
+    user_dict["hashed_password"] = await _password_work(
+        request.app.password_hasher.hash(user_dict.pop("password"))
+    )
+    user = await db.create_user(User(**user_dict).dict(exclude={"id"}))
+    user["_id"] = str(user["_id"])
     return user
 
 @router.post("/token", response_model=Token)
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Any:
     """Login user and return access token"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect email or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
     user = await db.get_user_by_email(form_data.username)
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    if not user:
+        raise credentials_exception
+
+    valid, new_hash = await _password_work(
+        request.app.password_hasher.verify_and_update(form_data.password, user["hashed_password"])
+    )
+    if not valid:
+        raise credentials_exception
+
+    # Upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        await db.update_user(str(user["_id"]), {"hashed_password": new_hash}, ID_PROJECTION)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -60,12 +90,14 @@ async def read_users_me(
 
 @router.put("/me", response_model=User)
 async def update_user(
-    user_data: User,
+    user_data: UserUpdate,
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Any:
     """Update current user information"""
-    if user_data.email != current_user.email:
+    # Only the email and password are the user's to change; store_id is set when a store is connected
+    if user_data.email and user_data.email != current_user.email:
         # Check if new email is already taken
         if await db.get_user_by_email(user_data.email):
             raise HTTPException(
@@ -73,9 +105,15 @@ async def update_user(
                 detail="Email already registered"
             )
     
-    update_data = user_data.dict(exclude_unset=True)
+    update_data = user_data.dict(exclude_none=True)
     if "password" in update_data:
-        update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await _password_work(
+            request.app.password_hasher.hash(update_data.pop("password"))
+        )
     
     updated_user = await db.update_user(current_user.id, update_data)
+    updated_user["_id"] = str(updated_user["_id"])
+    
+    # Cached principals for this user are stale now
+    request.app.principal_cache.invalidate_subject(current_user.email)
     return updated_user 
\ No newline at end of file
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from typing import Any, Dict
+from models import CampaignCreate
+from auth import get_current_store_id
+from bson.errors import InvalidId
+
+router = APIRouter()
+
+def _campaign_response(campaign: Dict[str, Any]) -> Dict[str, Any]:
+    campaign = dict(campaign)
+    campaign["id"] = str(campaign.pop("_id"))
+    campaign.pop("leaseUntil", None)
+    campaign.pop("runnerId", None)
+    return campaign
+
+async def _change_state(request: Request, campaign_id: str, store_id: str, action: str) -> Dict[str, Any]:
+    manager = request.app.campaigns
+    try:
+        campaign = await getattr(manager, action)(campaign_id, store_id)
+        if campaign:
+            return _campaign_response(campaign)
+        exists = await manager.get(campaign_id, store_id) is not None
+    except InvalidId:
+        exists = False
+
+    if not exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Campaign not found"
+        )
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Campaign cannot {action} from its current state"
+    )
+
+@router.post("/")
+async def create_campaign(
+    campaign: CampaignCreate,
+    request: Request,
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Start calling all orders that match a filter"""
+    # Campaigns only ever select orders from the caller's own store
+    campaign.storeId = store_id
+    created = await request.app.campaigns.create(campaign)
+    return _campaign_response(created)
+
+@router.get("/")
+async def get_campaigns(
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Get recent campaigns"""
+    campaigns = await request.app.campaigns.get_campaigns(store_id, limit)
+    return [_campaign_response(campaign) for campaign in campaigns]
+
+@router.get("/{campaign_id}")
+async def get_campaign(
+    campaign_id: str,
+    request: Request,
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Get campaign progress"""
+    try:
+        campaign = await request.app.campaigns.get(campaign_id, store_id)
+    except InvalidId:
+        campaign = None
+    if not campaign:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Campaign not found"
+        )
+    return _campaign_response(campaign)
+
+@router.post("/{campaign_id}/pause")
+async def pause_campaign(
+    campaign_id: str,
+    request: Request,
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Pause a running campaign"""
+    return await _change_state(request, campaign_id, store_id, "pause")
+
+@router.post("/{campaign_id}/resume")
+async def resume_campaign(
+    campaign_id: str,
+    request: Request,
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Resume a paused campaign"""
+    return await _change_state(request, campaign_id, store_id, "resume")
+
+@router.post("/{campaign_id}/cancel")
+async def cancel_campaign(
+    campaign_id: str,
+    request: Request,
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Cancel a campaign"""
+    return await _change_state(request, campaign_id, store_id, "cancel")
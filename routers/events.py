@@ -0,0 +1,97 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional, Set, AsyncIterator
+from auth import get_current_store_id, authenticate_token
+from order_events import DROPPED_MESSAGE, Subscription
+import asyncio
+import os
+
+router = APIRouter()
+
+# Idle connections get a keepalive so proxies keep them open and dead clients are noticed
+ORDER_EVENTS_KEEPALIVE = float(os.getenv("ORDER_EVENTS_KEEPALIVE", "15"))  # seconds
+
+def _status_set(value: Optional[str]) -> Optional[Set[str]]:
+    """Parse a comma-separated status filter"""
+    if not value:
+        return None
+    return {part.strip() for part in value.split(",") if part.strip()}
+
+@router.get("/orders")
+async def stream_order_events(
+    request: Request,
+    order_status: Optional[str] = Query(None, alias="status"),
+    call_status: Optional[str] = None,
+    resume: Optional[str] = None,
+    store_id: str = Depends(get_current_store_id)
+) -> StreamingResponse:
+    """Stream order changes for the store as server-sent events"""
+    # Browsers resend the last event id on reconnect
+    resume_token = resume or request.headers.get("Last-Event-ID")
+    hub = request.app.order_events
+    subscription = hub.subscribe(store_id, _status_set(order_status), _status_set(call_status), resume_token)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), ORDER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    yield f"event: dropped\ndata: {DROPPED_MESSAGE}\n\n"
+                    break
+                token, data = message
+                yield f"id: {token}\ndata: {data}\n\n" if token else f"data: {data}\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/orders/ws")
+async def order_events_socket(
+    websocket: WebSocket,
+    token: str,
+    order_status: Optional[str] = Query(None, alias="status"),
+    call_status: Optional[str] = None,
+    resume: Optional[str] = None
+):
+    """Push order changes for the store over a WebSocket"""
+    # Browsers cannot set headers on WebSockets, so the access token comes in the query
+    try:
+        user = await authenticate_token(websocket.app, token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    if not user.is_active or not user.store_id:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    hub = websocket.app.order_events
+    subscription: Subscription = hub.subscribe(
+        user.store_id, _status_set(order_status), _status_set(call_status), resume
+    )
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), ORDER_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await websocket.send_text('{"type": "keepalive"}')
+                continue
+            if message is None:
+                await websocket.send_text(DROPPED_MESSAGE)
+                await websocket.close(code=1013)
+                break
+            await websocket.send_text(message[1])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+from typing import Any
+from models import User
+from auth import get_current_active_user
+from metrics import metrics
+
+router = APIRouter()
+
+@router.get("/")
+async def get_metrics(current_user: User = Depends(get_current_active_user)) -> Any:
+    """Get counters and gauges for scaling and monitoring"""
+    return await metrics.snapshot()
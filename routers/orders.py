@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional, Any
-from models import Order, User
-from database import Database
-from auth import get_current_active_user
-from voice_service import VoiceService
-import asyncio
+from datetime import datetime, timedelta
+from models import Order, OrderStatus, OrderPage, CallHistoryPage, OrderStatsSummary
+from database import (
+    Database, get_database, new_dial_owner, ORDER_LIST_PROJECTION, ORDER_DIAL_PROJECTION, ID_PROJECTION, DIAL_CLAIM_FIELDS
+)
+from serialization import DocumentResponse, order_serializer
+from dialer import record_call_result
+from auth import get_current_store_id
 
 router = APIRouter()
-voice_service = VoiceService()
+
+# Fields the call-status route serves; kept current by Twilio status callbacks
+CALL_STATUS_PROJECTION = {"call_sid": 1, "callStatus": 1, "lastCallStatus": 1, "lastCallDuration": 1, "lastCallAt": 1}
 
 @router.get("/", response_model=List[Order])
 async def get_orders(
@@ -15,92 +20,164 @@ async def get_orders(
     limit: int = Query(10, ge=1, le=100),
     status: Optional[str] = None,
     call_status: Optional[str] = None,
-    current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
 ) -> Any:
     """Get list of orders"""
-    orders = await db.get_orders(skip, limit, status, call_status)
-    return orders
+    # Documents come from our own collection, so they are shaped and encoded without re-validation
+    orders = await db.get_orders(store_id, skip, limit, status, call_status)
+    return DocumentResponse(order_serializer.shape_many(orders))
+
+@router.get("/page", response_model=OrderPage)
+async def get_orders_page(
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    order_status: Optional[str] = Query(None, alias="status"),
+    call_status: Optional[str] = None,
+    include_total: bool = False,
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
+) -> Any:
+    """Get a page of orders, newest first, using an opaque cursor"""
+    try:
+        orders, next_cursor = await db.get_orders_page(store_id, limit, cursor, order_status, call_status)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    estimated_total = None
+    if include_total:
+        estimated_total = await db.estimate_order_count(store_id, order_status, call_status)
+    
+    return DocumentResponse({
+        "items": order_serializer.shape_many(orders),
+        "next_cursor": next_cursor,
+        "estimated_total": estimated_total
+    })
+
+@router.get("/stats", response_model=OrderStatsSummary)
+async def get_order_stats(
+    request: Request,
+    days: int = Query(30, ge=1, le=366),
+    store_id: str = Depends(get_current_store_id)
+) -> Any:
+    """Get daily order counts and rates for the last few days"""
+    now = datetime.utcnow()
+    end = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return await request.app.order_stats.get_stats(store_id, end - timedelta(days=days), end)
 
 @router.get("/{order_id}", response_model=Order)
 async def get_order(
     order_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
 ) -> Any:
     """Get order details"""
-    order = await db.get_order(order_id)
+    order = await db.get_order(order_id, store_id, ORDER_LIST_PROJECTION)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
-    return order
+    return DocumentResponse(order_serializer.shape(order))
 
-@router.post("/{order_id}/call")
-async def initiate_call(
+@router.get("/{order_id}/calls", response_model=CallHistoryPage)
+async def get_call_history(
     order_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
 ) -> Any:
-    """Initiate a manual call for an order"""
-    order = await db.get_order(order_id)
-    if not order:
+    """Get an order's call events, newest first, using an opaque cursor"""
+    if not await db.get_order(order_id, store_id, ID_PROJECTION):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
     
-    if order["callStatus"] == "calling":
+    try:
+        events, next_cursor = await request.app.call_history.get_page(order_id, limit, cursor)
+    except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Call already in progress"
+            detail=str(e)
+        )
+    return {"items": events, "next_cursor": next_cursor}
+
+@router.post("/{order_id}/call")
+async def initiate_call(
+    order_id: str,
+    request: Request,
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
+) -> Any:
+    """Initiate a manual call for an order"""
+    # Claim the order for this dial only if no call is in progress; concurrent clicks and workers get one claim
+    owner = new_dial_owner()
+    order = await db.claim_order_for_dial(order_id, owner, store_id, projection=ORDER_DIAL_PROJECTION)
+    if not order:
+        if await db.get_order(order_id, store_id, ID_PROJECTION):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Call already in progress"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found"
         )
     
-    # Update order status
-    await db.update_order(order_id, {"callStatus": "calling"})
+    await request.app.order_stats.record_change(order, {"callStatus": "calling"})
     
-    # Initiate call
-    call_result = voice_service.make_call(
+    # Initiate call through the rate-limited dialer
+    call_result = await request.app.dialer.dial(
         order["customerPhone"],
-        order["orderNumber"]
+        order["orderNumber"],
+        store_id,
+        (order_id, owner)
     )
     
-    # Update order with call information
-    await db.update_order(order_id, {
-        "callStatus": call_result["status"],
-        "lastCallAt": call_result["timestamp"]
-    })
+    # Update order with call information and release the claim; status callbacks take it from here
+    await record_call_result(db, request.app.order_stats, order_id, call_result, unset=DIAL_CLAIM_FIELDS, owner=owner)
+    if call_result["status"] == "failed":
+        await request.app.retry_scheduler.schedule_next(order)
     
     return call_result
 
-@router.put("/{order_id}/status")
+@router.put("/{order_id}/status", response_model=Order)
 async def update_order_status(
     order_id: str,
-    status: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    request: Request,
+    new_status: OrderStatus = Query(..., alias="status"),
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
 ) -> Any:
     """Update order status"""
-    order = await db.get_order(order_id)
-    if not order:
+    # Stored as the plain value; it also names the rollup counter
+    value = new_status.value
+    previous = await db.update_order(
+        order_id, {"status": value}, store_id, projection=ORDER_LIST_PROJECTION, return_previous=True
+    )
+    if not previous:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
-    
-    # Update order status
-    updated_order = await db.update_order(order_id, {"status": status})
-    return updated_order
+    await request.app.order_stats.record_change(previous, {"status": value})
+    await request.app.shopify_writeback.enqueue(previous, value)
+    return DocumentResponse(order_serializer.shape({**previous, "status": value}))
 
 @router.get("/{order_id}/call-status")
 async def get_call_status(
     order_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    store_id: str = Depends(get_current_store_id),
+    db: Database = Depends(get_database)
 ) -> Any:
     """Get call status for an order"""
-    order = await db.get_order(order_id)
+    order = await db.get_order(order_id, store_id, CALL_STATUS_PROJECTION)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -113,11 +190,10 @@ async def get_call_status(
             detail="No call initiated for this order"
         )
     
-    call_status = voice_service.get_call_status(order["call_sid"])
-    if not call_status:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Call not found"
-        )
-    
-    return call_status 
\ No newline at end of file
+    return {
+        "call_sid": order["call_sid"],
+        "status": order.get("lastCallStatus") or order["callStatus"],
+        "callStatus": order["callStatus"],
+        "duration": order.get("lastCallDuration"),
+        "timestamp": order.get("lastCallAt")
+    } 
\ No newline at end of file
@@ -1,14 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
 from fastapi.responses import RedirectResponse
-from typing import Dict, Any
-from models import User, Store
-from database import Database
-from shopify_service import ShopifyService
-from auth import get_current_active_user
+from typing import Dict, Any, List, Optional
+from models import User, Store, BackfillProgress, WritebackState
+from database import Database, get_database, ID_PROJECTION
+from shopify_service import ShopifyService, WebhookTooLarge, SHOPIFY_WEBHOOK_MAX_BYTES
+from auth import get_current_active_user, create_connect_state, verify_connect_state
 import os
 
 router = APIRouter()
-db = Database()
 
 # Required Shopify scopes
 SHOPIFY_SCOPES = [
@@ -20,11 +19,18 @@ SHOPIFY_SCOPES = [
     "read_shopify_payments_disputes"
 ]
 
+def _backfill_response(progress: Dict[str, Any]) -> Dict[str, Any]:
+    return {**progress, "storeId": progress["_id"]}
+
 @router.get("/auth")
-async def shopify_auth(shop: str):
+async def shopify_auth(
+    shop: str,
+    current_user: User = Depends(get_current_active_user)
+):
     """Generate Shopify OAuth URL"""
     redirect_uri = f"{os.getenv('BACKEND_URL')}/api/shopify/callback"
-    auth_url = ShopifyService.generate_auth_url(shop, SHOPIFY_SCOPES, redirect_uri)
+    # The signed state carries the user through Shopify, so the callback knows whose store this is
+    auth_url = ShopifyService.generate_auth_url(shop, SHOPIFY_SCOPES, redirect_uri, create_connect_state(current_user.id))
     return {"auth_url": auth_url}
 
 @router.get("/callback")
@@ -32,32 +38,49 @@ async def shopify_callback(
     shop: str,
     code: str,
     state: str,
-    db: Database = Depends()
+    request: Request,
+    db: Database = Depends(get_database)
 ):
     """Handle Shopify OAuth callback"""
+    user_id = verify_connect_state(state)
+    user = await db.get_user(user_id, {"email": 1}) if user_id else None
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired connect state"
+        )
+    
     try:
         # Exchange code for access token
         token_data = await ShopifyService.get_access_token(shop, code)
         
-        # Initialize Shopify service
-        shopify_service = ShopifyService(shop, token_data["access_token"])
-        
-        # Get shop info
-        shop_info = shopify_service.get_shop_info()
+        # Get the pooled client for this shop
+        client = await request.app.shopify_clients.get(shop, token_data["access_token"])
         
         # Create webhook for new orders
         webhook_url = f"{os.getenv('BACKEND_URL')}/api/shopify/webhook"
-        webhook = shopify_service.create_webhook("orders/create", webhook_url)
+        webhook = await client.create_webhook("orders/create", webhook_url)
         
-        # Save store information
+        # Save store information; reinstalling a shop updates its store
         store = Store(
-            shop_id=shop_info["id"],
-            shop_name=shop_info["name"],
-            shop_domain=shop_info["domain"],
-            access_token=token_data["access_token"],
-            webhook_id=webhook["id"]
+            shopifyDomain=shop,
+            accessToken=token_data["access_token"],
+            webhookSecret=os.getenv("SHOPIFY_API_SECRET", ""),
+            webhookId=str(webhook["id"])
+        )
+        credentials = {"accessToken", "webhookSecret", "webhookId"}
+        saved = await db.connect_store(
+            shop,
+            store.dict(include=credentials),
+            store.dict(exclude={"id", "updatedAt", *credentials})
         )
-        await db.create_store(store)
+        
+        # The store is scoped to the user who authorized it, never to a client-supplied id
+        await db.update_user(user_id, {"store_id": str(saved["_id"])}, ID_PROJECTION)
+        request.app.principal_cache.invalidate_subject(user["email"])
+        
+        # Import the orders placed before install in the background
+        await request.app.backfills.schedule(str(saved["_id"]), shop)
         
         # Redirect to frontend
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
@@ -71,7 +94,7 @@ async def shopify_callback(
 
 @router.post("/webhook")
 async def shopify_webhook(request: Request):
-    """Handle Shopify webhooks"""
+    """Verify a Shopify webhook and queue it for processing"""
     # Get HMAC header
     hmac_header = request.headers.get("X-Shopify-Hmac-Sha256")
     if not hmac_header:
@@ -80,78 +103,177 @@ async def shopify_webhook(request: Request):
             detail="Missing HMAC header"
         )
     
-    # Get request body
-    body = await request.body()
+    # Refuse oversized bodies before reading them when the length is declared
+    if int(request.headers.get("Content-Length") or 0) > SHOPIFY_WEBHOOK_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Webhook body too large"
+        )
+    
+    # Read the body once, hashing it as it streams in; the workers parse it
+    try:
+        body, digest = await ShopifyService.read_webhook(request.stream())
+    except WebhookTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Webhook body too large"
+        )
     
     # Verify webhook
-    if not ShopifyService.verify_webhook(body, hmac_header):
+    if not ShopifyService.verify_webhook_digest(digest, hmac_header):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid webhook signature"
         )
     
-    # Parse webhook data
-    data = await request.json()
+    # Acknowledge repeated deliveries without doing any work
+    webhook_id = request.headers.get("X-Shopify-Webhook-Id")
+    if webhook_id and await request.app.webhook_dedup.seen_before(webhook_id):
+        return {"status": "duplicate"}
     
-    # Handle new order
-    if request.headers.get("X-Shopify-Topic") == "orders/create":
-        # Get store from shop domain
-        shop_domain = request.headers.get("X-Shopify-Shop-Domain")
-        store = await db.get_store_by_domain(shop_domain)
-        
-        if store:
-            # Initialize Shopify service
-            shopify_service = ShopifyService(shop_domain, store.access_token)
-            
-            # Get order details
-            order = shopify_service.get_order(data["id"])
-            
-            if order:
-                # Save order to database
-                await db.create_order(order)
-                
-                # Initiate call
-                from voice_service import VoiceService
-                voice_service = VoiceService()
-                call = voice_service.make_call(order["phone"], order["name"])
-                
-                if call:
-                    # Update order with call information
-                    await db.update_order_call_status(order["id"], call["sid"], "initiated")
+    # Persist the raw delivery and acknowledge; ingest workers do the rest
+    await request.app.ingest_queue.enqueue(
+        topic=request.headers.get("X-Shopify-Topic", ""),
+        shop_domain=request.headers.get("X-Shopify-Shop-Domain", ""),
+        payload=body,
+        headers={
+            "webhookId": webhook_id,
+            "triggeredAt": request.headers.get("X-Shopify-Triggered-At")
+        }
+    )
+    
+    # Only a queued delivery is receipted; until then Shopify's retry gets through
+    if webhook_id:
+        await request.app.webhook_dedup.record(webhook_id)
     
     return {"status": "success"}
 
+@router.get("/ingest/stats")
+async def get_ingest_stats(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get webhook ingest queue depth and age"""
+    return await request.app.ingest_queue.stats()
+
+@router.get("/ingest/dead-letters")
+async def get_dead_letters(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_active_user),
+    db: Database = Depends(get_database)
+):
+    """Get the store's webhook deliveries that failed every processing attempt"""
+    store = await db.get_store(current_user.store_id, {"shopifyDomain": 1}) if current_user.store_id else None
+    if not store:
+        return []
+    letters = await request.app.ingest_queue.list_dead_letters(store["shopifyDomain"], limit)
+    return [{**letter, "_id": str(letter["_id"])} for letter in letters]
+
+@router.post("/ingest/dead-letters/{job_id}/requeue")
+async def requeue_dead_letter(
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: Database = Depends(get_database)
+):
+    """Queue one of the store's dead-lettered webhook deliveries for processing again"""
+    store = await db.get_store(current_user.store_id, {"shopifyDomain": 1}) if current_user.store_id else None
+    if not store or not await request.app.ingest_queue.requeue_dead_letter(job_id, store["shopifyDomain"]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Dead-lettered delivery not found"
+        )
+    return {"status": "requeued"}
+
+@router.post("/backfill", response_model=BackfillProgress)
+async def start_backfill(
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: Database = Depends(get_database)
+):
+    """Import the store's existing orders, unless an import is already running"""
+    store = await db.get_store(current_user.store_id, {"shopifyDomain": 1}) if current_user.store_id else None
+    if not store:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No store connected"
+        )
+    return _backfill_response(await request.app.backfills.schedule(current_user.store_id, store["shopifyDomain"]))
+
+@router.get("/backfill", response_model=BackfillProgress)
+async def get_backfill_progress(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get progress of the store's order import"""
+    progress = await request.app.backfills.get(current_user.store_id) if current_user.store_id else None
+    if not progress:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No order import for this store"
+        )
+    return _backfill_response(progress)
+
+@router.get("/writeback", response_model=List[WritebackState])
+async def get_writeback_states(
+    request: Request,
+    state: Optional[str] = Query(None, pattern="^(pending|synced|failed)$"),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get the store's call outcomes and whether they reached Shopify"""
+    if not current_user.store_id:
+        return []
+    outcomes = await request.app.shopify_writeback.list_outcomes(current_user.store_id, state, limit)
+    return [{**outcome, "orderId": outcome["_id"]} for outcome in outcomes]
+
+@router.post("/writeback/retry")
+async def retry_writebacks(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Queue the store's failed outcomes for another push to Shopify"""
+    if not current_user.store_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No store connected"
+        )
+    return {"requeued": await request.app.shopify_writeback.retry_failed(current_user.store_id)}
+
 @router.get("/store")
 async def get_store_info(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ):
     """Get connected store information"""
-    store = await db.get_store_by_user_id(current_user.id)
+    store = await db.get_store(current_user.store_id) if current_user.store_id else None
     if not store:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No store connected"
         )
     
-    # Initialize Shopify service
-    shopify_service = ShopifyService(store.shop_domain, store.access_token)
-    
     # Get shop info
-    shop_info = shopify_service.get_shop_info()
+    client = await request.app.shopify_clients.get(store["shopifyDomain"], store["accessToken"])
+    shop_info = await client.get_shop_info()
     
+    # Stored ids are ObjectIds; the model carries them as strings
+    store["_id"] = str(store["_id"])
     return {
-        "store": store.dict(),
+        "store": Store(**store).dict(exclude={"accessToken", "webhookSecret"}),
         "shop_info": shop_info
     }
 
 @router.delete("/disconnect")
 async def disconnect_store(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ):
     """Disconnect Shopify store"""
-    store = await db.get_store_by_user_id(current_user.id)
+    store = await db.get_store(current_user.store_id) if current_user.store_id else None
     if not store:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -159,15 +281,15 @@ async def disconnect_store(
         )
     
     try:
-        # Initialize Shopify service
-        shopify_service = ShopifyService(store.shop_domain, store.access_token)
-        
         # Delete webhook
-        if store.webhook_id:
-            shopify_service.delete_webhook(store.webhook_id)
+        if store.get("webhookId"):
+            client = await request.app.shopify_clients.get(store["shopifyDomain"], store["accessToken"])
+            await client.delete_webhook(store["webhookId"])
         
         # Delete store from database
-        await db.delete_store(store.id)
+        await db.delete_store(str(store["_id"]))
+        await db.update_user(current_user.id, {"store_id": None}, ID_PROJECTION)
+        request.app.principal_cache.invalidate_subject(current_user.email)
         
         return {"status": "success"}
         
@@ -1,34 +1,125 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from typing import Any, Dict
 from models import User
-from database import Database
+from database import Database, get_database, ID_PROJECTION, ORDER_STATS_PROJECTION
 from auth import get_current_active_user
-from voice_service import VoiceService
+from twiml_templates import TwimlTemplates
+from twilio.request_validator import RequestValidator
+from datetime import datetime
+from metrics import metrics
 import os
 
 router = APIRouter()
-voice_service = VoiceService()
+twiml = TwimlTemplates()
 
-@router.get("/welcome/{order_number}")
+# Order status recorded for each IVR digit
+DIGIT_STATUSES = {"1": "confirmed", "0": "cancelled", "2": "support"}
+
+# Order callStatus for each Twilio call status
+CALL_STATUSES = {
+    "queued": "calling",
+    "initiated": "calling",
+    "ringing": "calling",
+    "in-progress": "calling",
+    "completed": "completed",
+    "busy": "failed",
+    "no-answer": "failed",
+    "canceled": "failed",
+    "failed": "failed"
+}
+
+# Twilio call statuses of the first callback of a call
+NEW_CALL_STATUSES = {"queued", "initiated"}
+
+# Twilio call statuses that leave the customer unreached and schedule a retry
+RETRY_CALL_STATUSES = {"busy", "no-answer", "failed"}
+
+twilio_validator = RequestValidator(os.getenv("TWILIO_AUTH_TOKEN", ""))
+
+def verify_twilio_request(request: Request, form_data: Dict[str, Any]) -> None:
+    """Raise 401 unless the request came from Twilio for the URL we registered"""
+    url = f"{os.getenv('BASE_URL')}{request.url.path}"
+    if not twilio_validator.validate(url, form_data, request.headers.get("X-Twilio-Signature", "")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Twilio signature"
+        )
+
+@router.api_route("/{store_id}/welcome/{order_number}", methods=["GET", "POST"])
 async def welcome_call(
+    store_id: str,
     order_number: str,
     request: Request,
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Response:
     """Handle welcome call and generate IVR response"""
-    # Generate IVR response
-    response = voice_service.generate_ivr_response(order_number)
-    return Response(content=response, media_type="application/xml")
+    # Render the precompiled IVR response
+    return Response(content=twiml.render_welcome(order_number, store_id), media_type="application/xml")
 
-@router.post("/handle-input/{order_number}")
+@router.post("/{store_id}/status/{order_number}")
+async def call_status_callback(
+    store_id: str,
+    order_number: str,
+    request: Request
+) -> Response:
+    """Record a Twilio call status callback on the order"""
+    form_data = await request.form()
+    
+    # Verify the callback came from Twilio for the URL we registered
+    verify_twilio_request(request, dict(form_data))
+    
+    call_sid = form_data.get("CallSid")
+    twilio_status = form_data.get("CallStatus")
+    if not call_sid or twilio_status not in CALL_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Missing or unknown call status"
+        )
+    
+    duration = form_data.get("CallDuration")
+    sequence = form_data.get("SequenceNumber")
+    summary = {"callStatus": CALL_STATUSES[twilio_status]}
+    if duration:
+        summary["lastCallDuration"] = int(duration)
+    event = {
+        "timestamp": datetime.utcnow(),
+        "status": twilio_status,
+        "callSid": call_sid,
+        "duration": int(duration) if duration else None
+    }
+    
+    order = await request.app.call_history.record_event(
+        store_id,
+        order_number,
+        call_sid,
+        summary,
+        event,
+        int(sequence) if sequence else None,
+        new_attempt=twilio_status in NEW_CALL_STATUSES
+    )
+    if not order:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found"
+        )
+    
+    # Only the callback that ends the order's current call retries it; stale and repeated ones find it no longer calling
+    if twilio_status in RETRY_CALL_STATUSES and order.get("callStatus") == "calling" and order.get("status") == "pending":
+        await request.app.retry_scheduler.schedule_next(order)
+    metrics.incr("voice.status_callbacks")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.post("/{store_id}/handle-input/{order_number}")
 async def handle_ivr_input(
+    store_id: str,
     order_number: str,
     request: Request,
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Response:
     """Handle IVR input from customer"""
-    # Get form data
+    # Get form data; only Twilio may record an answer, since it changes the order and Shopify
     form_data = await request.form()
+    verify_twilio_request(request, dict(form_data))
     digit = form_data.get("Digits")
     
     if not digit:
@@ -37,8 +128,20 @@ async def handle_ivr_input(
             detail="No input received"
         )
     
-    # Get order from database
-    order = await db.get_order_by_number(order_number)
+    # Update order status based on input; other digits only need the order to exist
+    if digit in DIGIT_STATUSES:
+        order = await db.update_order_by_number(
+            store_id,
+            order_number,
+            {"status": DIGIT_STATUSES[digit]},
+            projection={"campaignId": 1, "shopifyOrderId": 1, **ORDER_STATS_PROJECTION},
+            return_previous=True
+        )
+        await request.app.order_stats.record_change(order, {"status": DIGIT_STATUSES[digit]})
+        if order:
+            await request.app.shopify_writeback.enqueue(order, DIGIT_STATUSES[digit])
+    else:
+        order = await db.get_order_by_number(store_id, order_number, ID_PROJECTION)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -46,22 +149,18 @@ async def handle_ivr_input(
         )
     
     # Handle input
-    response = voice_service.handle_input(order_number, digit)
+    response = twiml.render_input(order_number, store_id, digit)
     
-    # Update order status based on input
-    if digit == "1":  # Confirm order
-        await db.update_order(order["id"], {"status": "confirmed"})
-    elif digit == "0":  # Cancel order
-        await db.update_order(order["id"], {"status": "cancelled"})
-    elif digit == "2":  # Support
-        await db.update_order(order["id"], {"status": "support"})
+    # Count the answer towards the campaign that dialed it
+    if order.get("campaignId") and digit in DIGIT_STATUSES:
+        await request.app.campaigns.record_outcome(order["campaignId"], digit)
     
     return Response(content=response, media_type="application/xml")
 
 @router.get("/settings")
 async def get_voice_settings(
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Any:
     """Get voice settings for the store"""
     if not current_user.store_id:
@@ -70,7 +169,7 @@ async def get_voice_settings(
             detail="No store connected"
         )
     
-    store = await db.get_store(current_user.store_id)
+    store = await db.get_store(current_user.store_id, {"voiceSettings": 1})
     if not store:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -83,7 +182,7 @@ async def get_voice_settings(
 async def update_voice_settings(
     settings: Dict[str, Any],
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Any:
     """Update voice settings for the store"""
     if not current_user.store_id:
@@ -92,26 +191,26 @@ async def update_voice_settings(
             detail="No store connected"
         )
     
-    store = await db.get_store(current_user.store_id)
-    if not store:
+    # Update settings
+    updated_store = await db.update_store(
+        current_user.store_id,
+        {"voiceSettings": settings},
+        projection={"voiceSettings": 1}
+    )
+    if not updated_store:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Store not found"
         )
     
-    # Update settings
-    updated_store = await db.update_store(
-        store["id"],
-        {"voiceSettings": settings}
-    )
-    
     return updated_store["voiceSettings"]
 
 @router.post("/test")
 async def test_voice_call(
     phone_number: str,
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: Database = Depends()
+    db: Database = Depends(get_database)
 ) -> Any:
     """Test voice call with current settings"""
     if not current_user.store_id:
@@ -120,7 +219,7 @@ async def test_voice_call(
             detail="No store connected"
         )
     
-    store = await db.get_store(current_user.store_id)
+    store = await db.get_store(current_user.store_id, ID_PROJECTION)
     if not store:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -128,9 +227,10 @@ async def test_voice_call(
         )
     
     # Make test call
-    call_result = voice_service.make_call(
+    call_result = await request.app.dialer.dial(
         phone_number,
-        "TEST-ORDER"
+        "TEST-ORDER",
+        current_user.store_id
     )
     
     return call_result 
\ No newline at end of file
@@ -0,0 +1,43 @@
+from fastapi.responses import Response
+from pydantic import BaseModel
+from bson import ObjectId
+from typing import Dict, Any, List, Type
+from models import Order
+import orjson
+
+def _encode_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    """Encode documents as JSON; datetimes and enums are handled by orjson itself"""
+    return orjson.dumps(content, default=_encode_default)
+
+class DocumentResponse(Response):
+    """JSON response for documents read from MongoDB, bypassing response_model validation"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class DocumentSerializer:
+    """Shapes trusted MongoDB documents like a response model without validating them"""
+
+    def __init__(self, model: Type[BaseModel]):
+        # (document key, default) per field, in the model's order; aliases such as _id are the keys
+        self.fields = tuple(
+            (field.alias or name, None if field.is_required() or field.default_factory else field.default)
+            for name, field in model.model_fields.items()
+        )
+        self.projection = {key: 1 for key, _ in self.fields}
+
+    def shape(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Keep the model's fields, filling defaults for ones the document lacks"""
+        return {key: document.get(key, default) for key, default in self.fields}
+
+    def shape_many(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.shape(document) for document in documents]
+
+order_serializer = DocumentSerializer(Order)
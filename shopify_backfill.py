@@ -0,0 +1,233 @@
+from pymongo import ASCENDING, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta, timezone
+from database import Database
+from shopify_client import ShopifyClientPool
+from order_mapper import order_fields_from_payload, missing_order_fields
+from order_stats import OrderStats
+from models import Order
+from metrics import metrics
+import asyncio
+import socket
+import httpx
+import os
+
+# Backfill configuration
+BACKFILL_ORDER_STATUS = os.getenv("BACKFILL_ORDER_STATUS", "open")
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "250"))
+BACKFILL_MAX_RUNNING = int(os.getenv("BACKFILL_MAX_RUNNING", "4"))
+BACKFILL_POLL_INTERVAL = float(os.getenv("BACKFILL_POLL_INTERVAL", "30"))  # seconds
+BACKFILL_LEASE = int(os.getenv("BACKFILL_LEASE", "120"))  # seconds
+
+# An expired lease that any worker can take over
+LEASE_EXPIRED = datetime(1970, 1, 1)
+
+# Bulk write errors that mean another writer saved the order first
+DUPLICATE_KEY = 11000
+
+def shopify_created_at(data: Dict[str, Any]) -> Optional[datetime]:
+    """Get the order's creation time from Shopify as naive UTC"""
+    try:
+        return datetime.fromisoformat(data["created_at"]).astimezone(timezone.utc).replace(tzinfo=None)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class BackfillManager:
+    """Imports a shop's existing orders page by page, checkpointing after every page"""
+
+    def __init__(
+        self,
+        db: Database,
+        shopify_clients: ShopifyClientPool,
+        order_stats: OrderStats,
+        page_size: int = BACKFILL_PAGE_SIZE,
+        max_running: int = BACKFILL_MAX_RUNNING,
+        poll_interval: float = BACKFILL_POLL_INTERVAL,
+        lease: int = BACKFILL_LEASE
+    ):
+        self.db = db
+        self.shopify_clients = shopify_clients
+        self.order_stats = order_stats
+        # One checkpoint document per store, keyed by store id
+        self.jobs = db.db.shopify_backfills
+        self.page_size = page_size
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._runners: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._wake = asyncio.Event()
+
+    async def create_indexes(self):
+        await self.jobs.create_index([("state", ASCENDING), ("leaseUntil", ASCENDING)])
+
+    async def schedule(self, store_id: str, shop_domain: str) -> Dict[str, Any]:
+        """Start a backfill for a store from the first page, unless one is already running"""
+        now = datetime.utcnow()
+        try:
+            job = await self.jobs.find_one_and_update(
+                {"_id": store_id, "state": {"$ne": "running"}},
+                {"$set": {
+                    "shopDomain": shop_domain,
+                    "state": "running",
+                    "pageInfo": None,
+                    "lastOrderId": None,
+                    "pages": 0,
+                    "fetched": 0,
+                    "imported": 0,
+                    "skipped": 0,
+                    "error": None,
+                    "startedAt": now,
+                    "updatedAt": now,
+                    "completedAt": None,
+                    "leaseUntil": LEASE_EXPIRED
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Already running; the upsert could not match it
+            return await self.get(store_id)
+        self._wake.set()
+        return job
+
+    async def get(self, store_id: str) -> Optional[Dict[str, Any]]:
+        """Get a store's backfill progress"""
+        return await self.jobs.find_one({"_id": store_id})
+
+    async def import_page(self, store_id: str, orders: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Upsert a page of Shopify orders; orders already saved are left alone"""
+        requests = []
+        docs = []
+        for data in orders:
+            fields = order_fields_from_payload(data)
+            if missing_order_fields(fields):
+                continue
+            created_at = shopify_created_at(data)
+            if created_at:
+                fields["createdAt"] = created_at
+            doc = Order(storeId=store_id, **fields).dict(exclude={"id"})
+            # Imported orders are never dialed automatically
+            requests.append(UpdateOne({"shopifyOrderId": doc["shopifyOrderId"]}, {"$setOnInsert": doc}, upsert=True))
+            docs.append(doc)
+
+        upserted: List[int] = []
+        if requests:
+            try:
+                result = await self.db.orders.bulk_write(requests, ordered=False)
+                upserted = list(result.upserted_ids)
+            except BulkWriteError as e:
+                # A webhook can save the same order between our filter and upsert
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+                upserted = [item["index"] for item in e.details["upserted"]]
+        await self.order_stats.record_created_many(docs[index] for index in upserted)
+        return len(upserted), len(orders) - len(requests)
+
+    def start(self):
+        """Start acquiring backfills that need a worker"""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop acquiring backfills and wait for local runners to checkpoint"""
+        self._stopping.set()
+        self._wake.set()
+        if self._task:
+            await self._task
+        await asyncio.gather(*self._runners.values(), return_exceptions=True)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                await self._acquire_runners()
+            except Exception as e:
+                print(f"Error acquiring backfills: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire_runners(self):
+        # Take over running backfills whose worker lease expired, e.g. after a crash
+        for store_id in [store_id for store_id, task in self._runners.items() if task.done()]:
+            del self._runners[store_id]
+        while not self._stopping.is_set() and len(self._runners) < self.max_running:
+            now = datetime.utcnow()
+            job = await self.jobs.find_one_and_update(
+                {"state": "running", "leaseUntil": {"$lt": now}},
+                {"$set": {"runnerId": self.runner_id, "leaseUntil": now + timedelta(seconds=self.lease)}},
+                return_document=ReturnDocument.AFTER
+            )
+            if not job:
+                return
+            self._runners[job["_id"]] = asyncio.create_task(self._run_backfill(job))
+
+    async def _checkpoint(self, store_id: str, update: Dict[str, Any]) -> bool:
+        """Save progress and renew the lease; False if another worker took the backfill over"""
+        update.setdefault("$set", {}).update({
+            "updatedAt": datetime.utcnow(),
+            "leaseUntil": datetime.utcnow() + timedelta(seconds=self.lease)
+        })
+        result = await self.jobs.update_one({"_id": store_id, "runnerId": self.runner_id, "state": "running"}, update)
+        return result.matched_count == 1
+
+    async def _run_backfill(self, job: Dict[str, Any]):
+        store_id = job["_id"]
+        page_info, last_order_id = job.get("pageInfo"), job.get("lastOrderId")
+        try:
+            store = await self.db.get_store(store_id, {"shopifyDomain": 1, "accessToken": 1})
+            if not store:
+                await self._checkpoint(store_id, {"$set": {"state": "failed", "error": "Store not found"}})
+                return
+            client = await self.shopify_clients.get(store["shopifyDomain"], store["accessToken"])
+
+            while not self._stopping.is_set():
+                try:
+                    pages = client.iter_order_pages(BACKFILL_ORDER_STATUS, self.page_size, page_info, last_order_id)
+                    async for orders, next_page_info in pages:
+                        imported, skipped = await self.import_page(store_id, orders)
+                        page_info = next_page_info
+                        if orders:
+                            last_order_id = orders[-1]["id"]
+                        metrics.incr("backfill.pages")
+                        metrics.incr("backfill.imported", imported)
+                        saved = await self._checkpoint(store_id, {
+                            "$set": {"pageInfo": page_info, "lastOrderId": last_order_id},
+                            "$inc": {"pages": 1, "fetched": len(orders), "imported": imported, "skipped": skipped}
+                        })
+                        if not saved or self._stopping.is_set():
+                            await pages.aclose()
+                            return
+                    await self._checkpoint(store_id, {"$set": {"state": "completed", "completedAt": datetime.utcnow()}})
+                    return
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 429:
+                        await asyncio.sleep(float(e.response.headers.get("Retry-After", "2")))
+                    elif e.response.status_code == 400 and page_info:
+                        # Expired cursor; continue from the last imported order instead
+                        page_info = None
+                    else:
+                        raise
+        except Exception as e:
+            print(f"Error backfilling store {store_id}: {str(e)}")
+            await self._checkpoint(store_id, {"$set": {"state": "failed", "error": str(e)}})
+        finally:
+            # Let another worker resume right away if the backfill is still running
+            await self.jobs.update_one(
+                {"_id": store_id, "runnerId": self.runner_id, "state": "running"},
+                {"$set": {"leaseUntil": LEASE_EXPIRED}}
+            )
+            self._wake.set()
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get local runner count and page counters"""
+        return {
+            "running": len([task for task in self._runners.values() if not task.done()]),
+            "pages": metrics.get("backfill.pages"),
+            "imported": metrics.get("backfill.imported")
+        }
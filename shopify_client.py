@@ -0,0 +1,255 @@
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator
+from urllib.parse import urlparse, parse_qs
+from shopify_governor import ShopifyGovernor, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+import asyncio
+import httpx
+import os
+import time
+
+# Shopify client pool configuration
+SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
+SHOPIFY_POOL_MAX_SHOPS = int(os.getenv("SHOPIFY_POOL_MAX_SHOPS", "200"))
+SHOPIFY_POOL_IDLE_TIMEOUT = int(os.getenv("SHOPIFY_POOL_IDLE_TIMEOUT", "300"))  # seconds
+SHOPIFY_MAX_CONNECTIONS_PER_SHOP = int(os.getenv("SHOPIFY_MAX_CONNECTIONS_PER_SHOP", "10"))
+SHOPIFY_REQUEST_TIMEOUT = float(os.getenv("SHOPIFY_REQUEST_TIMEOUT", "10"))  # seconds
+SHOPIFY_THROTTLE_RETRIES = int(os.getenv("SHOPIFY_THROTTLE_RETRIES", "3"))
+
+# Order fields requested when paging; enough for order_mapper and nothing else
+ORDER_PAGE_FIELDS = "id,order_number,name,total_price,phone,customer,billing_address,shipping_address,created_at"
+
+def next_page_info(response: httpx.Response) -> Optional[str]:
+    """Get the page_info cursor of the next page from the Link header"""
+    link = response.links.get("next")
+    if not link:
+        return None
+    return parse_qs(urlparse(link["url"]).query).get("page_info", [None])[0]
+
+class ShopifyClient:
+    """Async Shopify Admin REST client with a keep-alive connection pool for one shop"""
+
+    def __init__(
+        self,
+        shop_url: str,
+        access_token: str,
+        api_version: str = SHOPIFY_API_VERSION,
+        governor: Optional[ShopifyGovernor] = None
+    ):
+        self.shop_url = shop_url
+        self.access_token = access_token
+        self.api_version = api_version
+        self.governor = governor
+        self.http = httpx.AsyncClient(
+            base_url=f"https://{shop_url}/admin/api/{api_version}",
+            headers={"X-Shopify-Access-Token": access_token},
+            limits=httpx.Limits(
+                max_connections=SHOPIFY_MAX_CONNECTIONS_PER_SHOP,
+                max_keepalive_connections=SHOPIFY_MAX_CONNECTIONS_PER_SHOP
+            ),
+            timeout=SHOPIFY_REQUEST_TIMEOUT
+        )
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.closing = False
+
+    async def request(self, method: str, path: str, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> httpx.Response:
+        """Send a request to the shop's Admin API within its rate limit, retrying when throttled"""
+        self.in_flight += 1
+        self.last_used = time.monotonic()
+        try:
+            for attempt in range(SHOPIFY_THROTTLE_RETRIES + 1):
+                if self.governor:
+                    await self.governor.acquire(self.shop_url, priority)
+                response = await self.http.request(method, path, **kwargs)
+                if self.governor:
+                    self.governor.observe(self.shop_url, response.status_code, response.headers)
+                # The governor holds the next attempt back until Retry-After has passed
+                if response.status_code != 429 or not self.governor:
+                    break
+            response.raise_for_status()
+            return response
+        finally:
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+            if self.closing and self.in_flight == 0:
+                await self.http.aclose()
+
+    async def aclose(self):
+        """Close the connection pool once in-flight requests finish"""
+        self.closing = True
+        if self.in_flight == 0:
+            await self.http.aclose()
+
+    async def get_shop_info(self) -> Dict[str, Any]:
+        """Get shop information"""
+        response = await self.request("GET", "/shop.json")
+        shop = response.json()["shop"]
+        return {
+            "id": shop["id"],
+            "name": shop["name"],
+            "email": shop["email"],
+            "domain": shop["domain"],
+            "plan_name": shop["plan_name"],
+            "myshopify_domain": shop["myshopify_domain"]
+        }
+
+    async def get_order(self, order_id: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict[str, Any]]:
+        """Get order details in the same shape as the order webhook payload, or None if it is gone"""
+        # Anything but a missing order propagates, so callers retry instead of losing the order
+        try:
+            response = await self.request("GET", f"/orders/{order_id}.json", priority)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+        return response.json()["order"]
+
+    async def iter_order_pages(
+        self,
+        status: str = "any",
+        page_size: int = 250,
+        page_info: Optional[str] = None,
+        since_id: Optional[int] = None,
+        priority: int = PRIORITY_BACKGROUND
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """Yield pages of orders in id order, each with the page_info cursor of the page after it"""
+        # A page_info cursor carries the original filters; Shopify rejects them alongside it
+        params: Dict[str, Any] = {"limit": page_size, "fields": ORDER_PAGE_FIELDS}
+        if page_info:
+            params["page_info"] = page_info
+        else:
+            params.update(status=status, order="id asc", since_id=since_id or 0)
+        while True:
+            response = await self.request("GET", "/orders.json", priority, params=params)
+            page_info = next_page_info(response)
+            yield response.json()["orders"], page_info
+            if not page_info:
+                return
+            params = {"limit": page_size, "fields": ORDER_PAGE_FIELDS, "page_info": page_info}
+
+    async def graphql(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> Dict[str, Any]:
+        """Run a GraphQL Admin API document and return the whole body, errors and cost included"""
+        response = await self.request("POST", "/graphql.json", priority, json={"query": query, "variables": variables or {}})
+        return response.json()
+
+    async def create_webhook(self, topic: str, address: str) -> Dict[str, Any]:
+        """Create webhook"""
+        response = await self.request("POST", "/webhooks.json", json={
+            "webhook": {"topic": topic, "address": address, "format": "json"}
+        })
+        webhook = response.json()["webhook"]
+        return {
+            "id": webhook["id"],
+            "topic": webhook["topic"],
+            "address": webhook["address"],
+            "format": webhook["format"]
+        }
+
+    async def delete_webhook(self, webhook_id: str) -> bool:
+        """Delete webhook"""
+        try:
+            await self.request("DELETE", f"/webhooks/{webhook_id}.json")
+            return True
+        except Exception as e:
+            print(f"Error deleting webhook: {str(e)}")
+            return False
+
+    async def get_webhooks(self) -> List[Dict[str, Any]]:
+        """Get all webhooks"""
+        response = await self.request("GET", "/webhooks.json")
+        return [{
+            "id": webhook["id"],
+            "topic": webhook["topic"],
+            "address": webhook["address"],
+            "format": webhook["format"]
+        } for webhook in response.json()["webhooks"]]
+
+    async def update_order(self, order_id: str, fields: Dict[str, Any]) -> bool:
+        """Update order fields"""
+        try:
+            await self.request("PUT", f"/orders/{order_id}.json", json={
+                "order": {"id": order_id, **fields}
+            })
+            return True
+        except Exception as e:
+            print(f"Error updating order: {str(e)}")
+            return False
+
+    async def update_order_status(self, order_id: str, financial_status: str) -> bool:
+        """Update order status"""
+        return await self.update_order(order_id, {"financial_status": financial_status})
+
+class ShopifyClientPool:
+    """LRU of per-shop Shopify clients with idle eviction"""
+
+    def __init__(
+        self,
+        governor: Optional[ShopifyGovernor] = None,
+        max_shops: int = SHOPIFY_POOL_MAX_SHOPS,
+        idle_timeout: int = SHOPIFY_POOL_IDLE_TIMEOUT
+    ):
+        # One governor for every client, so all coroutines share each shop's budget
+        self.governor = governor
+        self.max_shops = max_shops
+        self.idle_timeout = idle_timeout
+        self._clients: "OrderedDict[str, ShopifyClient]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def get(self, shop_url: str, access_token: str) -> ShopifyClient:
+        """Get the pooled client for a shop, creating it if needed"""
+        async with self._lock:
+            evicted = self._evict_idle()
+            client = self._clients.get(shop_url)
+            if client and client.access_token != access_token:
+                # The shop was reinstalled with a new token
+                evicted.append(self._clients.pop(shop_url))
+                client = None
+            if client is None:
+                client = ShopifyClient(shop_url, access_token, governor=self.governor)
+                self._clients[shop_url] = client
+                while len(self._clients) > self.max_shops:
+                    evicted.append(self._clients.popitem(last=False)[1])
+            self._clients.move_to_end(shop_url)
+            client.last_used = time.monotonic()
+
+        for stale in evicted:
+            await stale.aclose()
+        return client
+
+    def _evict_idle(self) -> List[ShopifyClient]:
+        # Least recently used clients are at the front
+        evicted = []
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._clients:
+            shop_url, client = next(iter(self._clients.items()))
+            if client.last_used > cutoff or client.in_flight:
+                break
+            evicted.append(self._clients.pop(shop_url))
+        return evicted
+
+    async def evict_idle(self):
+        """Close clients that have been idle longer than the idle timeout"""
+        async with self._lock:
+            evicted = self._evict_idle()
+        for client in evicted:
+            await client.aclose()
+
+    async def close(self):
+        """Close all pooled clients"""
+        async with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get pooled shop and in-flight request counts"""
+        return {
+            "shops": len(self._clients),
+            "in_flight": sum(client.in_flight for client in self._clients.values())
+        }
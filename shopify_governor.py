@@ -0,0 +1,215 @@
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta
+from database import Database
+from metrics import metrics
+import heapq
+import asyncio
+import itertools
+import time
+import os
+
+# Shopify rate-limit governor configuration
+SHOPIFY_BUCKET_SIZE = int(os.getenv("SHOPIFY_BUCKET_SIZE", "40"))  # until the shop reports its own
+SHOPIFY_BUCKET_RESERVE = int(os.getenv("SHOPIFY_BUCKET_RESERVE", "5"))  # calls kept free of background work
+SHOPIFY_GOVERNOR_SHARED = os.getenv("SHOPIFY_GOVERNOR_SHARED", "false").lower() == "true"
+SHOPIFY_GOVERNOR_SYNC_INTERVAL = float(os.getenv("SHOPIFY_GOVERNOR_SYNC_INTERVAL", "0.5"))  # seconds
+SHOPIFY_GOVERNOR_IDLE_TIMEOUT = int(os.getenv("SHOPIFY_GOVERNOR_IDLE_TIMEOUT", "600"))  # seconds
+
+# Call priorities, most urgent first
+PRIORITY_WEBHOOK = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BACKGROUND = 2
+
+# Shopify leaks this share of the bucket per second (2 of 40, 20 of 400 on Plus)
+LEAK_FRACTION = 0.05
+
+def parse_call_limit(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse X-Shopify-Shop-Api-Call-Limit, e.g. "32/40" -> (32, 40)"""
+    try:
+        used, size = value.split("/")
+        return int(used), int(size)
+    except (AttributeError, ValueError):
+        return None
+
+class ShopBucket:
+    """Local estimate of one shop's leaky bucket, corrected by every response"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+        self.blocked_until = 0.0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.dispatcher: Optional[asyncio.Task] = None
+        # Set when a waiter arrives, so a more urgent call does not sleep behind a background one
+        self.wake = asyncio.Event()
+        self.synced = 0.0
+        self.throttled = 0
+
+    @property
+    def leak_rate(self) -> float:
+        return self.size * LEAK_FRACTION
+
+    def leak(self, now: float) -> None:
+        self.level = max(0.0, self.level - (now - self.updated) * self.leak_rate)
+        self.updated = now
+
+    def limit(self, priority: int, reserve: int) -> float:
+        """Level a call of this priority may fill the bucket up to"""
+        return self.size - (reserve if priority >= PRIORITY_BACKGROUND else 0)
+
+class ShopifyGovernor:
+    """Per-shop leaky-bucket admission for Shopify Admin API calls, shared by every client in the process"""
+
+    def __init__(
+        self,
+        database: Optional[Database] = None,
+        bucket_size: int = SHOPIFY_BUCKET_SIZE,
+        reserve: int = SHOPIFY_BUCKET_RESERVE,
+        sync_interval: float = SHOPIFY_GOVERNOR_SYNC_INTERVAL,
+        idle_timeout: int = SHOPIFY_GOVERNOR_IDLE_TIMEOUT
+    ):
+        # With a database, bucket levels are shared with other workers through MongoDB
+        self.limits = database.db.shopify_rate_limits if database is not None else None
+        self.bucket_size = bucket_size
+        self.reserve = reserve
+        self.sync_interval = sync_interval
+        self.idle_timeout = idle_timeout
+        self._buckets: Dict[str, ShopBucket] = {}
+        self._sequence = itertools.count()
+
+    async def create_indexes(self):
+        if self.limits is not None:
+            # Shops nobody has called for a while fall out of the shared state
+            await self.limits.create_index("updatedAt", expireAfterSeconds=self.idle_timeout)
+
+    def _bucket(self, shop: str) -> ShopBucket:
+        bucket = self._buckets.get(shop)
+        if bucket is None:
+            bucket = self._buckets[shop] = ShopBucket(self.bucket_size)
+        return bucket
+
+    async def acquire(self, shop: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait until the shop's bucket has room for one call; lower priorities wait longer"""
+        bucket = self._bucket(shop)
+        bucket.last_used = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(bucket.waiters, (priority, next(self._sequence), future))
+        bucket.wake.set()
+        if bucket.dispatcher is None or bucket.dispatcher.done():
+            bucket.dispatcher = asyncio.create_task(self._dispatch(shop, bucket))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as we were cancelled; give the slot back
+                bucket.level = max(0.0, bucket.level - 1)
+            raise
+
+    async def _dispatch(self, shop: str, bucket: ShopBucket) -> None:
+        # One dispatcher per shop admits waiters in priority order as the bucket drains
+        while bucket.waiters:
+            if self.limits is not None:
+                await self._sync(shop, bucket)
+            priority, _, future = bucket.waiters[0]
+            if future.cancelled():
+                heapq.heappop(bucket.waiters)
+                continue
+            now = time.monotonic()
+            bucket.leak(now)
+            if now < bucket.blocked_until:
+                await self._sleep(bucket, bucket.blocked_until - now)
+                continue
+            limit = bucket.limit(priority, self.reserve)
+            if bucket.level + 1 > limit:
+                await self._sleep(bucket, (bucket.level + 1 - limit) / bucket.leak_rate)
+                continue
+            heapq.heappop(bucket.waiters)
+            bucket.level += 1
+            future.set_result(None)
+
+    @staticmethod
+    async def _sleep(bucket: ShopBucket, delay: float) -> None:
+        bucket.wake.clear()
+        try:
+            await asyncio.wait_for(bucket.wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def observe(self, shop: str, status_code: int, headers: Any) -> None:
+        """Correct the estimate from a response's call-limit and Retry-After headers"""
+        bucket = self._bucket(shop)
+        now = time.monotonic()
+        bucket.leak(now)
+        bucket.last_used = now
+        reported = parse_call_limit(headers.get("X-Shopify-Shop-Api-Call-Limit"))
+        if reported:
+            used, bucket.size = reported
+            # Calls admitted after this one was answered are still on their way
+            bucket.level = min(max(bucket.level, float(used)), float(bucket.size))
+        if status_code == 429:
+            retry_after = float(headers.get("Retry-After") or 1 / bucket.leak_rate)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            bucket.level = float(bucket.size)
+            bucket.throttled += 1
+            metrics.incr("shopify.throttled")
+        if self.limits is not None and (reported or status_code == 429):
+            asyncio.get_running_loop().create_task(self._publish(shop, bucket, now))
+
+    async def _sync(self, shop: str, bucket: ShopBucket) -> None:
+        # Take the fuller of our estimate and what other workers last saw
+        now = time.monotonic()
+        if now - bucket.synced < self.sync_interval:
+            return
+        bucket.synced = now
+        try:
+            shared = await self.limits.find_one({"_id": shop})
+        except Exception as e:
+            print(f"Error reading Shopify rate limit: {str(e)}")
+            return
+        if not shared:
+            return
+        age = (datetime.utcnow() - shared["updatedAt"]).total_seconds()
+        bucket.leak(time.monotonic())
+        bucket.size = shared.get("size", bucket.size)
+        bucket.level = min(max(bucket.level, shared["level"] - age * bucket.leak_rate), float(bucket.size))
+        if shared.get("blockedUntil"):
+            remaining = (shared["blockedUntil"] - datetime.utcnow()).total_seconds()
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + remaining)
+
+    async def _publish(self, shop: str, bucket: ShopBucket, now: float) -> None:
+        blocked = bucket.blocked_until - now
+        update: Dict[str, Any] = {"level": bucket.level, "size": bucket.size, "updatedAt": datetime.utcnow()}
+        if blocked > 0:
+            update["blockedUntil"] = datetime.utcnow() + timedelta(seconds=blocked)
+        try:
+            await self.limits.update_one({"_id": shop}, {"$set": update}, upsert=True)
+        except Exception as e:
+            print(f"Error sharing Shopify rate limit: {str(e)}")
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        for shop, bucket in list(self._buckets.items()):
+            bucket.leak(now)
+            if not bucket.waiters and bucket.level == 0 and now - bucket.last_used > self.idle_timeout:
+                del self._buckets[shop]
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get per-shop bucket utilisation and queue depth"""
+        self._evict_idle()
+        shops = {
+            shop: {
+                "utilisation": round(bucket.level / bucket.size, 3),
+                "level": round(bucket.level, 1),
+                "size": bucket.size,
+                "waiting": len(bucket.waiters),
+                "throttled": bucket.throttled
+            }
+            for shop, bucket in self._buckets.items()
+        }
+        return {
+            "shops": shops,
+            "waiting": sum(shop["waiting"] for shop in shops.values()),
+            "throttled": metrics.get("shopify.throttled")
+        }
@@ -0,0 +1,294 @@
+from pymongo import ASCENDING
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta
+from database import Database
+from shopify_client import ShopifyClientPool
+from shopify_governor import PRIORITY_BACKGROUND
+from metrics import metrics
+import asyncio
+import httpx
+import time
+import uuid
+import os
+
+# Shopify write-back configuration
+WRITEBACK_BATCH_SIZE = int(os.getenv("WRITEBACK_BATCH_SIZE", "25"))  # orders per GraphQL document
+WRITEBACK_MAX_SHOPS = int(os.getenv("WRITEBACK_MAX_SHOPS", "8"))  # shops pushed concurrently
+WRITEBACK_POLL_INTERVAL = float(os.getenv("WRITEBACK_POLL_INTERVAL", "10"))  # seconds
+WRITEBACK_CLAIM_LEASE = int(os.getenv("WRITEBACK_CLAIM_LEASE", "120"))  # seconds
+WRITEBACK_MAX_ATTEMPTS = int(os.getenv("WRITEBACK_MAX_ATTEMPTS", "5"))
+WRITEBACK_RETENTION = int(os.getenv("WRITEBACK_RETENTION", "604800"))  # seconds synced outcomes are kept
+WRITEBACK_CONFIRMED_TAG = os.getenv("WRITEBACK_CONFIRMED_TAG", "cod-confirmed")
+WRITEBACK_CANCELLED_TAG = os.getenv("WRITEBACK_CANCELLED_TAG", "cod-cancelled")
+# orderCancel needs SHOPIFY_API_VERSION 2024-04 or later
+WRITEBACK_CANCEL_ORDERS = os.getenv("WRITEBACK_CANCEL_ORDERS", "false").lower() == "true"
+
+# Order statuses that are written back to Shopify
+OUTCOMES = ("confirmed", "cancelled")
+
+TAGS_ADD = "{alias}: tagsAdd(id: $id{index}, tags: ${outcome}) {{ userErrors {{ field message }} }}"
+TAGS_REMOVE = "{alias}: tagsRemove(id: $id{index}, tags: ${outcome}) {{ userErrors {{ field message }} }}"
+ORDER_CANCEL = (
+    "{alias}: orderCancel(orderId: $id{index}, reason: CUSTOMER, refund: false, restock: true, notifyCustomer: false) "
+    "{{ orderCancelUserErrors {{ field message }} }}"
+)
+
+def build_mutation(jobs: List[Dict[str, Any]], cancel_orders: bool = WRITEBACK_CANCEL_ORDERS) -> Tuple[str, Dict[str, Any], Dict[str, List[str]]]:
+    """Build one GraphQL document for a batch; returns it with its variables and each order's aliases"""
+    tags = {"confirmed": [WRITEBACK_CONFIRMED_TAG], "cancelled": [WRITEBACK_CANCELLED_TAG]}
+    # An order whose outcome changed carries only the tag of the latest one
+    opposite = {"confirmed": "cancelled", "cancelled": "confirmed"}
+    fields: List[str] = []
+    variables: Dict[str, Any] = {}
+    aliases: Dict[str, List[str]] = {}
+    for index, job in enumerate(jobs):
+        removed = opposite[job["outcome"]]
+        variables[job["outcome"]] = tags[job["outcome"]]
+        variables[removed] = tags[removed]
+        variables[f"id{index}"] = f"gid://shopify/Order/{job['shopifyOrderId']}"
+        aliases[job["_id"]] = [f"t{index}", f"r{index}"]
+        fields.append(TAGS_ADD.format(alias=f"t{index}", index=index, outcome=job["outcome"]))
+        fields.append(TAGS_REMOVE.format(alias=f"r{index}", index=index, outcome=removed))
+        if cancel_orders and job["outcome"] == "cancelled":
+            aliases[job["_id"]].append(f"c{index}")
+            fields.append(ORDER_CANCEL.format(alias=f"c{index}", index=index))
+    # GraphQL rejects declared variables that no field uses
+    arguments = ", ".join([f"${outcome}: [String!]!" for outcome in tags if outcome in variables] + [f"$id{index}: ID!" for index in range(len(jobs))])
+    document = f"mutation WriteBack({arguments}) {{\n  " + "\n  ".join(fields) + "\n}"
+    return document, variables, aliases
+
+def user_errors(result: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not result:
+        return []
+    return result.get("userErrors") or result.get("orderCancelUserErrors") or []
+
+class ShopifyWriteback:
+    """Pushes confirmed and cancelled call outcomes to Shopify, batched per shop into GraphQL documents"""
+
+    def __init__(
+        self,
+        db: Database,
+        shopify_clients: ShopifyClientPool,
+        batch_size: int = WRITEBACK_BATCH_SIZE,
+        max_shops: int = WRITEBACK_MAX_SHOPS,
+        poll_interval: float = WRITEBACK_POLL_INTERVAL,
+        claim_lease: int = WRITEBACK_CLAIM_LEASE,
+        max_attempts: int = WRITEBACK_MAX_ATTEMPTS
+    ):
+        self.db = db
+        self.shopify_clients = shopify_clients
+        # One reconciliation document per order, keyed by order id
+        self.jobs = db.db.shopify_writebacks
+        self.batch_size = batch_size
+        self.max_shops = max_shops
+        self.poll_interval = poll_interval
+        self.claim_lease = claim_lease
+        self.max_attempts = max_attempts
+        # Stores whose GraphQL cost budget is refilling, until this monotonic time
+        self._cooldown: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def create_indexes(self):
+        await self.jobs.create_index([("state", ASCENDING), ("nextAttemptAt", ASCENDING)])
+        await self.jobs.create_index([("storeId", ASCENDING), ("state", ASCENDING)])
+        await self.jobs.create_index("claimToken", sparse=True)
+        # Only synced outcomes carry syncedAt, so failed ones stay until they are retried
+        await self.jobs.create_index("syncedAt", expireAfterSeconds=WRITEBACK_RETENTION)
+
+    async def enqueue(self, order: Dict[str, Any], outcome: str) -> None:
+        """Queue an order's latest outcome; a newer outcome replaces one not yet pushed"""
+        if outcome not in OUTCOMES or not order.get("shopifyOrderId"):
+            return
+        now = datetime.utcnow()
+        await self.jobs.update_one(
+            {"_id": str(order["_id"])},
+            {
+                "$set": {
+                    "storeId": order["storeId"],
+                    "shopifyOrderId": order["shopifyOrderId"],
+                    "outcome": outcome,
+                    "state": "pending",
+                    "attempts": 0,
+                    "nextAttemptAt": now,
+                    "claimToken": None,
+                    "lastError": None,
+                    "updatedAt": now
+                },
+                "$setOnInsert": {"createdAt": now},
+                "$unset": {"syncedAt": ""}
+            },
+            upsert=True
+        )
+        metrics.incr("writeback.enqueued")
+
+    async def list_outcomes(self, store_id: str, state: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Get a store's write-back states, most recently changed first"""
+        query: Dict[str, Any] = {"storeId": store_id}
+        if state:
+            query["state"] = state
+        return await self.jobs.find(query).sort("updatedAt", -1).limit(limit).to_list(length=limit)
+
+    async def retry_failed(self, store_id: str) -> int:
+        """Queue a store's failed write-backs again"""
+        result = await self.jobs.update_many(
+            {"storeId": store_id, "state": "failed"},
+            {"$set": {"state": "pending", "attempts": 0, "nextAttemptAt": datetime.utcnow(), "claimToken": None}}
+        )
+        return result.modified_count
+
+    async def claim_due(self, exclude: List[str]) -> List[Dict[str, Any]]:
+        """Atomically claim a batch of due outcomes, all for the same store"""
+        now = datetime.utcnow()
+        due = {"state": "pending", "nextAttemptAt": {"$lte": now}}
+        first = await self.jobs.find_one({**due, "storeId": {"$nin": exclude}}, {"storeId": 1}, sort=[("nextAttemptAt", ASCENDING)])
+        if not first:
+            return []
+        cursor = self.jobs.find({**due, "storeId": first["storeId"]}, {"_id": 1}).sort("nextAttemptAt", ASCENDING).limit(self.batch_size)
+        ids = [job["_id"] async for job in cursor]
+
+        # Same claim as the retry scheduler: the pushed-back nextAttemptAt is the lease
+        token = uuid.uuid4().hex
+        await self.jobs.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"claimToken": token, "nextAttemptAt": now + timedelta(seconds=self.claim_lease)}}
+        )
+        return await self.jobs.find({"claimToken": token}).to_list(length=self.batch_size)
+
+    async def run_once(self) -> int:
+        """Claim one batch for each of up to max_shops stores and push them concurrently"""
+        now = time.monotonic()
+        for store_id in [store_id for store_id, until in self._cooldown.items() if until <= now]:
+            del self._cooldown[store_id]
+        exclude = list(self._cooldown)
+        batches = []
+        while len(batches) < self.max_shops:
+            jobs = await self.claim_due(exclude)
+            if not jobs:
+                break
+            exclude.append(jobs[0]["storeId"])
+            batches.append(jobs)
+
+        results = await asyncio.gather(*(self._push(jobs) for jobs in batches), return_exceptions=True)
+        for jobs, result in zip(batches, results):
+            if isinstance(result, Exception):
+                print(f"Error writing back outcomes for store {jobs[0]['storeId']}: {str(result)}")
+                await self._release(jobs, str(result))
+        return max((len(jobs) for jobs in batches), default=0)
+
+    async def _push(self, jobs: List[Dict[str, Any]]) -> None:
+        store_id = jobs[0]["storeId"]
+        store = await self.db.get_store(store_id, {"shopifyDomain": 1, "accessToken": 1})
+        if not store:
+            await self._finish(jobs, {job["_id"]: "Store not found" for job in jobs})
+            return
+        client = await self.shopify_clients.get(store["shopifyDomain"], store["accessToken"])
+        document, variables, aliases = build_mutation(jobs)
+
+        try:
+            body = await client.graphql(document, variables, PRIORITY_BACKGROUND)
+        except httpx.HTTPStatusError as e:
+            if 400 <= e.response.status_code < 500 and e.response.status_code != 429:
+                # Bad token or scopes; retrying the same document will not help
+                await self._finish(jobs, {job["_id"]: str(e) for job in jobs})
+                return
+            raise
+        metrics.incr("writeback.requests")
+        self._pace(store_id, body)
+
+        data = body.get("data") or {}
+        errors = body.get("errors") or []
+        if any((error.get("extensions") or {}).get("code") == "THROTTLED" for error in errors):
+            # Nothing in the document ran; try again once the budget has refilled
+            await self._release(jobs, "Throttled", count_attempt=False)
+            return
+        if not data:
+            raise RuntimeError("; ".join(error.get("message", "") for error in errors) or "Empty GraphQL response")
+
+        failures = {}
+        for job in jobs:
+            messages = [
+                error["message"]
+                for alias in aliases[job["_id"]]
+                for error in user_errors(data.get(alias)) + [error for error in errors if alias in (error.get("path") or [])]
+            ]
+            if messages:
+                failures[job["_id"]] = "; ".join(messages)
+        await self._finish(jobs, failures)
+
+    def _pace(self, store_id: str, body: Dict[str, Any]) -> None:
+        # GraphQL has its own cost bucket; hold the store back until the next document can afford it
+        cost = (body.get("extensions") or {}).get("cost") or {}
+        throttle = cost.get("throttleStatus") or {}
+        if not throttle.get("restoreRate"):
+            return
+        deficit = cost.get("requestedQueryCost", 0) - throttle.get("currentlyAvailable", 0)
+        if deficit > 0:
+            self._cooldown[store_id] = time.monotonic() + deficit / throttle["restoreRate"]
+
+    async def _finish(self, jobs: List[Dict[str, Any]], failures: Dict[str, str]) -> None:
+        """Record each order's result; user errors are permanent and need a merchant to look"""
+        now = datetime.utcnow()
+        for job in jobs:
+            if job["_id"] in failures:
+                update = {"state": "failed", "lastError": failures[job["_id"]], "updatedAt": now}
+                metrics.incr("writeback.failed")
+            else:
+                update = {"state": "synced", "syncedAt": now, "lastError": None, "updatedAt": now}
+                metrics.incr("writeback.synced")
+            # A newer outcome clears the claim token, so it is pushed again rather than marked synced
+            await self.jobs.update_one(
+                {"_id": job["_id"], "claimToken": job["claimToken"]},
+                {"$set": {**update, "claimToken": None}, "$inc": {"attempts": 1}}
+            )
+
+    async def _release(self, jobs: List[Dict[str, Any]], error: str, count_attempt: bool = True) -> None:
+        """Put a batch back with backoff, or fail it once it is out of attempts"""
+        now = datetime.utcnow()
+        for job in jobs:
+            attempts = job["attempts"] + (1 if count_attempt else 0)
+            update: Dict[str, Any] = {"attempts": attempts, "lastError": error, "claimToken": None, "updatedAt": now}
+            if attempts >= self.max_attempts:
+                update["state"] = "failed"
+                metrics.incr("writeback.failed")
+            else:
+                delay = min(self.poll_interval * 2 ** attempts, self.claim_lease * 10)
+                update["nextAttemptAt"] = now + timedelta(seconds=delay)
+                metrics.incr("writeback.retried")
+            await self.jobs.update_one({"_id": job["_id"], "claimToken": job["claimToken"]}, {"$set": update})
+
+    def start(self):
+        """Start pushing queued outcomes"""
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop pushing after the current batches"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                print(f"Error running Shopify write-back: {str(e)}")
+                claimed = 0
+
+            # Keep draining while full batches are due
+            if claimed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get pending and failed write-back counts"""
+        return {
+            "pending": await self.jobs.count_documents({"state": "pending"}),
+            "failed": await self.jobs.count_documents({"state": "failed"}),
+            "synced": metrics.get("writeback.synced"),
+            "requests": metrics.get("writeback.requests")
+        }
@@ -0,0 +1,151 @@
+from twilio.twiml.voice_response import VoiceResponse, Gather
+from xml.sax.saxutils import escape
+from typing import Dict, List, Tuple
+import os
+import re
+
+# Stand-ins for per-call values while templates are compiled
+ORDER_NUMBER_PLACEHOLDER = "__ORDER_NUMBER__"
+STORE_ID_PLACEHOLDER = "__STORE_ID__"
+PLACEHOLDER_SLOTS = {
+    ORDER_NUMBER_PLACEHOLDER.encode("utf-8"): "order_number",
+    STORE_ID_PLACEHOLDER.encode("utf-8"): "store_id"
+}
+PLACEHOLDER_PATTERN = re.compile(b"(" + b"|".join(re.escape(p) for p in PLACEHOLDER_SLOTS) + b")")
+XML_SPECIAL = re.compile(r'[&<>"]')
+
+DEFAULT_LANGUAGE = "ur"
+DEFAULT_PROMPT_VERSION = "v1"
+
+# Prompt text per (language, prompt version)
+PROMPTS: Dict[Tuple[str, str], Dict[str, str]] = {
+    ("ur", "v1"): {
+        "voice_language": "ur-PK",
+        "welcome": "آپ کا آرڈر نمبر {order_number} ہے۔ براہ کرم اپنے آرڈر کی تصدیق کے لیے 1 دبائیں۔ آرڈر منسوخ کرنے کے لیے 0 دبائیں۔ سپورٹ ٹیم سے بات کرنے کے لیے 2 دبائیں۔",
+        "confirmed": "آپ کے آرڈر کی تصدیق ہو گئی ہے۔ آپ کا شکریہ۔",
+        "cancelled": "آپ کا آرڈر منسوخ کر دیا گیا ہے۔",
+        "support": "آپ کو سپورٹ ٹیم سے جوڑا جا رہا ہے۔",
+        "invalid": "معذرت، یہ ایک غلط انپٹ ہے۔"
+    }
+}
+
+def build_welcome(
+    order_number: str,
+    store_id: str,
+    language: str = DEFAULT_LANGUAGE,
+    version: str = DEFAULT_PROMPT_VERSION
+) -> str:
+    """Generate TwiML for the IVR welcome prompt"""
+    prompts = PROMPTS[(language, version)]
+    response = VoiceResponse()
+
+    # Welcome message
+    response.say(
+        prompts["welcome"].format(order_number=order_number),
+        language=prompts["voice_language"]
+    )
+
+    # Gather user input
+    gather = Gather(
+        num_digits=1,
+        timeout=10,
+        action=f"/api/voice/{store_id}/handle-input/{order_number}",
+        method="POST"
+    )
+    response.append(gather)
+
+    # If no input is received, repeat the message
+    response.redirect(f"/api/voice/{store_id}/welcome/{order_number}")
+
+    return str(response)
+
+def build_input_response(
+    order_number: str,
+    store_id: str,
+    digit: str,
+    language: str = DEFAULT_LANGUAGE,
+    version: str = DEFAULT_PROMPT_VERSION
+) -> str:
+    """Generate TwiML answering an IVR digit"""
+    prompts = PROMPTS[(language, version)]
+    response = VoiceResponse()
+
+    if digit == "1":
+        # Order confirmed
+        response.say(prompts["confirmed"], language=prompts["voice_language"])
+    elif digit == "0":
+        # Order cancelled
+        response.say(prompts["cancelled"], language=prompts["voice_language"])
+    elif digit == "2":
+        # Transfer to support
+        response.say(prompts["support"], language=prompts["voice_language"])
+        response.dial(os.getenv("SUPPORT_PHONE_NUMBER"))
+    else:
+        # Invalid input
+        response.say(prompts["invalid"], language=prompts["voice_language"])
+        response.redirect(f"/api/voice/{store_id}/welcome/{order_number}")
+
+    return str(response)
+
+class TwimlTemplate:
+    """TwiML document precompiled to bytes with slots for per-call values"""
+
+    def __init__(self, rendered: str):
+        pieces = PLACEHOLDER_PATTERN.split(rendered.encode("utf-8"))
+        self.literals: List[bytes] = pieces[0::2]
+        self.slots: List[str] = [PLACEHOLDER_SLOTS[p] for p in pieces[1::2]]
+
+    def render(self, **values: str) -> bytes:
+        """Fill in the slots"""
+        if not self.slots:
+            return self.literals[0]
+        escaped = {}
+        for name, value in values.items():
+            if XML_SPECIAL.search(value):
+                value = escape(value, {'"': "&quot;"})
+            escaped[name] = value.encode("utf-8")
+        out = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            out.append(escaped[slot])
+            out.append(literal)
+        return b"".join(out)
+
+class TwimlTemplates:
+    """Precompiled IVR responses for every language and prompt version"""
+
+    def __init__(self):
+        self.welcome: Dict[Tuple[str, str], TwimlTemplate] = {}
+        self.inputs: Dict[Tuple[str, str], Dict[str, TwimlTemplate]] = {}
+        for key in PROMPTS:
+            language, version = key
+            self.welcome[key] = TwimlTemplate(
+                build_welcome(ORDER_NUMBER_PLACEHOLDER, STORE_ID_PLACEHOLDER, language, version)
+            )
+            self.inputs[key] = {
+                digit: TwimlTemplate(
+                    build_input_response(ORDER_NUMBER_PLACEHOLDER, STORE_ID_PLACEHOLDER, digit, language, version)
+                )
+                for digit in ("1", "0", "2", "invalid")
+            }
+
+    def render_welcome(
+        self,
+        order_number: str,
+        store_id: str,
+        language: str = DEFAULT_LANGUAGE,
+        version: str = DEFAULT_PROMPT_VERSION
+    ) -> bytes:
+        """Get the welcome prompt for an order"""
+        return self.welcome[(language, version)].render(order_number=order_number, store_id=store_id)
+
+    def render_input(
+        self,
+        order_number: str,
+        store_id: str,
+        digit: str,
+        language: str = DEFAULT_LANGUAGE,
+        version: str = DEFAULT_PROMPT_VERSION
+    ) -> bytes:
+        """Get the response to an IVR digit"""
+        templates = self.inputs[(language, version)]
+        return templates.get(digit, templates["invalid"]).render(order_number=order_number, store_id=store_id)
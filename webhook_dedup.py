@@ -0,0 +1,75 @@
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+from typing import Dict, Any
+from datetime import datetime
+from database import Database
+from metrics import metrics
+import os
+
+# Shopify retries failed deliveries for up to 48 hours
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", str(48 * 3600)))  # seconds
+WEBHOOK_DEDUP_LRU_SIZE = int(os.getenv("WEBHOOK_DEDUP_LRU_SIZE", "10000"))
+
+class WebhookDeduplicator:
+    """Recognise repeated Shopify deliveries by X-Shopify-Webhook-Id"""
+
+    def __init__(
+        self,
+        database: Database,
+        ttl: int = WEBHOOK_DEDUP_TTL,
+        lru_size: int = WEBHOOK_DEDUP_LRU_SIZE
+    ):
+        self.receipts = database.db.webhook_receipts
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+
+    async def create_indexes(self):
+        # Receipts expire once Shopify can no longer retry the delivery
+        await self.receipts.create_index("receivedAt", expireAfterSeconds=self.ttl)
+
+    def _remember(self, webhook_id: str) -> None:
+        self._recent[webhook_id] = None
+        self._recent.move_to_end(webhook_id)
+        if len(self._recent) > self.lru_size:
+            self._recent.popitem(last=False)
+
+    async def seen_before(self, webhook_id: str) -> bool:
+        """Report whether a delivery was already received"""
+        metrics.incr("webhooks.received")
+
+        # Fast path: retries usually land on the same worker within seconds
+        if webhook_id in self._recent:
+            self._recent.move_to_end(webhook_id)
+            metrics.incr("webhooks.duplicates")
+            metrics.incr("webhooks.dedup_lru_hits")
+            return True
+
+        if await self.receipts.find_one({"_id": webhook_id}, {"_id": 1}):
+            self._remember(webhook_id)
+            metrics.incr("webhooks.duplicates")
+            metrics.incr("webhooks.dedup_store_hits")
+            return True
+        return False
+
+    async def record(self, webhook_id: str) -> None:
+        """Record a delivery once it is safely queued, so that later retries are acknowledged"""
+        try:
+            await self.receipts.insert_one({"_id": webhook_id, "receivedAt": datetime.utcnow()})
+        except DuplicateKeyError:
+            # A concurrent retry of the same delivery was queued too; processing ignores the repeat
+            pass
+        self._remember(webhook_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Get duplicate and LRU hit rates"""
+        received = metrics.get("webhooks.received")
+        duplicates = metrics.get("webhooks.duplicates")
+        lru_hits = metrics.get("webhooks.dedup_lru_hits")
+        return {
+            "received": received,
+            "duplicates": duplicates,
+            "duplicate_rate": duplicates / received if received else 0.0,
+            "lru_hit_rate": lru_hits / duplicates if duplicates else 0.0,
+            "lru_size": len(self._recent)
+        }
@@ -0,0 +1,95 @@
+from pymongo.errors import DuplicateKeyError
+from typing import Dict, Any, Set
+from datetime import datetime
+from database import Database, new_dial_owner, dial_claim_fields, DIAL_CLAIM_FIELDS
+from shopify_client import ShopifyClientPool
+from shopify_governor import PRIORITY_WEBHOOK
+from dialer import Dialer, record_call_result
+from retry_scheduler import RetryScheduler
+from order_stats import OrderStats
+from order_mapper import order_fields_from_payload, missing_order_fields
+from models import Order
+from metrics import metrics
+import asyncio
+import orjson
+
+class WebhookProcessor:
+    """Process Shopify webhook deliveries claimed from the ingest queue"""
+
+    def __init__(
+        self,
+        db: Database,
+        dialer: Dialer,
+        shopify_clients: ShopifyClientPool,
+        retry_scheduler: RetryScheduler,
+        order_stats: OrderStats
+    ):
+        self.db = db
+        self.dialer = dialer
+        self.shopify_clients = shopify_clients
+        self.retry_scheduler = retry_scheduler
+        self.order_stats = order_stats
+        # First dials waiting for the dialer; the delivery is acknowledged once its call is queued
+        self._calls: Set[asyncio.Task] = set()
+
+    async def process(self, job: Dict[str, Any]) -> None:
+        """Dispatch a queued webhook to its topic handler"""
+        # The only parse of the delivery; the queue keeps the signed raw bytes
+        data = orjson.loads(job["payload"])
+        if job["topic"] == "orders/create":
+            await self.handle_order_created(job["shopDomain"], data)
+
+    async def handle_order_created(self, shop_domain: str, data: Dict[str, Any]) -> None:
+        """Save a new Shopify order and call the customer"""
+        # Get store from shop domain
+        store = await self.db.get_store_by_domain(shop_domain)
+        if not store:
+            return
+
+        # Build the order from the webhook payload; only refetch when it is incomplete
+        fields = order_fields_from_payload(data)
+        missing = missing_order_fields(fields)
+        if missing:
+            metrics.incr("orders.payload_fallback_fetch")
+            client = await self.shopify_clients.get(shop_domain, store["accessToken"])
+            fetched = await client.get_order(data["id"], PRIORITY_WEBHOOK)
+            if fetched:
+                fields = {**order_fields_from_payload(fetched), **fields}
+            missing = missing_order_fields(fields)
+            if missing:
+                raise ValueError(f"Order {data.get('id')} is missing {', '.join(missing)}")
+        else:
+            metrics.incr("orders.mapped_from_payload")
+        order = Order(storeId=str(store["_id"]), **fields)
+
+        # Save the order already claimed for its first dial; a duplicate means another delivery handled it
+        try:
+            owner = new_dial_owner()
+            saved = await self.db.create_order({**order.dict(exclude={"id"}), **dial_claim_fields(owner)})
+        except DuplicateKeyError:
+            metrics.incr("orders.duplicate_create")
+            return
+        await self.order_stats.record_created(saved)
+
+        # Queue the call; if this process dies before recording it, the dial claim expires and the order is retried
+        order_id = str(saved["_id"])
+        future = await self.dialer.submit(order.customerPhone, order.orderNumber, order.storeId, (order_id, owner))
+        task = asyncio.create_task(self._record_call(order_id, owner, store, future))
+        self._calls.add(task)
+        task.add_done_callback(self._calls.discard)
+
+    async def _record_call(self, order_id: str, owner: str, store: Dict[str, Any], future: asyncio.Future) -> None:
+        try:
+            call = await future
+        except Exception as e:
+            call = {"error": str(e), "status": "failed", "timestamp": datetime.utcnow()}
+        try:
+            await record_call_result(self.db, self.order_stats, order_id, call, unset=DIAL_CLAIM_FIELDS, owner=owner)
+            if call["status"] == "failed":
+                await self.retry_scheduler.schedule(order_id, store, attempt=1)
+        except Exception as e:
+            print(f"Error recording call for order {order_id}: {str(e)}")
+
+    async def stop(self):
+        """Wait for queued first dials to be recorded"""
+        await asyncio.gather(*self._calls, return_exceptions=True)